@@ -0,0 +1,187 @@
+import math
+
+import faiss
+import numpy as np
+
+'''
+FAISS 近似最近邻索引工厂
+支持 flat / ivf / hnsw / ivfpq 四种索引，统一使用内积度量，并通过 add_with_ids
+显式写入 int64 的 faiss_id（与 MongoDB 文档的 faiss_id 一一对应），检索结果直接返回 faiss_id。
+
+- flat:  精确搜索（IndexIDMap2 + IndexFlatIP），小语料默认选项
+- ivf:   IndexIVFFlat，nlist / nprobe 按语料规模自动选择
+- hnsw:  IndexIDMap2 + IndexHNSWFlat，不需要训练，但不支持 remove_ids
+- ivfpq: IndexIVFPQ，乘积量化压缩向量，适合十万级以上语料
+
+训练数据不足时自动降级（ivfpq -> ivf -> flat），并打印提示。
+'''
+
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'ivfpq')
+
+# FAISS 建议每个聚类中心至少有 39 个训练点
+MIN_POINTS_PER_CENTROID = 39
+
+
+def auto_nlist(n_vectors):
+    """按语料规模选择聚类中心数：约 4*sqrt(N)，并保证每个中心有足够的训练点"""
+    if n_vectors <= 0:
+        return 1
+    nlist = int(4 * math.sqrt(n_vectors))
+    return max(1, min(nlist, n_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def auto_nprobe(nlist):
+    """默认探查约 1/8 的聚类中心（至少 1 个，至多 128 个）"""
+    return max(1, min(nlist // 8, 128))
+
+
+def _pq_m(dim, m):
+    """PQ 子空间个数必须整除向量维度，取不大于 m 的最大约数"""
+    m = max(1, min(m, dim))
+    while dim % m:
+        m -= 1
+    return m
+
+
+def _config_value(name, default):
+    try:
+        from config.app_config import app_config
+        value = getattr(app_config, name, default)
+    except ImportError:
+        value = default
+    return default if value is None else value
+
+
+def build_index(vectors, ids, index_type=None, nlist=None, nprobe=None,
+                hnsw_m=None, ef_construction=None, ef_search=None, pq_m=None, pq_nbits=None,
+                check_recall=None):
+    """
+    创建并填充索引。
+    :param vectors: (N, dim) 向量矩阵
+    :param ids: 长度为 N 的 faiss_id 列表
+    :param index_type: flat / ivf / hnsw / ivfpq，默认 app_config.ANN_INDEX_TYPE
+    :param nlist / nprobe: IVF 参数，None 表示按语料规模自动选择
+    :param check_recall: 近似索引建好后是否与精确搜索对比 recall@k 并打印，默认 app_config.ANN_RECALL_CHECK
+    :return: 已训练并添加了全部向量的索引
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    ids = np.asarray(ids, dtype='int64')
+    if vectors.ndim != 2 or vectors.shape[0] != ids.shape[0]:
+        raise ValueError(f"向量与 ID 数量不匹配: {vectors.shape} vs {ids.shape}")
+    n_vectors, dim = vectors.shape
+
+    index_type = (index_type or _config_value('ANN_INDEX_TYPE', 'flat')).lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"未知的索引类型: {index_type}，可选: {', '.join(INDEX_TYPES)}")
+
+    if index_type in ('ivf', 'ivfpq'):
+        nlist = nlist or _config_value('ANN_NLIST', None) or auto_nlist(n_vectors)
+        nlist = min(nlist, max(1, n_vectors))
+        if index_type == 'ivfpq':
+            pq_m = _pq_m(dim, pq_m or _config_value('ANN_PQ_M', 48))
+            pq_nbits = pq_nbits or _config_value('ANN_PQ_NBITS', 8)
+            # PQ 码本有 2^nbits 个中心，同样需要足够的训练点
+            if n_vectors < MIN_POINTS_PER_CENTROID * max(2 ** pq_nbits, nlist):
+                print(f"[ANN] 训练数据 ({n_vectors}) 不足以训练 IVF-PQ，改用 IVF")
+                index_type = 'ivf'
+        if index_type == 'ivf' and n_vectors < MIN_POINTS_PER_CENTROID:
+            print(f"[ANN] 训练数据 ({n_vectors}) 过少，改用精确搜索")
+            index_type = 'flat'
+
+    if index_type == 'flat':
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+    elif index_type == 'hnsw':
+        base_index = faiss.IndexHNSWFlat(dim, hnsw_m or _config_value('ANN_HNSW_M', 32),
+                                         faiss.METRIC_INNER_PRODUCT)
+        base_index.hnsw.efConstruction = ef_construction or _config_value('ANN_HNSW_EF_CONSTRUCTION', 80)
+        index = faiss.IndexIDMap2(base_index)
+    elif index_type == 'ivf':
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    else:
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        index.train(vectors)
+    if n_vectors:
+        index.add_with_ids(vectors, ids)
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    print(f"[ANN] 已创建 {index_type} 索引: {n_vectors} 个向量，维度 {dim}"
+          + (f"，nlist={nlist}" if index_type in ('ivf', 'ivfpq') else ""))
+    if check_recall is None:
+        check_recall = _config_value('ANN_RECALL_CHECK', True)
+    if check_recall and index_type != 'flat' and n_vectors:
+        recall_at_k(index, vectors, ids, k=_config_value('ANN_RECALL_CHECK_K', 10),
+                    n_queries=_config_value('ANN_RECALL_CHECK_QUERIES', 100))
+    return index
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """设置检索参数（IVF 的 nprobe、HNSW 的 efSearch），未指定时使用配置或自动值"""
+    ivf = _find_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(ivf.nlist, nprobe or _config_value('ANN_NPROBE', None) or auto_nprobe(ivf.nlist))
+    hnsw = _find_hnsw(index)
+    if hnsw is not None:
+        hnsw.hnsw.efSearch = ef_search or _config_value('ANN_HNSW_EF_SEARCH', 64)
+    return index
+
+
+def _find_ivf(index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def _find_hnsw(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    return index if isinstance(index, faiss.IndexHNSW) else None
+
+
+def uses_positional_labels(index):
+    """
+    旧版索引（直接 index.add 的 IndexFlat / IndexHNSW）返回的是向量位置而不是 faiss_id，
+    检索时需要额外的 位置 -> faiss_id 映射。
+    """
+    index = faiss.downcast_index(index)
+    return isinstance(index, (faiss.IndexFlat, faiss.IndexHNSW))
+
+
+def supports_remove(index):
+    """HNSW 不支持删除向量，增量更新时需要整体重建"""
+    return _find_hnsw(index) is None
+
+
+def recall_at_k(index, vectors, ids, queries=None, k=10, n_queries=100, seed=0):
+    """
+    与精确搜索（flat）对比的 recall@k，用于检查近似索引参数是否合适。
+    :param vectors / ids: 建索引用的全部向量及其 faiss_id
+    :param queries: 查询向量，None 时从 vectors 中随机抽取 n_queries 条
+    :return: 近似结果中命中精确 top-k 的平均比例
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    ids = np.asarray(ids, dtype='int64')
+    if queries is None:
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(vectors.shape[0], size=min(n_queries, vectors.shape[0]), replace=False)
+        queries = vectors[sample]
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    k = min(k, vectors.shape[0])
+    if k == 0 or queries.shape[0] == 0:
+        return 1.0
+
+    exact = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+    exact.add_with_ids(vectors, ids)
+    _, exact_ids = exact.search(queries, k)
+    _, approx_ids = index.search(queries, k)
+
+    hits = 0
+    for truth, found in zip(exact_ids, approx_ids):
+        hits += len(set(truth.tolist()) & set(found.tolist()))
+    recall = hits / (k * queries.shape[0])
+    print(f"[ANN] recall@{k} = {recall:.4f}（{queries.shape[0]} 条查询）")
+    return recall
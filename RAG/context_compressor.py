@@ -0,0 +1,183 @@
+import hashlib
+import re
+import threading
+
+'''
+上下文去重压缩：检索到的多个示例通常重复同样的脚手架代码
+（<script src=unpkg> 引用、vtkFullScreenRenderWindow 初始化、renderer / renderWindow 连线等）。
+这里找出在多个示例中重复出现的连续行块，只在 "Common Scaffold" 中输出一次，
+各示例中对应位置替换为引用标记，只保留各自不同的部分，不丢失信息。
+
+每个代码片段的行指纹（去掉首尾空白后的行哈希）在建索引时预先计算（见 CorpusIndex.refresh），
+拼接 Prompt 时只需做哈希比较。
+'''
+
+# 一个共享块至少包含的行数（单行的 "});" 之类不值得引用）
+MIN_BLOCK_LINES = 2
+# 少于该长度的行（如 "}"、"});"）不单独构成共享块
+MIN_LINE_CHARS = 4
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+_MAX_FINGERPRINTS = 50000
+
+
+def _line_hash(line):
+    return hashlib.sha1(line.strip().encode('utf-8')).hexdigest()[:16]
+
+
+def fingerprint(code):
+    """
+    返回 (lines, hashes)：代码的行列表和每行（去首尾空白）的哈希，空行哈希为 None。
+    结果按代码内容缓存。
+    """
+    key = hashlib.sha1(code.encode('utf-8')).hexdigest()
+    cached = _fingerprints.get(key)
+    if cached is not None:
+        return cached
+    lines = code.split('\n')
+    hashes = tuple(_line_hash(line) if line.strip() else None for line in lines)
+    cached = (lines, hashes)
+    with _fingerprints_lock:
+        if len(_fingerprints) >= _MAX_FINGERPRINTS:
+            _fingerprints.clear()
+        _fingerprints[key] = cached
+    return cached
+
+
+def precompute_fingerprints(codes):
+    """建索引时为全部代码片段预先计算行指纹"""
+    count = 0
+    for code in codes:
+        if isinstance(code, str) and code:
+            fingerprint(code)
+            count += 1
+    return count
+
+
+def _shared_runs(lines, hashes, doc_sets):
+    """
+    示例中由共享行组成的连续区间 [(start, end)]（空行可以夹在共享行之间）。
+    相邻行被不同的示例集合共享时在此切开，保证同一个区间在各示例中的内容完全一致。
+    """
+    runs = []
+    start = None
+    current = None
+    for i, h in enumerate(hashes):
+        if h is None:
+            continue
+        docs = doc_sets.get(h)
+        if docs is not None and len(docs) >= 2:
+            if start is not None and docs != current:
+                runs.append((start, end))
+                start = None
+            if start is None:
+                start = i
+                current = docs
+            end = i + 1
+        else:
+            if start is not None:
+                runs.append((start, end))
+            start = None
+    if start is not None:
+        runs.append((start, end))
+
+    valid = []
+    for start, end in runs:
+        content = [lines[i].strip() for i in range(start, end) if hashes[i] is not None]
+        if len(content) >= MIN_BLOCK_LINES and any(len(c) >= MIN_LINE_CHARS for c in content):
+            valid.append((start, end))
+    return valid
+
+
+def compress_snippets(codes):
+    """
+    对一组示例代码（按相关度从高到低）做去重压缩。
+
+    :return: dict
+        - blocks: [(block_id, text)] 共享脚手架块，按首次出现顺序编号
+        - bodies: 与 codes 一一对应的压缩后代码，共享块替换为 "// [Common Scaffold #id]"
+        - refs:   每个示例引用的块 ID 集合
+    只有内容完全相同、且出现在至少两个示例中的块才会被提取，把引用标记换回块内容即可还原示例
+    （除行首缩进外逐行一致）。
+    """
+    codes = [code if isinstance(code, str) else '' for code in codes]
+    prints = [fingerprint(code) for code in codes]
+
+    # 1. 记录每个行哈希出现在哪些示例中
+    doc_sets = {}
+    for n, (_, hashes) in enumerate(prints):
+        for h in set(hashes):
+            if h is not None:
+                doc_sets.setdefault(h, set()).add(n)
+    doc_sets = {h: frozenset(docs) for h, docs in doc_sets.items()}
+
+    # 2. 切出各示例的共享区间，以去掉缩进后的内容为键
+    blocks = {}          # {key: (首次出现顺序, text)}
+    assignments = []     # 每个示例: [(start, end, key)]
+    for lines, hashes in prints:
+        example_assignments = []
+        for start, end in _shared_runs(lines, hashes, doc_sets):
+            key = '\n'.join(lines[i].strip() for i in range(start, end) if hashes[i] is not None)
+            if key not in blocks:
+                blocks[key] = (len(blocks), '\n'.join(lines[start:end]))
+            example_assignments.append((start, end, key))
+        assignments.append(example_assignments)
+
+    # 3. 只保留被至少两个示例引用的块，按首次出现顺序编号
+    usage = {}
+    for example_assignments in assignments:
+        for key in {a[2] for a in example_assignments}:
+            usage[key] = usage.get(key, 0) + 1
+    kept = sorted((key for key in blocks if usage.get(key, 0) >= 2), key=lambda k: blocks[k][0])
+    block_ids = {key: n + 1 for n, key in enumerate(kept)}
+
+    bodies = []
+    refs = []
+    for (lines, _), example_assignments in zip(prints, assignments):
+        out = []
+        used = set()
+        cursor = 0
+        for start, end, key in example_assignments:
+            if key not in block_ids:
+                continue
+            out.extend(lines[cursor:start])
+            indent = lines[start][:len(lines[start]) - len(lines[start].lstrip())]
+            out.append(f"{indent}// [Common Scaffold #{block_ids[key]}]")
+            used.add(block_ids[key])
+            cursor = end
+        out.extend(lines[cursor:])
+        bodies.append('\n'.join(out))
+        refs.append(used)
+
+    return {
+        "blocks": [(block_ids[key], blocks[key][1]) for key in kept],
+        "bodies": bodies,
+        "refs": refs,
+    }
+
+
+_MARKER_RE = re.compile(r'^([ \t]*)// \[Common Scaffold #(\d+)\]$', re.MULTILINE)
+
+
+def expand_blocks(body, blocks, block_ids):
+    """把 body 中 block_ids 对应的引用标记换回块内容（只被一个示例用到的块不值得单独输出）"""
+    texts = {block_id: text for block_id, text in blocks if block_id in block_ids}
+    if not texts or not isinstance(body, str):
+        return body
+
+    def replace(match):
+        block_id = int(match.group(2))
+        return texts[block_id] if block_id in texts else match.group(0)
+
+    return _MARKER_RE.sub(replace, body)
+
+
+def render_scaffold(blocks, used_ids=None):
+    """输出共享脚手架部分；used_ids 不为 None 时只输出被引用的块"""
+    parts = [f"#{block_id}:\n{text}" for block_id, text in blocks
+             if used_ids is None or block_id in used_ids]
+    if not parts:
+        return ""
+    return ("Common Scaffold (shared by the examples below; each example references the blocks it uses "
+            "with // [Common Scaffold #n]):\n" + "\n\n".join(parts) + "\n")
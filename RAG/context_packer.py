@@ -0,0 +1,275 @@
+import hashlib
+import math
+import re
+import threading
+from collections import OrderedDict
+
+'''
+上下文打包器：在每个目标模型的 token 预算内拼接检索到的示例代码
+- token 数估算：安装了 tiktoken 时用 cl100k_base 编码计数，否则按字符数近似（ASCII 约 4 字符/token，非 ASCII 约 1 字符/token）
+- 结构化精简：去掉 <style>、<head> 中除 <script> 外的内容、HTML 注释、JS 注释（识别字符串 / 模板字符串 / 正则字面量）、多余空行
+- 贪心打包：按重排分数从高到低依次放入，放不下的示例跳过，尝试后面更短的示例
+- 统计节省的 token 数
+'''
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+_CACHE_SIZE = 8192
+
+
+class _LRUCache:
+    def __init__(self, size):
+        self.size = size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+
+_token_cache = _LRUCache(_CACHE_SIZE)
+_reduce_cache = _LRUCache(_CACHE_SIZE)
+
+
+def _text_key(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def estimate_tokens(text):
+    """估算文本的 token 数（结果按文本哈希缓存）"""
+    if not text:
+        return 0
+    key = _text_key(text)
+    tokens = _token_cache.get(key)
+    if tokens is None:
+        if _encoding is not None:
+            tokens = len(_encoding.encode(text, disallowed_special=()))
+        else:
+            non_ascii = sum(1 for ch in text if ord(ch) > 127)
+            tokens = math.ceil((len(text) - non_ascii) / 4) + non_ascii
+        _token_cache.put(key, tokens)
+    return tokens
+
+
+# --- 结构化精简 ---
+
+_STYLE_RE = re.compile(r'<style\b[^>]*>.*?</style\s*>', re.IGNORECASE | re.DOTALL)
+_HTML_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+_HEAD_RE = re.compile(r'(<head\b[^>]*>)(.*?)(</head\s*>)', re.IGNORECASE | re.DOTALL)
+_SCRIPT_TAG_RE = re.compile(r'<script\b[^>]*>.*?</script\s*>', re.IGNORECASE | re.DOTALL)
+_SCRIPT_BODY_RE = re.compile(r'(<script\b[^>]*>)(.*?)(</script\s*>)', re.IGNORECASE | re.DOTALL)
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+
+# 出现在这些字符之后的 "/" 是正则字面量的开始，而不是除号
+_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw')
+
+
+def strip_js_comments(source):
+    """
+    去掉 JS 中的 // 和 /* */ 注释。逐字符扫描，跳过单/双引号字符串、模板字符串和正则字面量，
+    因此 'http://...' 或 /\\/\\// 这类内容不会被误删。
+    """
+    out = []
+    i = 0
+    n = len(source)
+    last_significant = ''   # 上一个非空白、非注释字符
+    last_word = ''          # 上一个标识符（用于判断 return /re/ 之类）
+    while i < n:
+        ch = source[i]
+        nxt = source[i + 1] if i + 1 < n else ''
+
+        if ch in ('"', "'", '`'):
+            j = i + 1
+            while j < n and source[j] != ch:
+                if source[j] == '\\':
+                    j += 1
+                elif ch != '`' and source[j] == '\n':
+                    break
+                j += 1
+            out.append(source[i:j + 1])
+            i = j + 1
+            last_significant, last_word = ch, ''
+            continue
+
+        if ch == '/' and nxt == '/':
+            j = source.find('\n', i)
+            i = n if j == -1 else j
+            continue
+
+        if ch == '/' and nxt == '*':
+            j = source.find('*/', i + 2)
+            # 块注释视为一个空格，避免把两侧的标识符粘在一起
+            out.append(' ')
+            i = n if j == -1 else j + 2
+            continue
+
+        if ch == '/' and (last_significant == '' or last_significant in _REGEX_PRECEDERS
+                          or last_word in _REGEX_KEYWORDS):
+            # 正则字面量
+            j = i + 1
+            in_class = False
+            while j < n and source[j] != '\n':
+                c = source[j]
+                if c == '\\':
+                    j += 2
+                    continue
+                if c == '[':
+                    in_class = True
+                elif c == ']':
+                    in_class = False
+                elif c == '/' and not in_class:
+                    break
+                j += 1
+            j += 1
+            while j < n and (source[j].isalnum() or source[j] == '_'):
+                j += 1
+            out.append(source[i:j])
+            i = j
+            last_significant, last_word = '/', ''
+            continue
+
+        out.append(ch)
+        if not ch.isspace():
+            if ch.isalnum() or ch in '_$':
+                # 记录当前标识符
+                last_word = last_word + ch if (last_significant.isalnum() or last_significant in '_$') else ch
+            else:
+                last_word = ''
+            last_significant = ch
+        i += 1
+    return ''.join(out)
+
+
+def _reduce_head(match):
+    # <head> 中只保留 <script>（CDN 引用对生成代码有意义），去掉 meta / title / link 等
+    scripts = _SCRIPT_TAG_RE.findall(match.group(2))
+    body = ''.join('\n' + s for s in scripts)
+    return match.group(1) + body + ('\n' if body else '') + match.group(3)
+
+
+def _reduce_script(match):
+    return match.group(1) + strip_js_comments(match.group(2)) + match.group(3)
+
+
+def reduce_code(code):
+    """精简示例代码（HTML 或纯 JS），结果按代码哈希缓存"""
+    if not code:
+        return code
+    key = _text_key(code)
+    reduced = _reduce_cache.get(key)
+    if reduced is not None:
+        return reduced
+
+    if re.search(r'<(html|head|body|script)\b', code, re.IGNORECASE):
+        reduced = _HTML_COMMENT_RE.sub('', code)
+        reduced = _STYLE_RE.sub('', reduced)
+        reduced = _HEAD_RE.sub(_reduce_head, reduced)
+        reduced = _SCRIPT_BODY_RE.sub(_reduce_script, reduced)
+    else:
+        reduced = strip_js_comments(code)
+
+    reduced = '\n'.join(line.rstrip() for line in reduced.split('\n'))
+    reduced = _BLANK_LINES_RE.sub('\n', reduced).strip()
+    _reduce_cache.put(key, reduced)
+    return reduced
+
+
+# --- 预算与打包 ---
+
+def get_token_budget(model_name=None):
+    """按目标模型取上下文 token 预算（app_config.CONTEXT_TOKEN_BUDGETS，未列出的模型用 'default'）"""
+    try:
+        from config.app_config import app_config
+        budgets = getattr(app_config, 'CONTEXT_TOKEN_BUDGETS', None) or {}
+    except ImportError:
+        budgets = {}
+    if model_name and model_name in budgets:
+        return budgets[model_name]
+    return budgets.get('default', 12000)
+
+
+def _truncate_to_budget(text, budget):
+    """按行截断，使文本不超过预算"""
+    lines = text.split('\n')
+    kept = []
+    used = 0
+    for line in lines:
+        cost = estimate_tokens(line + '\n')
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    return '\n'.join(kept) + '\n// ...(truncated)\n'
+
+
+def prepare_code(code, reduce=True):
+    """示例代码放入 prompt 前的处理（目前只有结构化精简）"""
+    if reduce and isinstance(code, str):
+        return reduce_code(code)
+    return code
+
+
+def pack_examples(results, render, budget, reduce=True, codes=None, reserved_tokens=0):
+    """
+    贪心打包示例。
+    :param results: 按分数从高到低排好的检索结果
+    :param render: render(序号, result, code) -> 该示例在 prompt 中的文本
+    :param budget: 示例部分的 token 预算，None 表示不限
+    :param reduce: 是否先做结构化精简（codes 已给出时忽略）
+    :param codes: 可选，与 results 对应的已处理代码（如去重压缩后的代码）
+    :param reserved_tokens: 预算中预留给其他内容（如共享脚手架）的 token 数
+    :return: (示例文本列表, 统计信息)。统计中的 packed_indices 为放入的示例在 results 中的下标
+    """
+    if codes is None:
+        codes = [prepare_code(result.get("code", "N/A"), reduce) for result in results]
+    parts = []
+    packed_indices = []
+    truncated = False
+    original_tokens = 0
+    packed_tokens = reserved_tokens
+    for index, (result, code) in enumerate(zip(results, codes)):
+        original_tokens += estimate_tokens(render(len(parts) + 1, result, result.get("code", "N/A")))
+        text = render(len(parts) + 1, result, code)
+        cost = estimate_tokens(text)
+        if budget is not None and packed_tokens + cost > budget:
+            continue
+        parts.append(text)
+        packed_indices.append(index)
+        packed_tokens += cost
+
+    if results and not parts and budget:
+        # 连最相关的示例都放不下时，截断它而不是完全不给上下文
+        text = _truncate_to_budget(render(1, results[0], codes[0]), max(1, budget - reserved_tokens))
+        parts.append(text)
+        packed_indices.append(0)
+        packed_tokens = reserved_tokens + estimate_tokens(text)
+        truncated = True
+
+    stats = {
+        "budget": budget,
+        "examples_in": len(results),
+        "examples_packed": len(parts),
+        "packed_indices": packed_indices,
+        "truncated": truncated,
+        "original_tokens": original_tokens,
+        "packed_tokens": packed_tokens,
+        "saved_tokens": max(0, original_tokens - packed_tokens),
+        "tokenizer": "tiktoken" if _encoding is not None else "estimate",
+    }
+    return parts, stats
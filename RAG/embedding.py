@@ -13,6 +13,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config.app_config import app_config
 from config.ollama_config import ollama_config
 from RAG.vtk_code_meta_extract import extract_vtkjs_meta
+from RAG.embedding_cache import EmbeddingCache, CachedEmbeddings
 
 import json
 
@@ -99,7 +100,10 @@ def main():
     documents = process_vtk_examples(vtk_dir)
     print(f"Processed {len(documents)} document chunks")
     print("Initializing embedding model...")
-    embeddings = get_embedding()
+    # Wrap with the persistent cache so unchanged chunks are not re-embedded
+    embeddings = CachedEmbeddings(
+        get_embedding(),
+        EmbeddingCache(app_config.EMBEDDING_CACHE_DIR, ollama_config.embedding_models['bge']))
     print("Creating vector database...")
     db = FAISS.from_documents(documents, embeddings)
     print("Saving vector database...")
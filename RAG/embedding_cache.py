@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+'''
+持久化的文本向量缓存
+键为 (模型名, 文本 SHA-1)，向量以 float32 矩阵追加写入磁盘并通过 memmap 读取，
+重建索引时只需为新增或修改过的文本计算向量。
+
+目录结构: <cache_dir>/<模型名>/
+    vectors.f32   float32 矩阵（行优先，每行一个向量）
+    keys.json     {"dim": 维度, "rows": {文本sha1: 行号}}
+'''
+
+
+def text_key(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir, model_name):
+        self.model_name = model_name
+        safe_name = re.sub(r'[^\w.-]+', '_', model_name)
+        self.dir = os.path.join(cache_dir, safe_name)
+        os.makedirs(self.dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.dir, 'vectors.f32')
+        self.keys_path = os.path.join(self.dir, 'keys.json')
+        self._lock = threading.Lock()
+        self.dim = None
+        self.rows = {}
+        self._matrix = None
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.dim = meta.get('dim')
+            self.rows = meta.get('rows', {})
+        self._remap()
+
+    def _remap(self):
+        """根据当前行数重新映射向量文件（只读）"""
+        n_rows = len(self.rows)
+        if not n_rows or not self.dim or not os.path.exists(self.vectors_path):
+            self._matrix = None
+            return
+        # 文件可能因中途中断多写了几行，只映射 keys.json 中记录的部分
+        self._matrix = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(n_rows, self.dim))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def lookup(self, texts):
+        """
+        :return: (vectors, missing)。vectors 为 {位置: 向量}，missing 为未命中的位置列表
+        """
+        vectors = {}
+        missing = []
+        with self._lock:
+            for i, text in enumerate(texts):
+                row = self.rows.get(text_key(text))
+                if row is None or self._matrix is None:
+                    missing.append(i)
+                else:
+                    vectors[i] = np.array(self._matrix[row])
+        return vectors, missing
+
+    def add(self, texts, vectors):
+        """追加新的向量（已存在的文本会被跳过）"""
+        vectors = np.asarray(vectors, dtype='float32')
+        if len(texts) == 0:
+            return
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度不匹配: {vectors.shape[1]} != {self.dim}")
+
+            new_rows = []
+            new_keys = {}
+            for text, vector in zip(texts, vectors):
+                key = text_key(text)
+                if key in self.rows or key in new_keys:
+                    continue
+                new_keys[key] = len(self.rows) + len(new_rows)
+                new_rows.append(vector)
+            if not new_rows:
+                return
+
+            # 先截断到已记录的行数（丢弃上次中断时的残留），再追加向量，最后原子替换键索引
+            with open(self.vectors_path, 'ab') as f:
+                f.truncate(len(self.rows) * self.dim * 4)
+                f.write(np.stack(new_rows).astype('float32').tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self.rows.update(new_keys)
+            tmp_path = self.keys_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'dim': self.dim, 'model': self.model_name, 'rows': self.rows}, f)
+            os.replace(tmp_path, self.keys_path)
+            self._remap()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    为 LangChain Embeddings 加上持久化缓存：embed_documents 只为未缓存的文本调用底层模型。
+    embed_query 不缓存（部分模型对查询和文档使用不同的编码方式）。
+    """
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts, embed_fn=None):
+        """
+        :param embed_fn: 可选，为未命中的文本计算向量的函数（默认 embeddings.embed_documents）
+        """
+        texts = list(texts)
+        vectors, missing = self.cache.lookup(texts)
+        print(f"[EmbeddingCache] {self.cache.model_name}: 命中 {len(vectors)} 条，需计算 {len(missing)} 条")
+
+        if missing:
+            # 同一文本只计算一次
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            embed_fn = embed_fn or self.embeddings.embed_documents
+            computed = np.asarray(embed_fn(missing_texts), dtype='float32')
+            self.cache.add(missing_texts, computed)
+            by_text = dict(zip(missing_texts, computed))
+            for i in missing:
+                vectors[i] = by_text[texts[i]]
+
+        return [np.asarray(vectors[i], dtype='float32').tolist() for i in range(len(texts))]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
@@ -1,4 +1,5 @@
 import re
+from collections import OrderedDict
 from typing import List, Dict, Tuple
 import numpy as np
 from langchain_community.embeddings import OllamaEmbeddings # Replace with OllamaEmbeddings
@@ -198,35 +199,94 @@ def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
         return 0.0
     return dot_product / (norm_vec1 * norm_vec2)
 
+# Cache of L2-normalised float32 sample matrices, keyed by the sample description texts
+_SAMPLE_MATRIX_CACHE_SIZE = 8
+_sample_matrix_cache = OrderedDict()
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    L2-normalise each row as float32. All-zero rows stay zero (cosine similarity 0).
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def get_sample_matrix(sample_descriptions: List[Dict[str, str]]) -> np.ndarray:
+    """
+    Embed all sample descriptions in one batch and return the normalised (N, dim) matrix.
+    The matrix is cached, so repeated queries against the same library do not re-embed it.
+    """
+    key = tuple(item['description'] for item in sample_descriptions)
+    matrix = _sample_matrix_cache.get(key)
+    if matrix is None:
+        matrix = normalize_rows(get_embeddings(list(key))) if key else np.zeros((0, 0), dtype=np.float32)
+        _sample_matrix_cache[key] = matrix
+        if len(_sample_matrix_cache) > _SAMPLE_MATRIX_CACHE_SIZE:
+            _sample_matrix_cache.popitem(last=False)
+    else:
+        _sample_matrix_cache.move_to_end(key)
+    return matrix
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores, descending. argpartition keeps this O(N);
+    ties keep the original sample order (same as the previous stable sort).
+    """
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
 def find_top_k_similar(
     query_description: str,
     sample_descriptions: List[Dict[str, str]],
-    k: int = 2
+    k: int = 2,
+    sample_matrix: np.ndarray = None
 ) -> List[Tuple[str, float, str]]:
     """
     Find the K most similar sample descriptions to the given query description.
+    Scores come from one matrix-vector product against the cached normalised sample matrix.
     """
-    # Get query embeddings
-    # Note: OllamaEmbeddings' embed_documents method returns a list of lists, even if the input is a single text
-    # So we take [0] to get the first (and only) embedding vector
-    query_embedding = get_embeddings([query_description])[0] 
-
-    similarities = []
-    for sample_desc_item in sample_descriptions:
-        sample_title = sample_desc_item['title']
-        sample_desc_text = sample_desc_item['description']
-        
-        # Get sample embeddings
-        sample_embedding = get_embeddings([sample_desc_text])[0]
+    return find_top_k_similar_batch([query_description], sample_descriptions, k, sample_matrix)[0]
 
-        similarity = cosine_similarity(query_embedding, sample_embedding)
-        similarities.append((sample_title, similarity, sample_desc_text))
 
-    # Sort by similarity in descending order
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    
-    # Return top K
-    return similarities[:k]
+def find_top_k_similar_batch(
+    query_descriptions: List[str],
+    sample_descriptions: List[Dict[str, str]],
+    k: int = 2,
+    sample_matrix: np.ndarray = None
+) -> List[List[Tuple[str, float, str]]]:
+    """
+    Batched version of find_top_k_similar: embeds all queries in one call and scores
+    them with a single (Q, dim) x (dim, N) product. Returns one result list per query.
+    """
+    if not query_descriptions:
+        return []
+    if not sample_descriptions:
+        return [[] for _ in query_descriptions]
+
+    if sample_matrix is None:
+        sample_matrix = get_sample_matrix(sample_descriptions)
+    query_matrix = normalize_rows(get_embeddings(list(query_descriptions)))
+    scores = query_matrix @ sample_matrix.T
+
+    results = []
+    for row in scores:
+        results.append([
+            (sample_descriptions[i]['title'], float(row[i]), sample_descriptions[i]['description'])
+            for i in _top_k_indices(row, k)
+        ])
+    return results
 
 if __name__ == "__main__":
     # 1. Parse sample descriptions
@@ -235,11 +295,12 @@ if __name__ == "__main__":
 
     # 2. Find the two most similar for each query
     print("\n--- Finding most similar descriptions for each query (using Llama 3.1 embeddings) ---")
+    all_top_2_similar = find_top_k_similar_batch([q['description'] for q in querys], parsed_sample_data, k=2)
     for i, query_item in enumerate(querys):
         query_desc = query_item['description']
         print(f"\nQuery {i+1}: \"{query_desc}\"")
         
-        top_2_similar = find_top_k_similar(query_desc, parsed_sample_data, k=2)
+        top_2_similar = all_top_2_similar[i]
         
         if top_2_similar:
             for j, (title, score, desc) in enumerate(top_2_similar):
@@ -1,4 +1,5 @@
-from llm_agent.ollma_chat import get_llm_response
+from llm_agent.ollma_chat import get_llm_response, call_llm
+from llm_agent.batch_runner import run_batch
 
 import os
 import time
@@ -188,7 +189,8 @@ def slipt_query(query):
     model_name="qwen2.5-14b"
     return get_llm_response(query, model_name, system)
 
-def main(query):
+def main(query, strict=False):
+    """strict=True 时调用失败直接抛出异常（供批量执行器重试），否则返回错误页面"""
 
     system="""
 You are a query assistant. Your task is to find the most relevant information from the provided "Content Library" ONLY. Do NOT use any external knowledge. Return only the top 6 most relevant results(title + content), without any additional text or explanation.
@@ -200,19 +202,25 @@ Content Library: {des}
 
 
     model_name="qwen2.5-14b"
-    r=get_llm_response(Q, model_name, system)
+    r=(call_llm if strict else get_llm_response)(Q, model_name, system)
     print(r)
     return r
 
-def process_rag_benchmark(input_file, output_file):
+def process_rag_benchmark(input_file, output_file, checkpoint_path=None):
     """
     Read the Benchmark prompt column from Excel file, perform RAG retrieval for each question,
-    record retrieval time, and write results to Excel file
+    record retrieval time, and write results to Excel file.
+    Rows are processed concurrently by BatchLLMRunner and checkpointed per row,
+    so an interrupted run resumes where it stopped.
     
     Args:
         input_file: Input Excel file path
         output_file: Output Excel file path
+        checkpoint_path: Checkpoint JSONL path, defaults to output_file + ".rag.checkpoint.jsonl"
     """
+    if checkpoint_path is None:
+        checkpoint_path = output_file + ".rag.checkpoint.jsonl"
+
     # 读取Excel文件
     df = pd.read_excel(input_file, sheet_name='第二期实验数据')
     
@@ -226,7 +234,8 @@ def process_rag_benchmark(input_file, output_file):
     df['rag_retrieval_result'] = df['rag_retrieval_result'].astype(str)
     df['time_spend_rag'] = df['time_spend_rag'].astype(str)
     
-    # Process each question
+    # Collect questions to process
+    tasks = []
     for index, row in df.iterrows():
         prompt = row['Benchmark prompt']
         
@@ -236,39 +245,33 @@ def process_rag_benchmark(input_file, output_file):
             df.at[index, 'rag_retrieval_result'] = str("")
             df.at[index, 'time_spend_rag'] = str("")
             continue
-            
-        print(f"Processing RAG retrieval for question {index+1}...")
-        
-        # Record start time
-        start_time = time.time()
-        
-        try:
-            # Perform RAG retrieval
-            result = main(prompt)
-            
-            # 记录结束时间
-            end_time = time.time()
-            time_spent = end_time - start_time
-            
-            # Write results to DataFrame, ensure conversion to string
-            if result is not None:
-                # Save retrieval results
-                df.at[index, 'rag_retrieval_result'] = str(result)
-                df.at[index, 'time_spend_rag'] = str(f"{time_spent:.2f}")
-                print(f"RAG retrieval for question {index+1} completed, time spent: {time_spent:.2f} seconds")
-            else:
-                df.at[index, 'rag_retrieval_result'] = str("Retrieval failed")
-                df.at[index, 'time_spend_rag'] = str(f"{time_spent:.2f}")
-                print(f"Retrieval failed for question {index+1}, time spent: {time_spent:.2f} seconds")
-                
-        except Exception as e:
-            # Record end time
-            end_time = time.time()
-            time_spent = end_time - start_time
-            
-            df.at[index, 'rag_retrieval_result'] = str(f"Retrieval error: {str(e)}")
+
+        tasks.append({"id": index, "prompt": prompt, "model_name": "qwen2.5-14b"})
+
+    print(f"Processing RAG retrieval for {len(tasks)} questions concurrently...")
+    records = run_batch(tasks, worker=lambda task: main(task["prompt"], strict=True), checkpoint_path=checkpoint_path)
+
+    for task, record in zip(tasks, records):
+        index = task["id"]
+        time_spent = record["elapsed"]
+
+        if record["status"] != "success":
+            df.at[index, 'rag_retrieval_result'] = str(f"Retrieval error: {record['error']}")
+            df.at[index, 'time_spend_rag'] = str(f"{time_spent:.2f}")
+            print(f"Retrieval error for question {index+1}: {record['error']}, time spent: {time_spent:.2f} seconds")
+            continue
+
+        result = record["result"]
+        # Write results to DataFrame, ensure conversion to string
+        if result is not None:
+            # Save retrieval results
+            df.at[index, 'rag_retrieval_result'] = str(result)
+            df.at[index, 'time_spend_rag'] = str(f"{time_spent:.2f}")
+            print(f"RAG retrieval for question {index+1} completed, time spent: {time_spent:.2f} seconds")
+        else:
+            df.at[index, 'rag_retrieval_result'] = str("Retrieval failed")
             df.at[index, 'time_spend_rag'] = str(f"{time_spent:.2f}")
-            print(f"Retrieval error for question {index+1}: {e}, time spent: {time_spent:.2f} seconds")
+            print(f"Retrieval failed for question {index+1}, time spent: {time_spent:.2f} seconds")
     
     # Save to Excel file
     try:
@@ -1,6 +1,5 @@
 import faiss
 import numpy as np
-from langchain_huggingface import HuggingFaceEmbeddings
 import pymongo
 import os
 import hashlib
@@ -9,17 +8,24 @@ import re
 
 # Import MongoDBManager class (please ensure this path is correct, or you have defined it in the current file)
 from RAG.mongodb import MongoDBManager
+from RAG import ann_index
+from RAG.lazy_handle import LazyHandle
 
-# Create an instance of MongoDB connection manager
-mongo_manager = MongoDBManager(
+# Create a lazy handle for the MongoDB connection manager (connects on first use)
+mongo_manager = LazyHandle(lambda: MongoDBManager(
     host='localhost',
     port=27017,
     db_name='code_database',
     collection_name='code_snippets'
-)
+), "MongoDB (embedding_v3)")
 
-# Load embedding model
-model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+# Embedding model (loaded on first use)
+def _load_embedding_model():
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+
+
+model = LazyHandle(_load_embedding_model, "嵌入模型 all-MiniLM-L6-v2")
 
 # Initialize FAISS vector database (in global scope)
 embedding_dim = 384
@@ -203,15 +209,13 @@ def search_code_optimized(query, k=3, similarity_threshold=0.3, recall_k_multipl
         print("警告: FAISS 索引未训练，无法执行搜索。")
         return []
     
-    if not hasattr(index, 'nprobe'):
-        print("警告: index.nprobe 未设置，使用默认值 1。")
-    index.nprobe = max(1, nlist // 5) if nlist > 0 else 1 # 确保 nprobe 不为0
-    print(f"FAISS IndexIVFFlat nprobe 设置为: {index.nprobe}")
+    # nprobe / efSearch 按索引类型和语料规模设置（IndexIDMap 外层直接赋 nprobe 不会生效）
+    ann_index.set_search_params(index)
 
     recall_k = k * recall_k_multiplier
     distances, faiss_ids = index.search(query_vector, recall_k)
 
-    raw_results = []
+    hits = []
     for i, faiss_id in enumerate(faiss_ids[0]):
         if faiss_id == -1:
             continue
@@ -221,7 +225,12 @@ def search_code_optimized(query, k=3, similarity_threshold=0.3, recall_k_multipl
         if similarity_threshold is not None and similarity < similarity_threshold:
             continue 
         
-        matched_document = mongo_manager.find_code_snippet({"faiss_id": int(faiss_id)})
+        hits.append((int(faiss_id), similarity))
+
+    # 一次 $in 查询取回所有命中的文档，保持 FAISS 的排序
+    matched_documents = mongo_manager.find_code_snippets_by_faiss_ids([faiss_id for faiss_id, _ in hits])
+    raw_results = []
+    for (faiss_id, similarity), matched_document in zip(hits, matched_documents):
         if matched_document:
             matched_document['faiss_similarity'] = similarity
             raw_results.append(matched_document)
@@ -306,32 +315,14 @@ def load_data_from_directory(directory):
         print("未找到任何符合条件的向量用于训练和添加。")
         return
 
-    if not index.is_trained:
-        print(f"开始训练 FAISS 索引，使用 {len(all_vectors)} 个向量...")
-        training_data = np.array(all_vectors).astype('float32')
-        
-        if training_data.shape[0] < nlist:
-            nlist_old = nlist
-            nlist = max(1, training_data.shape[0] // 2 if training_data.shape[0] > 1 else 1) 
-            print(f"警告: 训练数据量 ({training_data.shape[0]}) 小于当前 nlist ({nlist_old})。nlist 已自动调整为 {nlist}。")
-            
-            # 重新初始化 FAISS 索引 with adjusted nlist
-            quantizer = faiss.IndexFlatIP(embedding_dim)
-            base_index = faiss.IndexIVFFlat(quantizer, embedding_dim, nlist, faiss.METRIC_INNER_PRODUCT)
-            index = faiss.IndexIDMap(base_index)
-            
-        index.train(training_data)
-        print("FAISS 索引训练完成。")
-
-    if index.ntotal == 0: # 只有在索引为空时才添加
+    if index.ntotal == 0: # 只有在索引为空时才创建
         faiss_ids_array = np.array([item[0] for item in documents_for_faiss_and_mongo]).astype('int64')
         vectors_array = np.array([item[1] for item in documents_for_faiss_and_mongo]).astype('float32')
         
-        if vectors_array.shape[0] > 0:
-            index.add_with_ids(vectors_array, faiss_ids_array)
-            print(f"批量添加到 FAISS 成功，共添加 {vectors_array.shape[0]} 个向量。")
-        else:
-            print("没有向量可以添加到 FAISS。")
+        # 按 app_config.ANN_INDEX_TYPE 创建索引，nlist 按语料规模自动选择，训练数据不足时自动降级
+        print(f"开始创建 FAISS 索引，使用 {len(all_vectors)} 个向量...")
+        index = ann_index.build_index(vectors_array, faiss_ids_array)
+        print(f"批量添加到 FAISS 成功，共添加 {vectors_array.shape[0]} 个向量。")
 
     if mongo_manager.collection.count_documents({}) == 0: # 只有在集合为空时才插入
         mongo_documents_to_insert = [item[2] for item in documents_for_faiss_and_mongo]
@@ -438,8 +429,7 @@ if __name__ == '__main__':
     print(f"MongoDB 集合中当前有 {mongo_manager.collection.count_documents({})} 个文档。")
 
     if index.is_trained:
-        index.nprobe = max(1, nlist // 5) 
-        print(f"FAISS IndexIVFFlat nprobe 设置为: {index.nprobe}")
+        ann_index.set_search_params(index)
     else:
         print("警告: FAISS 索引尚未训练，nprobe 未设置。搜索可能不会按预期工作。")
 
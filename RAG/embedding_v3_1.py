@@ -1,14 +1,20 @@
 import faiss
 import numpy as np
-from langchain_huggingface import HuggingFaceEmbeddings
 import pymongo
 import os
 import hashlib
 import json
 import re
 from config.app_config import app_config
+from RAG.query_analyzer import get_query_analyzer
+from RAG.embedding_cache import EmbeddingCache, CachedEmbeddings
+from RAG.mongodb import find_docs_by_faiss_ids
+from RAG import ann_index
+from RAG.lazy_handle import LazyHandle
 import pandas as pd
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 # 第一阶段召回的k
 K=4
 Similarity_Threshold=0.1
@@ -33,6 +39,10 @@ class MongoDBManager:
     def find_code_snippet(self, query):
         return self.collection.find_one(query)
 
+    def find_code_snippets_by_faiss_ids(self, faiss_ids):
+        """按 FAISS ID 批量查询（一次往返，不取 embedding 字段），顺序与输入一致"""
+        return find_docs_by_faiss_ids(self.collection, faiss_ids)
+
     def insert_many(self, documents):
         if documents:
             try:
@@ -45,22 +55,49 @@ class MongoDBManager:
         else:
             print("No documents to insert.")
 
-# 创建 MongoDB 连接管理器的实例
-mongo_manager = MongoDBManager(
+# 创建 MongoDB 连接管理器的句柄（首次访问时才连接）
+mongo_manager = LazyHandle(lambda: MongoDBManager(
     host='localhost',
     port=27017,
     db_name='code_database',
     collection_name='code_snippets'
-)
+), "MongoDB (embedding_v3_1)")
+
+# 嵌入模型（首次使用时才加载）
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
 
-# 加载嵌入模型
-model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+def _load_embedding_model():
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+
+model = LazyHandle(_load_embedding_model, f"嵌入模型 {EMBEDDING_MODEL_NAME}")
 
 # 初始化 FAISS 向量数据库（在全局作用域中）
 embedding_dim = 384
 nlist = 100
 
-index = faiss.IndexFlatIP(embedding_dim)  # 使用精确搜索
+index = faiss.IndexFlatIP(embedding_dim)  # 空索引占位，加载数据时按 app_config.ANN_INDEX_TYPE 创建
+
+# 索引位置 -> faiss_id 的映射。仅用于旧版不带 ID 的 IndexFlatIP 索引文件，
+# 其向量位置与 MongoDB 中的插入顺序一致；新建的索引通过 add_with_ids 直接返回 faiss_id
+_position_faiss_ids = None
+
+
+def get_position_faiss_ids():
+    """返回按索引位置排列的 faiss_id 列表（首次调用时只取 faiss_id 字段查询一次）"""
+    global _position_faiss_ids
+    if _position_faiss_ids is None:
+        _position_faiss_ids = [doc.get('faiss_id') for doc in
+                               mongo_manager.collection.find({}, {'faiss_id': 1, '_id': 0})]
+    return _position_faiss_ids
+
+
+def reset_position_faiss_ids():
+    """索引或集合重建后调用，下次检索时重新查询映射"""
+    global _position_faiss_ids
+    _position_faiss_ids = None
 
 
 # 定义数据目录
@@ -83,46 +120,53 @@ def embed_text(text):
     embedding = model.embed_query(text)
     return np.array(embedding).reshape(1, -1)
 
+def embed_texts_batched(texts, batch_size=None, num_threads=None, use_cache=True):
+    """
+    批量将文本转换为向量（返回 float32 的二维 numpy 数组，每行对应一个文本）。
+    按 batch_size 分批调用 embed_documents，并用多个线程并行处理各批次。
+    use_cache=True 时先查询持久化的向量缓存，只为新增或修改过的文本计算向量。
+    """
+    batch_size = batch_size or app_config.EMBEDDING_BATCH_SIZE
+    num_threads = num_threads or app_config.EMBEDDING_NUM_THREADS
+    if not texts:
+        return np.zeros((0, embedding_dim), dtype='float32')
+
+    def embed_batches(batch_texts):
+        batches = [batch_texts[i:i + batch_size] for i in range(0, len(batch_texts), batch_size)]
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            batch_vectors = list(executor.map(model.embed_documents, batches))
+        elapsed = time.time() - start_time
+
+        vectors = np.array([v for batch in batch_vectors for v in batch], dtype='float32')
+        print(f"批量嵌入完成: {len(batch_texts)} 条, {len(batches)} 批, 耗时 {elapsed:.2f}秒, "
+              f"{len(batch_texts) / elapsed if elapsed > 0 else float('inf'):.1f} items/s")
+        return vectors
+
+    if not use_cache:
+        return embed_batches(texts)
+
+    cached_model = CachedEmbeddings(model, get_embedding_cache())
+    return np.array(cached_model.embed_documents(texts, embed_fn=embed_batches), dtype='float32')
+
+
+_embedding_cache = None
+
+
+def get_embedding_cache():
+    """当前嵌入模型的持久化向量缓存"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache(app_config.EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_NAME)
+    return _embedding_cache
+
+
 def analyze_query(query: str):
     """
     分析用户查询，提取潜在的 VTK.js 模块。
+    使用预编译 + LRU 缓存的共享分析器（见 RAG/query_analyzer.py）。
     """
-    analyzed_data = {
-        "modules": []
-    }
-
-    lower_query = query.lower()
-
-    # 1. 提取 VTK.js 模块名称 (更精确的匹配)
-    # 匹配 vtk.Namespace.vtkClassName 或 vtkClassName
-    module_patterns = [
-        r"vtk\.?[\w\.]*?vtk([A-Z]\w+)", # 匹配 vtk.Namespace.vtkClassName 或 vtkClassName
-        r"vtk\.[a-z]+\.[a-z]+\.[a-zA-Z]+", # 匹配 vtk.Rendering.Core.vtkActor 这种完整路径
-        r"(vtk[A-Z]\w+)" # 匹配独立的 vtkClassName 如 vtkImageSlice
-    ]
-    for pattern in module_patterns:
-        matches = re.findall(pattern, query, re.IGNORECASE)
-        for match in matches:
-            # 对于如 vtk.Rendering.Core.vtkActor，我们需要提取 vtkActor
-            if isinstance(match, str) and match.lower().startswith('vtk.'): # 完整路径，提取最后一个部分
-                last_part = match.split('.')[-1]
-                if last_part.lower().startswith('vtk'):
-                    analyzed_data['modules'].append(last_part)
-            elif isinstance(match, str) and match.lower().startswith('vtk'): # 已经是 vtkClassName 形式
-                analyzed_data['modules'].append(match)
-
-    # 简单提取常用模块，如果查询中直接提到了简写形式
-    common_modules_short = app_config.VTKJS_COMMON_APIS
-    for mod in common_modules_short:
-        # 确保不会重复添加已经通过正则匹配到的模块
-        if mod.lower() in lower_query and mod not in analyzed_data['modules']:
-            # 检查是否是独立单词或后跟非字母数字字符
-            if re.search(r'\b' + re.escape(mod.lower()) + r'\b', lower_query):
-                 analyzed_data['modules'].append(mod)
-
-    # 移除重复项并保持原始大小写 (如果需要)
-    # 这里为了匹配方便，通常会转小写处理，但存储时可以保留原始形式
-    analyzed_data['modules'] = list(set([mod for mod in analyzed_data['modules']]))
+    analyzed_data = get_query_analyzer(app_config.VTKJS_COMMON_APIS).analyze(query)
 
     print(f"Analyzed query: {analyzed_data}")
     return analyzed_data
@@ -328,10 +372,14 @@ def search_code_optimized_with_stages(query, k, similarity_threshold, recall_k_m
         print(f"错误: 查询向量维度不匹配 ({query_vector.shape[1]} != {embedding_dim})")
         return [], []
 
+    # 同步数据时全局索引可能被替换，本次检索固定使用同一个索引对象
+    current_index = index
     recall_k = k * recall_k_multiplier
-    distances, indices = index.search(query_vector, recall_k)
+    distances, indices = current_index.search(query_vector, recall_k)
 
-    raw_results = []
+    # 旧版索引不带 IDs，需要先通过位置映射得到 faiss_id；之后一次性批量取回文档
+    position_faiss_ids = get_position_faiss_ids() if ann_index.uses_positional_labels(current_index) else None
+    hits = []
     for i, idx in enumerate(indices[0]):
         if idx == -1:
             continue
@@ -341,11 +389,17 @@ def search_code_optimized_with_stages(query, k, similarity_threshold, recall_k_m
         if similarity_threshold is not None and similarity < similarity_threshold:
             continue 
         
-        # 由于我们不再使用 IDs，需要通过其他方式找到匹配的文档
-        # 这里我们获取所有文档并按索引匹配
-        all_documents = list(mongo_manager.collection.find({}))
-        if idx < len(all_documents):
-            matched_document = all_documents[idx]
+        if position_faiss_ids is None:
+            hits.append((idx, similarity, int(idx)))
+        elif idx < len(position_faiss_ids):
+            hits.append((idx, similarity, position_faiss_ids[idx]))
+
+    matched_documents = mongo_manager.find_code_snippets_by_faiss_ids(
+        [faiss_id for _, _, faiss_id in hits])
+
+    raw_results = []
+    for (idx, similarity, _), matched_document in zip(hits, matched_documents):
+        if matched_document:
             matched_document['faiss_similarity'] = similarity
             raw_results.append(matched_document)
             print(f"找到匹配的文档: {matched_document.get('file_path')}\n{similarity:.4f} (Index: {idx})")
@@ -658,18 +712,9 @@ def search_code_optimized_with_analysis(query, k, similarity_threshold, recall_k
 
 
 
-def load_data_from_directory(directory, index_file="faiss_index.index"):
-    """从指定目录读取所有文件并添加到数据库."""
-    global index
-
-    if not os.path.isdir(directory):
-        print(f"错误: 目录不存在或不是一个有效目录: {directory}")
-        return
-
-    print(f"开始从目录加载数据: {directory}")
-    
-    all_vectors = [] 
-    documents_for_faiss_and_mongo = [] 
+def _collect_examples(directory):
+    """遍历示例目录，返回 [(file_path, meta_info, description, code_content), ...]"""
+    pending_items = []
 
     for root, _, files in os.walk(directory):
         for filename in files:
@@ -699,62 +744,218 @@ def load_data_from_directory(directory, index_file="faiss_index.index"):
                 elif 'vtkjs_modules' not in meta_info or not isinstance(meta_info['vtkjs_modules'], list):
                     meta_info['vtkjs_modules'] = [] # 确保是一个列表
 
-                vector = embed_text(description)[0] 
-                if vector.shape[0] != embedding_dim:
-                    print(f"警告: 向量维度不匹配 ({vector.shape[0]} != {embedding_dim})，跳过文件 {file_path}")
-                    continue
+                pending_items.append((file_path, meta_info, description, code_content))
 
-                snippet_faiss_id = int(hashlib.sha1(file_path.encode("utf-8")).hexdigest(), 16) % (2**31 - 1)
-                if snippet_faiss_id < 0:
-                    snippet_faiss_id *= -1
-                
-                mongo_document = {
-                    "faiss_id": snippet_faiss_id,
-                    "file_path": file_path, 
-                    "code": code_content,
-                    "meta_info": meta_info, # meta_info 包含了 description 和处理后的 vtkjs_modules
-                    "embedding": vector.tolist() 
-                }
-
-                all_vectors.append(vector)
-                documents_for_faiss_and_mongo.append((snippet_faiss_id, vector, mongo_document))
-
-    # 重新创建索引以确保它是空的
-    index = faiss.IndexFlatIP(embedding_dim)
-    print("已重置为新的 FAISS 精确搜索索引")
-    
-    # 添加向量到索引（不使用 IDs）
-    if len(all_vectors) > 0:
-        vectors_array = np.array(all_vectors).astype('float32')
-        index.add(vectors_array)
-        print(f"批量添加到 FAISS 成功，共添加 {vectors_array.shape[0]} 个向量。")
+    return pending_items
+
+
+def _snippet_faiss_id(file_path):
+    snippet_faiss_id = int(hashlib.sha1(file_path.encode("utf-8")).hexdigest(), 16) % (2**31 - 1)
+    if snippet_faiss_id < 0:
+        snippet_faiss_id *= -1
+    return snippet_faiss_id
+
+
+def _content_hash(file_path, meta_info, description, code_content):
+    """示例内容指纹，增量同步时用来判断示例是否被修改"""
+    raw = json.dumps([file_path, description, code_content, meta_info], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _build_documents(pending_items, vectors):
+    """组装 (faiss_id, vector, mongo_document) 列表，跳过维度不匹配的向量"""
+    documents_for_faiss_and_mongo = []
+    for (file_path, meta_info, description, code_content), vector in zip(pending_items, vectors):
+        if vector.shape[0] != embedding_dim:
+            print(f"警告: 向量维度不匹配 ({vector.shape[0]} != {embedding_dim})，跳过文件 {file_path}")
+            continue
+
+        snippet_faiss_id = _snippet_faiss_id(file_path)
         
-        # 保存索引到文件
-        faiss.write_index(index, index_file)
-        print(f"FAISS 索引已保存到 {index_file}")
-    else:
-        print("没有向量可以添加到 FAISS。")
+        mongo_document = {
+            "faiss_id": snippet_faiss_id,
+            "file_path": file_path, 
+            "code": code_content,
+            "meta_info": meta_info, # meta_info 包含了 description 和处理后的 vtkjs_modules
+            "content_hash": _content_hash(file_path, meta_info, description, code_content),
+            "embedding": vector.tolist() 
+        }
+
+        documents_for_faiss_and_mongo.append((snippet_faiss_id, vector, mongo_document))
+    return documents_for_faiss_and_mongo
+
 
-    # 清空 MongoDB 集合并重新插入数据
-    mongo_manager.collection.delete_many({})
-    mongo_documents_to_insert = [item[2] for item in documents_for_faiss_and_mongo]
-    if mongo_documents_to_insert:
+# 全量重建与增量同步互斥
+_sync_lock = threading.Lock()
+
+
+def load_data_from_directory(directory, index_file="faiss_index.index"):
+    """
+    从指定目录读取所有文件并添加到数据库（全量重建）。
+    与 sync_data_from_directory 共用 _sync_lock，两者不会同时执行。
+    """
+    with _sync_lock:
+        _rebuild_from_directory(directory, index_file)
+
+
+def _rebuild_from_directory(directory, index_file):
+    """全量重建（调用方需持有 _sync_lock）"""
+    global index
+
+    if not os.path.isdir(directory):
+        print(f"错误: 目录不存在或不是一个有效目录: {directory}")
+        return
+
+    print(f"开始从目录加载数据: {directory}")
+    
+    # 先收集所有示例，再批量计算 description 的向量
+    pending_items = _collect_examples(directory)
+    vectors = embed_texts_batched([item[2] for item in pending_items])
+    documents_for_faiss_and_mongo = _build_documents(pending_items, vectors)
+
+    # 按配置的索引类型在新对象上建索引，建好后再替换全局索引，建索引期间检索不受影响
+    vectors_array = np.array([item[1] for item in documents_for_faiss_and_mongo], dtype='float32').reshape(-1, embedding_dim)
+    faiss_ids_array = np.array([item[0] for item in documents_for_faiss_and_mongo], dtype='int64')
+    new_index = ann_index.build_index(vectors_array, faiss_ids_array)
+
+    # 1. 先 upsert 全部文档：替换索引前后，检索命中的 faiss_id 都能取到文档
+    if documents_for_faiss_and_mongo:
         try:
-            mongo_manager.collection.insert_many(mongo_documents_to_insert)
+            mongo_manager.collection.create_index("faiss_id")
+            mongo_manager.collection.bulk_write(
+                [pymongo.ReplaceOne({"faiss_id": faiss_id}, document, upsert=True)
+                 for faiss_id, _, document in documents_for_faiss_and_mongo],
+                ordered=False)
         except Exception as e:
-            print(f"批量插入到 MongoDB 失败: {e}")
+            # 文档写入失败时保留旧索引和旧文档，不做替换
+            print(f"批量写入 MongoDB 失败，保留原有索引: {e}")
+            return
     else:
         print("没有文档可以插入到 MongoDB。")
+
+    # 2. 保存并替换全局索引
+    if vectors_array.shape[0] > 0:
+        print(f"批量添加到 FAISS 成功，共添加 {vectors_array.shape[0]} 个向量。")
+    else:
+        print("没有向量可以添加到 FAISS。")
+    _write_index_atomic(new_index, index_file)
+    print(f"FAISS 索引已保存到 {index_file}")
+    index = new_index
+    reset_position_faiss_ids()
+
+    # 3. 最后删除新索引中已不存在的文档
+    mongo_manager.collection.delete_many({"faiss_id": {"$nin": faiss_ids_array.tolist()}})
     
     print("数据加载完成。")
 
 
+def sync_data_from_directory(directory, index_file="faiss_index.index"):
+    """
+    增量同步示例目录到 FAISS 和 MongoDB。
+    通过 content_hash 与库中文档对比：只为新增或修改过的示例计算向量，
+    从索引中 remove_ids 已删除或修改的条目再 add_with_ids 新向量，MongoDB 端批量 upsert / 删除。
+    更新在索引副本上进行，完成后替换全局索引并原子写入文件，同步期间检索照常进行。
+
+    以下情况退回全量重建：旧版不带 ID 的索引、索引类型不支持删除（HNSW）、
+    索引与 MongoDB 中的条目数不一致。
+
+    Returns:
+        dict: {"added", "updated", "removed", "unchanged", "full_rebuild"}
+    """
+    global index
+
+    if not os.path.isdir(directory):
+        print(f"错误: 目录不存在或不是一个有效目录: {directory}")
+        return None
+
+    with _sync_lock:
+        if index.ntotal == 0:
+            load_faiss_index(index_file)
+        current_index = index
+        stored = {doc['faiss_id']: doc.get('content_hash') for doc in
+                  mongo_manager.collection.find({}, {'faiss_id': 1, 'content_hash': 1, '_id': 0})}
+
+        if ann_index.uses_positional_labels(current_index) or not ann_index.supports_remove(current_index) \
+                or current_index.ntotal != len(stored):
+            print("当前索引无法增量更新，执行全量重建...")
+            _rebuild_from_directory(directory, index_file)
+            return {"added": index.ntotal, "updated": 0, "removed": 0, "unchanged": 0, "full_rebuild": True}
+
+        print(f"开始增量同步目录: {directory}")
+        pending_items = _collect_examples(directory)
+        current_ids = set()
+        changed_items = []
+        added = updated = 0
+        for item in pending_items:
+            faiss_id = _snippet_faiss_id(item[0])
+            current_ids.add(faiss_id)
+            stored_hash = stored.get(faiss_id)
+            if stored_hash == _content_hash(*item):
+                continue
+            if faiss_id not in stored:
+                added += 1
+            else:
+                updated += 1
+            changed_items.append(item)
+        removed_ids = [faiss_id for faiss_id in stored if faiss_id not in current_ids]
+        unchanged = len(pending_items) - len(changed_items)
+
+        if not changed_items and not removed_ids:
+            print(f"没有变化，{unchanged} 个示例保持不变。")
+            return {"added": 0, "updated": 0, "removed": 0, "unchanged": unchanged, "full_rebuild": False}
+
+        vectors = embed_texts_batched([item[2] for item in changed_items])
+        documents_for_faiss_and_mongo = _build_documents(changed_items, vectors)
+
+        # 1. 先 upsert 新增/修改的文档，旧索引命中这些 ID 时也能取到文档
+        if documents_for_faiss_and_mongo:
+            mongo_manager.collection.create_index("faiss_id")
+            mongo_manager.collection.bulk_write(
+                [pymongo.ReplaceOne({"faiss_id": faiss_id}, document, upsert=True)
+                 for faiss_id, _, document in documents_for_faiss_and_mongo],
+                ordered=False)
+
+        # 2. 在索引副本上删除旧向量、添加新向量，完成后替换全局索引并保存
+        new_index = faiss.clone_index(current_index)
+        stale_ids = removed_ids + [faiss_id for faiss_id, _, _ in documents_for_faiss_and_mongo if faiss_id in stored]
+        if stale_ids:
+            new_index.remove_ids(np.array(stale_ids, dtype='int64'))
+        if documents_for_faiss_and_mongo:
+            new_index.add_with_ids(
+                np.array([item[1] for item in documents_for_faiss_and_mongo], dtype='float32'),
+                np.array([item[0] for item in documents_for_faiss_and_mongo], dtype='int64'))
+        ann_index.set_search_params(new_index)
+        _write_index_atomic(new_index, index_file)
+        index = new_index
+        reset_position_faiss_ids()
+
+        # 3. 最后删除已不存在的示例文档
+        if removed_ids:
+            mongo_manager.collection.delete_many({"faiss_id": {"$in": removed_ids}})
+
+        print(f"增量同步完成: 新增 {added}，修改 {updated}，删除 {len(removed_ids)}，未变化 {unchanged}。"
+              f"索引中当前有 {index.ntotal} 个向量。")
+        return {"added": added, "updated": updated, "removed": len(removed_ids),
+                "unchanged": unchanged, "full_rebuild": False}
+
+
+def _write_index_atomic(target_index, index_file):
+    """先写临时文件再 os.replace，避免进程中断时留下写了一半的索引文件"""
+    index_dir = os.path.dirname(index_file)
+    if index_dir:
+        os.makedirs(index_dir, exist_ok=True)
+    tmp_file = f"{index_file}.tmp"
+    faiss.write_index(target_index, tmp_file)
+    os.replace(tmp_file, index_file)
+
+
 def load_faiss_index(index_file="faiss_index.index"):
     """从文件加载FAISS索引"""
     global index
     try:
         if os.path.exists(index_file):
-            index = faiss.read_index(index_file)
+            index = ann_index.set_search_params(faiss.read_index(index_file))
+            reset_position_faiss_ids()
             print(f"FAISS 索引已从 {index_file} 加载")
             return True
         else:
@@ -768,7 +969,7 @@ def save_faiss_index(index_file="faiss_index.index"):
     """保存FAISS索引到文件"""
     global index
     try:
-        faiss.write_index(index, index_file)
+        _write_index_atomic(index, index_file)
         print(f"FAISS 索引已保存到 {index_file}")
     except Exception as e:
         print(f"保存 FAISS 索引时出错: {e}")
@@ -1075,7 +1276,23 @@ def save_rag_results_to_excel(input_file="res2.xlsx", output_file="res2.xlsx", r
 
 
 if __name__ == '__main__':
-    index_file = "faiss_index.index"
+    import argparse
+
+    parser = argparse.ArgumentParser(description="构建示例向量库并运行检索实验")
+    parser.add_argument('--sync', nargs='?', const=DATA_DIR, metavar='DIR',
+                        help="增量同步示例目录（默认 DATA_DIR）到索引和 MongoDB 后退出")
+    parser.add_argument('--rebuild', nargs='?', const=DATA_DIR, metavar='DIR',
+                        help="全量重建示例目录（默认 DATA_DIR）的索引和 MongoDB 后退出")
+    parser.add_argument('--index-file', default="faiss_index.index")
+    args = parser.parse_args()
+    index_file = args.index_file
+
+    if args.sync:
+        print(f"同步结果: {sync_data_from_directory(args.sync, index_file)}")
+        raise SystemExit(0)
+    if args.rebuild:
+        load_data_from_directory(args.rebuild, index_file)
+        raise SystemExit(0)
     
     # 尝试加载已存在的索引
     if not load_faiss_index(index_file) or index.ntotal == 0:
@@ -6,6 +6,8 @@ import time
 import pandas as pd
 import os
 from config.app_config import app_config
+from RAG.query_analyzer import get_query_analyzer
+from RAG.lazy_handle import LazyHandle
 
 # --- 配置区域 ---
 # 由于不再使用语义相似度，我们可以调整权重策略
@@ -59,8 +61,8 @@ class MongoDBManager:
             print(f"MongoDB Query Error: {e}")
             return []
 
-# 初始化 MongoDB 管理器
-mongo_manager = MongoDBManager(DB_HOST, DB_PORT, DB_NAME, COLLECTION_NAME)
+# MongoDB 管理器句柄（首次访问时才连接）
+mongo_manager = LazyHandle(lambda: MongoDBManager(DB_HOST, DB_PORT, DB_NAME, COLLECTION_NAME), "MongoDB (embedding_v4)")
 
 
 # --- 不需要的功能置空或保留接口 ---
@@ -79,38 +81,10 @@ def load_data_from_directory(directory, index_file=None):
 def analyze_query(query: str):
     """
     分析用户查询，提取潜在的 VTK.js 模块。
+    使用预编译 + LRU 缓存的共享分析器（见 RAG/query_analyzer.py）。
     """
-    analyzed_data = {
-        "modules": []
-    }
-
-    lower_query = query.lower()
-
-    # 1. 正则提取 VTK.js 模块名称
-    module_patterns = [
-        r"vtk\.?[\w\.]*?vtk([A-Z]\w+)", # 匹配 vtk.Namespace.vtkClassName 或 vtkClassName
-        r"vtk\.[a-z]+\.[a-z]+\.[a-zA-Z]+", # 匹配完整路径
-        r"(vtk[A-Z]\w+)" # 匹配独立 vtkClassName
-    ]
-    for pattern in module_patterns:
-        matches = re.findall(pattern, query, re.IGNORECASE)
-        for match in matches:
-            if isinstance(match, str) and match.lower().startswith('vtk.'): 
-                last_part = match.split('.')[-1]
-                if last_part.lower().startswith('vtk'):
-                    analyzed_data['modules'].append(last_part)
-            elif isinstance(match, str) and match.lower().startswith('vtk'):
-                analyzed_data['modules'].append(match)
-
-    # 2. 常用模块简写匹配
     common_modules_short = app_config.VTKJS_COMMON_APIS if hasattr(app_config, 'VTKJS_COMMON_APIS') else []
-    for mod in common_modules_short:
-        if mod.lower() in lower_query and mod not in analyzed_data['modules']:
-            if re.search(r'\b' + re.escape(mod.lower()) + r'\b', lower_query):
-                 analyzed_data['modules'].append(mod)
-
-    # 去重
-    analyzed_data['modules'] = list(set([mod for mod in analyzed_data['modules']]))
+    analyzed_data = get_query_analyzer(common_modules_short).analyze(query)
 
     print(f"Analyzed query modules: {analyzed_data['modules']}")
     return analyzed_data
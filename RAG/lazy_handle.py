@@ -0,0 +1,56 @@
+import threading
+import time
+
+'''
+延迟初始化句柄
+模块级的重量级全局对象（嵌入模型、MongoDB 连接）在 import 时只创建句柄，
+第一次访问属性时才调用工厂函数真正创建，import 本身不再有副作用。
+'''
+
+
+class LazyHandle:
+    """
+    用法: model = LazyHandle(lambda: HuggingFaceEmbeddings(...), "嵌入模型")
+    之后 model.embed_query(...) 等属性访问会透明地转发到真实对象。
+    """
+
+    def __init__(self, factory, name=None):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_name', name or getattr(factory, '__name__', 'object'))
+        object.__setattr__(self, '_target', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+        object.__setattr__(self, 'init_seconds', None)
+
+    def get(self):
+        """返回真实对象（首次调用时创建，线程安全）"""
+        target = self._target
+        if target is None:
+            with self._lock:
+                target = self._target
+                if target is None:
+                    start_time = time.time()
+                    target = self._factory()
+                    object.__setattr__(self, 'init_seconds', time.time() - start_time)
+                    object.__setattr__(self, '_target', target)
+                    print(f"[LazyHandle] {self._name} 初始化完成，耗时 {self.init_seconds:.2f}秒")
+        return target
+
+    @property
+    def is_initialized(self):
+        return self._target is not None
+
+    def reset(self, target=None):
+        """丢弃当前对象（下次访问时重新创建），或直接替换为 target"""
+        with self._lock:
+            object.__setattr__(self, '_target', target)
+
+    def __getattr__(self, name):
+        # 只有在自身属性中找不到时才会进入这里
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.get(), name, value)
+
+    def __repr__(self):
+        state = repr(self._target) if self._target is not None else '未初始化'
+        return f"<LazyHandle {self._name}: {state}>"
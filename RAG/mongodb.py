@@ -1,11 +1,37 @@
 import pymongo
 from pymongo.results import InsertOneResult, UpdateResult, DeleteResult
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, Iterable
 
 # 连接到本地 MongoDB 实例
 # 建议将连接字符串作为参数或环境变量，以提高灵活性和安全性
 # client = pymongo.MongoClient('mongodb://localhost:27017/')
 
+# 批量查询时默认不取回向量字段（检索结果用不到，且体积最大）
+DEFAULT_PROJECTION = {'embedding': 0}
+
+
+def find_docs_by_faiss_ids(collection, faiss_ids: Iterable[int],
+                           projection: Optional[Dict[str, Any]] = DEFAULT_PROJECTION) -> List[Optional[Dict[str, Any]]]:
+    """
+    用一次 $in 查询取回一批 FAISS 命中对应的文档，替代逐条 find_one。
+    Args:
+        collection: pymongo 集合。
+        faiss_ids (Iterable[int]): FAISS 返回的 ID，按相似度排序。
+        projection: 查询投影，默认排除 embedding 字段。
+    Returns:
+        List[Optional[Dict[str, Any]]]: 与 faiss_ids 顺序一致的文档列表，未找到的位置为 None。
+        同一 ID 出现多次时返回各自独立的副本。
+    """
+    faiss_ids = [int(i) for i in faiss_ids]
+    if not faiss_ids:
+        return []
+    by_id = {}
+    for doc in collection.find({'faiss_id': {'$in': list(dict.fromkeys(faiss_ids))}}, projection):
+        # 与 find_one 一致：重复的 faiss_id 取第一条
+        by_id.setdefault(doc.get('faiss_id'), doc)
+    return [dict(by_id[i]) if i in by_id else None for i in faiss_ids]
+
+
 # 更好的实践：使用上下文管理器或在程序结束时显式关闭连接
 # 对于脚本，可以保持当前方式，但对于长期运行的服务，需要考虑连接池和关闭
 class MongoDBManager:
@@ -64,6 +90,17 @@ class MongoDBManager:
             raise
 
 
+    def find_code_snippets_by_faiss_ids(self, faiss_ids: Iterable[int]) -> List[Optional[Dict[str, Any]]]:
+        """
+        按 FAISS ID 批量查询文档（一次往返），结果顺序与输入一致。
+        """
+        try:
+            return find_docs_by_faiss_ids(self.collection, faiss_ids)
+        except pymongo.errors.PyMongoError as e:
+            print(f"批量查询文档时发生错误: {e}")
+            raise
+
+
     def update_code_snippet(self, filter_query: Dict[str, Any], update_data: Dict[str, Any]) -> UpdateResult:
         """
         更新单个文档。
@@ -0,0 +1,115 @@
+import re
+import threading
+from collections import OrderedDict
+
+'''查询分析器：从查询文本中提取 VTK.js 模块关键词（各代检索器共用）'''
+
+# 模块名称正则（与原 analyze_query 保持一致）
+MODULE_PATTERNS = [
+    r"vtk\.?[\w\.]*?vtk([A-Z]\w+)",  # 匹配 vtk.Namespace.vtkClassName 或 vtkClassName
+    r"vtk\.[a-z]+\.[a-z]+\.[a-zA-Z]+",  # 匹配 vtk.Rendering.Core.vtkActor 这种完整路径
+    r"(vtk[A-Z]\w+)"  # 匹配独立的 vtkClassName 如 vtkImageSlice
+]
+
+
+class QueryAnalyzer:
+    """
+    预编译的查询分析器。
+    - 模块正则只编译一次；
+    - 常用 API 列表合并为一个 \\b(?:...)\\b 交替正则，一次扫描即可找出所有整词命中；
+    - 相同子查询文本的分析结果缓存在有界 LRU 中（召回和重排序会分析同一批子查询）。
+    结果与原先逐个 re.search 的实现完全一致。
+    """
+
+    def __init__(self, common_apis=None, cache_size=1024):
+        self.common_apis = list(common_apis or [])
+        self.module_patterns = [re.compile(p, re.IGNORECASE)
+                                for p in MODULE_PATTERNS]
+
+        # 由单词字符组成的 API 名合并进交替正则（长的在前），其余单独编译
+        word_apis = sorted({api.lower() for api in self.common_apis if re.fullmatch(r'\w+', api)},
+                           key=len, reverse=True)
+        self.api_pattern = re.compile(
+            r'\b(?:' + '|'.join(re.escape(a) for a in word_apis) + r')\b') if word_apis else None
+        self.other_api_patterns = {
+            api: re.compile(r'\b' + re.escape(api.lower()) + r'\b')
+            for api in self.common_apis if not re.fullmatch(r'\w+', api)
+        }
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _analyze(self, query):
+        modules = []
+
+        # 1. 正则提取 VTK.js 模块名称
+        for pattern in self.module_patterns:
+            for match in pattern.findall(query):
+                # 对于如 vtk.Rendering.Core.vtkActor，需要提取 vtkActor
+                if isinstance(match, str) and match.lower().startswith('vtk.'):
+                    last_part = match.split('.')[-1]
+                    if last_part.lower().startswith('vtk'):
+                        modules.append(last_part)
+                elif isinstance(match, str) and match.lower().startswith('vtk'):
+                    modules.append(match)
+
+        # 2. 常用模块简写匹配（完整单词），按 API 列表顺序加入
+        lower_query = query.lower()
+        found_words = set(self.api_pattern.findall(lower_query)) if self.api_pattern else set()
+        for mod in self.common_apis:
+            if mod in modules:
+                continue
+            pattern = self.other_api_patterns.get(mod)
+            if pattern is not None:
+                if pattern.search(lower_query):
+                    modules.append(mod)
+            elif mod.lower() in found_words:
+                modules.append(mod)
+
+        # 去重
+        return list(set(modules))
+
+    def analyze(self, query):
+        """返回 {"modules": [...]}，每次返回新的字典，调用方可以随意修改"""
+        query = query or ''
+        with self._lock:
+            modules = self._cache.get(query)
+            if modules is not None:
+                self._cache.move_to_end(query)
+                self.hits += 1
+        if modules is None:
+            modules = self._analyze(query)
+            with self._lock:
+                self.misses += 1
+                self._cache[query] = modules
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return {"modules": list(modules)}
+
+
+_analyzers = {}
+_analyzers_lock = threading.Lock()
+
+
+def get_query_analyzer(common_apis=None):
+    """按 API 列表共享分析器实例"""
+    if common_apis is None:
+        from config.app_config import app_config
+        common_apis = app_config.VTKJS_COMMON_APIS
+    key = tuple(common_apis)
+    analyzer = _analyzers.get(key)
+    if analyzer is None:
+        with _analyzers_lock:
+            analyzer = _analyzers.get(key)
+            if analyzer is None:
+                try:
+                    from config.app_config import app_config
+                    cache_size = getattr(app_config, 'QUERY_ANALYZER_CACHE_SIZE', 1024)
+                except ImportError:
+                    cache_size = 1024
+                analyzer = QueryAnalyzer(key, cache_size=cache_size)
+                _analyzers[key] = analyzer
+    return analyzer
@@ -5,16 +5,18 @@ import sys
 import os
 import json
 import pandas as pd
-from RAG.embedding_v3_1 import index, load_faiss_index
+from RAG import embedding_v3_1
+from RAG.embedding_v3_1 import load_faiss_index
 
 # 添加项目根目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # 导入embedding_v3_1.py中的函数
 from RAG.embedding_v3_1 import search_code_optimized, search_code_optimized_with_stages, analyze_query as embedding_analyze_query, rerank_results
-from RAG.embedding_v3_1 import embed_text, mongo_manager, index, embedding_dim
+from RAG.embedding_v3_1 import embed_text, mongo_manager, embedding_dim
 from RAG.embedding_v3_1 import K, Similarity_Threshold
 from config.app_config import app_config
+from RAG.context_compressor import compress_snippets, render_scaffold
 from config.ollama_config import ollama_config
 from llm_agent.prompt_agent import analyze_query as prompt_analyze_query
 import time
@@ -306,8 +308,8 @@ class VTKSearcherV2:
         支持提示词拓展后的新格式（包含 description、vtk_modules 等字段）。
         同时记录初筛和重排序的结果。
         """
-        # 检查FAISS索引是否已加载
-        if index.ntotal == 0:
+        # 检查FAISS索引是否已加载（索引加载/重建后会替换模块全局变量，需通过模块访问）
+        if embedding_v3_1.index.ntotal == 0:
             print("检测到FAISS索引未加载，正在尝试加载...")
             load_faiss_index("faiss_index.index")
             
@@ -387,9 +389,17 @@ class VTKSearcherV2:
         
         # 从检索结果中提取相关信息并格式化
         if search_results:
+            codes = [result.get("code", "N/A") for result in search_results]
+            if len(codes) > 1 and getattr(app_config, 'CONTEXT_COMPRESS_SHARED', True):
+                # 多个示例共有的脚手架代码只输出一次，示例中用引用标记代替
+                compressed = compress_snippets(codes)
+                if compressed["blocks"]:
+                    context_parts.append(render_scaffold(compressed["blocks"]))
+                    codes = [body if isinstance(code, str) else code
+                             for code, body in zip(codes, compressed["bodies"])]
             for j, result in enumerate(search_results):
                 meta = result.get("meta_info", {})
-                code = result.get("code", "N/A")
+                code = codes[j]
                 description = meta.get("description", "N/A")
                 vtkjs_modules = meta.get("vtkjs_modules", "N/A")
                 # 构建单个结果的上下文信息
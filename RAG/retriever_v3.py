@@ -2,6 +2,9 @@ import pymongo
 import json
 import re
 import time
+import threading
+from collections import deque
+import numpy as np
 import pandas as pd
 import os
 from typing import List, Dict, Any
@@ -31,24 +34,102 @@ except ImportError:
 
 # --- 导入必要的模块 ---
 from RAG.vtk_code_meta_extract import extract_vtkjs_meta, get_project_root
+from RAG.query_analyzer import get_query_analyzer
+from RAG.context_packer import pack_examples, get_token_budget, prepare_code, estimate_tokens
+from RAG.context_compressor import compress_snippets, precompute_fingerprints, render_scaffold, expand_blocks
 
 # --- 数据库管理类 ---
 
 
 class MongoDBManager:
-    def __init__(self, host, port, db_name, collection_name):
+    def __init__(self, host, port, db_name, collection_name, max_pool_size=None,
+                 server_selection_timeout_ms=None, retry_interval=None):
+        """
+        连接在第一次访问 collection 时才建立（import 本模块不再阻塞在连接上）。
+        连接失败后 collection 为 None，retry_interval 秒后的下一次访问会重新尝试连接，
+        而不是永久失效。
+        """
+        self.host = host
+        self.port = port
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.max_pool_size = max_pool_size or getattr(app_config, 'MONGO_MAX_POOL_SIZE', 50)
+        self.server_selection_timeout_ms = server_selection_timeout_ms or \
+            getattr(app_config, 'MONGO_SERVER_SELECTION_TIMEOUT_MS', 2000)
+        self.retry_interval = retry_interval if retry_interval is not None else \
+            getattr(app_config, 'MONGO_RETRY_INTERVAL', 10)
+        self.client = None
+        self.db = None
+        self._collection = None
+        self.last_error = None
+        self._failed_at = None
+        self._connect_lock = threading.Lock()
+
+    def _connect(self):
+        client = None
         try:
-            self.client = pymongo.MongoClient(
-                host, port, serverSelectionTimeoutMS=2000)
-            self.db = self.client[db_name]
-            self.collection = self.db[collection_name]
+            client = pymongo.MongoClient(
+                self.host, self.port,
+                maxPoolSize=self.max_pool_size,
+                serverSelectionTimeoutMS=self.server_selection_timeout_ms)
             # 测试连接
-            self.client.server_info()
-            print(
-                f"MongoDBManager initialized. Connected to DB: {db_name}, Collection: {collection_name}")
+            client.admin.command('ping')
         except Exception as e:
             print(f"Error connecting to MongoDB: {e}")
-            self.collection = None
+            if client is not None:
+                client.close()
+            self.last_error = str(e)
+            self._failed_at = time.time()
+            return None
+
+        self.client = client
+        self.db = client[self.db_name]
+        self._collection = self.db[self.collection_name]
+        self.last_error = None
+        self._failed_at = None
+        print(
+            f"MongoDBManager initialized. Connected to DB: {self.db_name}, Collection: {self.collection_name} "
+            f"(maxPoolSize={self.max_pool_size})")
+        return self._collection
+
+    @property
+    def collection(self):
+        """共享的集合对象（连接池由 MongoClient 维护）；MongoDB 不可用时为 None"""
+        if self._collection is not None:
+            return self._collection
+        with self._connect_lock:
+            if self._collection is not None:
+                return self._collection
+            if self._failed_at is not None and time.time() - self._failed_at < self.retry_interval:
+                # 刚失败过，暂不重连，避免每个请求都等待连接超时
+                return None
+            return self._connect()
+
+    @property
+    def is_connected(self):
+        return self._collection is not None
+
+    def ping(self):
+        """
+        检查 MongoDB 是否可用（会在需要时建立连接）。
+        :return: (是否可用, 错误信息)
+        """
+        if self.collection is None:
+            return False, self.last_error
+        try:
+            self.client.admin.command('ping')
+            return True, None
+        except Exception as e:
+            self.last_error = str(e)
+            return False, self.last_error
+
+    def close(self):
+        with self._connect_lock:
+            if self.client is not None:
+                self.client.close()
+            self.client = None
+            self.db = None
+            self._collection = None
 
     def find_docs_by_modules(self, modules):
         """
@@ -82,8 +163,147 @@ class MongoDBManager:
             return []
 
 
-# 初始化全局 MongoDB 管理器
+class CorpusIndex:
+    """
+    语料库内存快照 + 倒排索引。
+    一次性从 MongoDB 加载全部文档，建立 {模块名(小写): 文档ID集合} 的倒排表，
+    召回时对各模块的倒排链求并集，避免每个子查询都对集合做正则全表扫描。
+    匹配语义与 MongoDBManager.find_docs_by_modules 一致：忽略大小写的后缀匹配。
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.docs = {}            # {doc_id: doc}
+        self.doc_order = {}       # {doc_id: 在集合中的自然顺序}，保证召回顺序与原查询一致
+        self.postings = {}        # {module_lower: set(doc_id)}
+        self._suffix_cache = {}   # {query_module_lower: [module_lower, ...]}
+        self.loaded = False
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _doc_id(doc):
+        did = doc.get("faiss_id")
+        if did is None:
+            did = doc.get("file_path") or doc.get(
+                "meta_info", {}).get("file_path")
+        if did is None:
+            did = str(doc.get("_id"))
+        return did
+
+    def refresh(self):
+        """重新加载快照（initialize_database 重建集合后会调用）"""
+        if self.manager.collection is None:
+            print("CorpusIndex: MongoDB 不可用，无法加载语料快照")
+            return False
+
+        try:
+            all_docs = list(self.manager.collection.find({}))
+        except Exception as e:
+            print(f"CorpusIndex: 加载语料快照失败: {e}")
+            return False
+
+        docs = {}
+        doc_order = {}
+        postings = {}
+        for position, doc in enumerate(all_docs):
+            did = self._doc_id(doc)
+            if did in docs:
+                continue
+            docs[did] = doc
+            doc_order[did] = position
+
+            doc_modules = doc.get("meta_info", {}).get('vtkjs_modules', [])
+            if isinstance(doc_modules, str):
+                doc_modules = [doc_modules]
+            for m in doc_modules:
+                if isinstance(m, str) and m:
+                    postings.setdefault(m.lower(), set()).add(did)
+
+        # 整体替换引用，检索线程始终看到一致的快照
+        with self._lock:
+            self.docs = docs
+            self.doc_order = doc_order
+            self.postings = postings
+            self._suffix_cache = {}
+            self.loaded = True
+            self.loaded_at = time.time()
+
+        print(f"CorpusIndex: 已加载 {len(docs)} 个文档，{len(postings)} 个模块键")
+        if getattr(app_config, 'CONTEXT_COMPRESS_SHARED', True):
+            # 预先计算（精简后）代码的行指纹，拼接 Prompt 时去重只需比较哈希
+            reduce = getattr(app_config, 'CONTEXT_REDUCE_CODE', True)
+            count = precompute_fingerprints(prepare_code(doc.get("code"), reduce) for doc in docs.values())
+            print(f"CorpusIndex: 已预计算 {count} 个代码片段的行指纹")
+        return True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.refresh()
+        return self.loaded
+
+    def _resolve_module(self, module_lower, postings, suffix_cache):
+        """查询模块 -> 以其结尾的语料模块键（结果按查询缓存，快照刷新时清空）"""
+        keys = suffix_cache.get(module_lower)
+        if keys is None:
+            keys = [k for k in postings if k.endswith(module_lower)]
+            suffix_cache[module_lower] = keys
+        return keys
+
+    def find_docs_by_modules(self, modules):
+        """
+        与 MongoDBManager.find_docs_by_modules 返回相同的文档集合（按集合自然顺序），
+        但只在内存中做倒排链并集。返回浅拷贝，调用方可以放心写入打分字段。
+        """
+        if not modules or not self.ensure_loaded():
+            return []
+
+        docs, doc_order = self.docs, self.doc_order
+        postings, suffix_cache = self.postings, self._suffix_cache
+        hit_ids = set()
+        for m in modules:
+            if not m:
+                continue
+            for key in self._resolve_module(str(m).lower(), postings, suffix_cache):
+                hit_ids |= postings[key]
+
+        ordered_ids = sorted(hit_ids, key=lambda did: doc_order[did])
+        return [dict(docs[did]) for did in ordered_ids]
+
+
+# 全局 MongoDB 管理器（首次访问集合时才连接）
 mongo_manager = MongoDBManager(DB_HOST, DB_PORT, DB_NAME, COLLECTION_NAME)
+# 语料库内存索引（首次检索时加载）
+corpus_index = CorpusIndex(mongo_manager)
+
+
+def retrieval_health():
+    """
+    检索后端的就绪状态（供 /healthz 使用）。
+    ready 要求 MongoDB 可用且语料快照已加载、非空。
+    """
+    mongo_ok, mongo_error = mongo_manager.ping()
+    corpus_size = len(corpus_index.docs)
+    collection_size = None
+    if mongo_ok:
+        try:
+            collection_size = mongo_manager.collection.estimated_document_count()
+        except Exception as e:
+            mongo_error = str(e)
+    loaded_at = corpus_index.loaded_at
+    return {
+        "ready": bool(mongo_ok and corpus_index.loaded and corpus_size > 0),
+        "mongo": {"ok": mongo_ok, "error": mongo_error, "max_pool_size": mongo_manager.max_pool_size},
+        "corpus": {
+            "loaded": corpus_index.loaded,
+            "size": corpus_size,
+            "collection_size": collection_size,
+            # 快照与集合条数不一致说明集合在加载后被修改过
+            "stale": collection_size is not None and corpus_index.loaded and collection_size != corpus_size,
+            "loaded_at": loaded_at,
+            "age_seconds": time.time() - loaded_at if loaded_at else None,
+        },
+    }
 
 # --- 核心辅助函数 ---
 
@@ -91,42 +311,9 @@ mongo_manager = MongoDBManager(DB_HOST, DB_PORT, DB_NAME, COLLECTION_NAME)
 def analyze_query(query: str):
     """
     分析查询文本，提取潜在的 VTK.js 模块关键词。
+    使用预编译 + LRU 缓存的共享分析器（见 RAG/query_analyzer.py）。
     """
-    analyzed_data = {
-        "modules": []
-    }
-
-    lower_query = query.lower()
-
-    # 1. 正则提取 VTK.js 模块名称
-    module_patterns = [
-        # 匹配 vtk.Namespace.vtkClassName 或 vtkClassName
-        r"vtk\.?[\w\.]*?vtk([A-Z]\w+)",
-        r"vtk\.[a-z]+\.[a-z]+\.[a-zA-Z]+",  # 匹配完整路径
-        r"(vtk[A-Z]\w+)"  # 匹配独立 vtkClassName
-    ]
-    for pattern in module_patterns:
-        matches = re.findall(pattern, query, re.IGNORECASE)
-        for match in matches:
-            if isinstance(match, str) and match.lower().startswith('vtk.'):
-                last_part = match.split('.')[-1]
-                if last_part.lower().startswith('vtk'):
-                    analyzed_data['modules'].append(last_part)
-            elif isinstance(match, str) and match.lower().startswith('vtk'):
-                analyzed_data['modules'].append(match)
-
-    # 2. 常用模块简写匹配
-    common_modules_short = app_config.VTKJS_COMMON_APIS
-    for mod in common_modules_short:
-        if mod.lower() in lower_query and mod not in analyzed_data['modules']:
-            # 完整单词匹配
-            if re.search(r'\b' + re.escape(mod.lower()) + r'\b', lower_query):
-                analyzed_data['modules'].append(mod)
-
-    # 去重
-    analyzed_data['modules'] = list(
-        set([mod for mod in analyzed_data['modules']]))
-    return analyzed_data
+    return get_query_analyzer(app_config.VTKJS_COMMON_APIS).analyze(query)
 
 # --- 重排序核心逻辑类 ---
 
@@ -137,10 +324,22 @@ class WeightedRanker:
     是对【语料】进行排序，依据是文档解决了多少高权重的子查询需求。
     """
 
-    def __init__(self, raw_docs):
+    def __init__(self, raw_docs, vectorized=None):
         self.raw_docs = raw_docs  # 候选文档池（去重后的）
         self.doc_scores = {}      # 记录每个文档的得分 {doc_id: score}
         self.doc_details = {}     # 记录每个文档的匹配详情（用于解释/调试）
+        if vectorized is None:
+            vectorized = getattr(app_config, 'RERANK_VECTORIZED', True)
+        self.vectorized = vectorized
+
+    @staticmethod
+    def _get_doc_id(doc):
+        # 获取唯一ID，优先 FAISS ID，其次 File Path
+        doc_id = doc.get("faiss_id")
+        if doc_id is None:
+            doc_id = doc.get("file_path") or doc.get(
+                "meta_info", {}).get("file_path")
+        return doc_id
 
     def calculate_scores(self, query_list_with_weights):
         """
@@ -166,6 +365,15 @@ class WeightedRanker:
         if total_weight == 0:
             total_weight = 1
 
+        doc_ids = [self._get_doc_id(doc) for doc in self.raw_docs]
+        # 候选池中存在重复 ID 时（调用方未去重）退回逐个累加的实现
+        if self.vectorized and len(set(doc_ids)) == len(doc_ids):
+            self._calculate_scores_vectorized(valid_queries, doc_ids)
+        else:
+            self._calculate_scores_loop(valid_queries, doc_ids)
+
+    def _calculate_scores_loop(self, valid_queries, doc_ids):
+        """逐查询、逐文档的原始打分实现"""
         # 2. 遍历每个子查询（作为评分标准）
         for query_item in valid_queries:
             q_text = query_item.get('description', '')
@@ -179,13 +387,7 @@ class WeightedRanker:
                 continue
 
             # 3. 遍历所有候选文档，计算得分
-            for doc in self.raw_docs:
-                # 获取唯一ID，优先 FAISS ID，其次 File Path
-                doc_id = doc.get("faiss_id")
-                if doc_id is None:
-                    doc_id = doc.get("file_path") or doc.get(
-                        "meta_info", {}).get("file_path")
-
+            for doc, doc_id in zip(self.raw_docs, doc_ids):
                 # 计算该文档对当前查询的命中数 (Keywords Hit)
                 hits, matched_keywords = self._count_hits(doc, q_modules)
 
@@ -212,6 +414,107 @@ class WeightedRanker:
                     self.doc_details[doc_id]["all_matched_keywords"].update(
                         matched_keywords)
 
+    def _calculate_scores_vectorized(self, valid_queries, doc_ids):
+        """
+        向量化打分，结果与 _calculate_scores_loop 完全一致（得分、解释、关键词及并列顺序）。
+        1. 候选池的模块词表只解析一次，得到 文档×模块词表 关联矩阵 M；
+        2. 每个不同的查询模块只与词表做一次匹配，得到 词表×查询模块 矩阵 B，
+           文档命中矩阵 A = (M @ B > 0) | 描述包含；
+        3. 命中数 H = A @ Qm.T（文档×子查询），得分按子查询顺序累加 H[:, j] * w[j]。
+        """
+        # 解析子查询的模块（没有模块的子查询不参与打分）
+        queries = []
+        for query_item in valid_queries:
+            q_text = query_item.get('description', '')
+            q_modules = analyze_query(q_text).get('modules', [])
+            if q_modules:
+                queries.append(
+                    (q_text, query_item.get('parsed_weight'), q_modules))
+
+        if not queries or not self.raw_docs:
+            return
+
+        # 不同的查询模块（保持首次出现顺序）
+        unique_qms = list(dict.fromkeys(
+            qm for _, _, q_modules in queries for qm in q_modules))
+        qm_col = {qm: j for j, qm in enumerate(unique_qms)}
+
+        # 文档模块词表 + 文档×词表关联矩阵
+        vocab = {}
+        rows, cols = [], []
+        descs = []
+        for i, doc in enumerate(self.raw_docs):
+            meta = doc.get("meta_info", {})
+            doc_modules = meta.get('vtkjs_modules', [])
+            if isinstance(doc_modules, str):
+                doc_modules = doc_modules.split(',')
+            descs.append(meta.get('description', '').lower())
+            for dm in set(m.lower().strip() for m in doc_modules):
+                rows.append(i)
+                cols.append(vocab.setdefault(dm, len(vocab)))
+
+        n_docs = len(self.raw_docs)
+        M = np.zeros((n_docs, len(vocab)), dtype=np.int32)
+        M[rows, cols] = 1
+
+        # 词表×查询模块：模块名精确/后缀匹配
+        B = np.zeros((len(vocab), len(unique_qms)), dtype=np.int32)
+        qm_lowers = [qm.lower() for qm in unique_qms]
+        for dm, v in vocab.items():
+            for j, qm_lower in enumerate(qm_lowers):
+                # 处理 vtkActor -> Actor
+                if qm_lower == dm or dm.endswith(qm_lower.replace('vtk', '')):
+                    B[v, j] = 1
+
+        A = (M @ B) > 0
+        # 模块没匹配到时检查描述
+        if n_docs and qm_lowers:
+            desc_hit = np.char.find(
+                np.array(descs, dtype=str)[:, None],
+                np.array(qm_lowers, dtype=str)[None, :]) >= 0
+            A |= desc_hit
+
+        # 子查询×查询模块矩阵与权重向量
+        Qm = np.zeros((len(queries), len(unique_qms)), dtype=np.int32)
+        for k, (_, _, q_modules) in enumerate(queries):
+            for qm in q_modules:
+                Qm[k, qm_col[qm]] += 1
+        H = A.astype(np.int32) @ Qm.T    # 文档×子查询 命中数
+
+        hit_mask = H > 0
+        hit_docs = np.flatnonzero(hit_mask.any(axis=1))
+        if hit_docs.size == 0:
+            return
+
+        # 得分按子查询顺序累加，保证浮点结果与逐个累加一致
+        scores = np.zeros(n_docs, dtype=np.float64)
+        for k, (_, q_weight, _) in enumerate(queries):
+            scores += H[:, k] * q_weight
+
+        # 字典插入顺序与循环实现一致：先按首个命中的子查询，再按候选池顺序
+        first_query = hit_mask[hit_docs].argmax(axis=1)
+        order = hit_docs[np.lexsort((hit_docs, first_query))]
+
+        for i in order:
+            doc = self.raw_docs[i]
+            matches = []
+            all_matched = set()
+            for k in np.flatnonzero(hit_mask[i]):
+                q_text, q_weight, q_modules = queries[k]
+                matches.append(
+                    f"Query: '{q_text}' (w={q_weight}) -> Hit {int(H[i, k])} keys"
+                )
+                all_matched.update(
+                    qm for qm in q_modules if A[i, qm_col[qm]])
+
+            doc_id = doc_ids[i]
+            self.doc_scores[doc_id] = float(scores[i])
+            self.doc_details[doc_id] = {
+                "doc_obj": doc,
+                "matches": matches,
+                "all_matched_keywords": all_matched
+            }
+
     def _count_hits(self, doc, query_modules):
         """辅助函数：计算文档命中了多少个关键词"""
         meta = doc.get("meta_info", {})
@@ -363,6 +666,8 @@ def initialize_database(data_dir=None, force_reinit=False):
     try:
         mongo_manager.collection.insert_many(documents_to_insert)
         print(f"✓ 成功导入 {len(documents_to_insert)} 个文档")
+        # 集合已重建，刷新内存索引
+        corpus_index.refresh()
         return True
     except Exception as e:
         print(f"✗ 导入失败: {e}")
@@ -373,24 +678,47 @@ def initialize_database(data_dir=None, force_reinit=False):
 
 
 class VTKSearcherV3:
-    def __init__(self):
+    def __init__(self, history_size=None):
         """
         初始化 VTKSearcherV3。
         纯关键词检索 + 基于子查询权重的重排序。
+
+        Args:
+            history_size (int): 历史记录环形缓冲区的容量；None 表示不限（批量实验导出 Excel 时需要完整历史）。
         """
-        self.raw_results_history = []
-        self.reranked_results_history = []
-        self.retrieval_time_history = []  # 新增：记录每次检索的时间
+        self.raw_results_history = deque(maxlen=history_size)
+        self.reranked_results_history = deque(maxlen=history_size)
+        self.retrieval_time_history = deque(maxlen=history_size)  # 新增：记录每次检索的时间
+        self._history_lock = threading.Lock()
         print("VTKSearcherV3 initialized (Weighted Keyword Logic).")
 
-    def search(self, query: str, query_list: List[Dict]) -> str:
+    def warm_up(self):
+        """预加载语料库内存索引，避免首个请求承担加载开销"""
+        return corpus_index.ensure_loaded()
+
+    def health(self):
+        return retrieval_health()
+
+    def search(self, query: str, query_list: List[Dict], model_name: str = None) -> str:
+        """
+        执行检索并生成 Prompt（兼容旧接口，只返回 Prompt）。
+        """
+        return self.retrieve(query, query_list, model_name=model_name)["prompt"]
+
+    def retrieve(self, query: str, query_list: List[Dict], model_name: str = None) -> Dict[str, Any]:
         """
-        执行检索并生成 Prompt。
+        执行检索并生成 Prompt。本次检索的全部结果通过返回值交给调用方，
+        不依赖实例上的状态，可在多个请求线程间共享同一个实例。
 
         Args:
             query (str): 原始用户完整请求。
             query_list (List[Dict]): 分割后的子查询列表，需包含 'description' 和 'weight'。
                                      例如: [{'description': '画球', 'weight': 8}]
+            model_name (str): 生成代码的目标模型，用于确定示例上下文的 token 预算。
+
+        Returns:
+            Dict: {"prompt", "results"(重排后的文档), "raw_results"(各子查询召回), "retrieval_time",
+                   "context_stats"(上下文打包统计)}
         """
 
         # 记录检索开始时间
@@ -415,8 +743,8 @@ class VTKSearcherV3:
 
             analyzed = analyze_query(q_text)
 
-            # 数据库查询
-            docs = mongo_manager.find_docs_by_modules(
+            # 内存倒排索引召回（语义同 mongo_manager.find_docs_by_modules）
+            docs = corpus_index.find_docs_by_modules(
                 analyzed.get('modules', []))
 
             # 记录 Raw History
@@ -460,41 +788,119 @@ class VTKSearcherV3:
         # 为了兼容 raw_results_history 的结构（List[List]），
         # 我们这里将最终结果复制一份放入 rerank history，或者也可以按需调整结构。
         # 这里为了保持 VTKSearcherV1 的 Excel 导出逻辑，我们将最终结果作为"整体结果"存入。
-        self.raw_results_history.append(temp_raw_history)
-        self.reranked_results_history.append(
-            final_results)  # 注意：这里结构稍有变化，变为 List[Doc]
-        
         # 记录检索耗时
         search_duration = time.time() - search_start_time
-        self.retrieval_time_history.append(search_duration)
-        
+        with self._history_lock:
+            self.raw_results_history.append(temp_raw_history)
+            self.reranked_results_history.append(
+                final_results)  # 注意：这里结构稍有变化，变为 List[Doc]
+            self.retrieval_time_history.append(search_duration)
+
         # --- 阶段 3: 构建 Prompt (Context) ---
-        prompt = self._build_prompt(query, final_results)
-        return prompt
+        prompt, context_stats = self._build_prompt(query, final_results, model_name=model_name)
+        return {
+            "prompt": prompt,
+            "results": final_results,
+            "raw_results": temp_raw_history,
+            "retrieval_time": search_duration,
+            "context_stats": context_stats
+        }
 
-    def _build_prompt(self, user_query, results):
-        context_parts = []
+    @staticmethod
+    def _render_example(number, result, code):
+        meta = result.get("meta_info", {})
+        desc = meta.get("description", "N/A")
+        mods = meta.get("vtkjs_modules", [])
+        score = result.get("rerank_score", 0)
+        matched_keys = result.get("matched_keywords", [])
+
+        mods_str = ", ".join(mods) if isinstance(
+            mods, list) else str(mods)
+        keys_str = ", ".join(matched_keys)
+
+        return (
+            f"Example {number} (Score: {score:.2f}, Matches: {keys_str}):\n"
+            f"Description: {desc}\n"
+            f"Modules: {mods_str}\n"
+            f"Code:\n{code}\n"
+        )
+
+    @staticmethod
+    def _compress_codes(codes):
+        """
+        示例间共享脚手架去重。
+        :return: (压缩后的代码列表, 共享块, 各示例引用的块 ID)；没有可节省的内容时返回 (codes, [], None)
+        """
+        if len(codes) < 2 or not getattr(app_config, 'CONTEXT_COMPRESS_SHARED', True):
+            return codes, [], None
+        compressed = compress_snippets(codes)
+        if not compressed["blocks"]:
+            return codes, [], None
+        before = sum(estimate_tokens(c) for c in codes if isinstance(c, str))
+        after = (estimate_tokens(render_scaffold(compressed["blocks"]))
+                 + sum(estimate_tokens(c) for c in compressed["bodies"]))
+        if after >= before:
+            return codes, [], None
+        bodies = [body if isinstance(code, str) else code for code, body in zip(codes, compressed["bodies"])]
+        return bodies, compressed["blocks"], compressed["refs"]
+
+    def _build_prompt(self, user_query, results, model_name=None):
+        """
+        构建最终 Prompt。示例按分数从高到低在目标模型的 token 预算内贪心打包，
+        代码先经过结构化精简（去掉样式、注释等），多个示例共有的脚手架代码只在开头输出一次。
+        :return: (prompt, 打包统计)
+        """
+        context_stats = None
+        scaffold = ""
         if results:
-            for j, result in enumerate(results):
-                meta = result.get("meta_info", {})
-                code = result.get("code", "N/A")
-                desc = meta.get("description", "N/A")
-                mods = meta.get("vtkjs_modules", [])
-                score = result.get("rerank_score", 0)
-                matched_keys = result.get("matched_keywords", [])
-
-                mods_str = ", ".join(mods) if isinstance(
-                    mods, list) else str(mods)
-                keys_str = ", ".join(matched_keys)
-
-                context_parts.append(
-                    f"Example {j+1} (Score: {score:.2f}, Matches: {keys_str}):\n"
-                    f"Description: {desc}\n"
-                    f"Modules: {mods_str}\n"
-                    f"Code:\n{code}\n"
-                )
+            codes = [result.get("code", "N/A") for result in results]
+            packing = getattr(app_config, 'CONTEXT_PACKING_ENABLED', True)
+            if packing:
+                reduce = getattr(app_config, 'CONTEXT_REDUCE_CODE', True)
+                codes = [prepare_code(code, reduce) for code in codes]
+            codes, blocks, refs = self._compress_codes(codes)
+
+            if packing:
+                # 预算中先预留全部共享块，打包后只输出实际被引用的块
+                context_parts, context_stats = pack_examples(
+                    results, self._render_example, get_token_budget(model_name), codes=codes,
+                    reserved_tokens=estimate_tokens(render_scaffold(blocks)))
+                # 只输出被至少两个入选示例引用的块，其余块在示例中原样展开
+                usage = {}
+                for index in context_stats["packed_indices"] if refs else []:
+                    for block_id in refs[index]:
+                        usage[block_id] = usage.get(block_id, 0) + 1
+                used_ids = {block_id for block_id, count in usage.items() if count >= 2}
+                single_ids = set(usage) - used_ids
+                if context_stats["truncated"]:
+                    # 截断后的示例不再重新展开，保留它引用的全部块
+                    used_ids, single_ids = set(usage), set()
+                if single_ids:
+                    context_parts = [
+                        self._render_example(n + 1, results[index], expand_blocks(codes[index], blocks, single_ids))
+                        for n, index in enumerate(context_stats["packed_indices"])]
+                    context_stats["packed_tokens"] = (estimate_tokens(render_scaffold(blocks))
+                                                      + sum(estimate_tokens(part) for part in context_parts))
+                scaffold = render_scaffold(blocks, used_ids)
+                context_stats["packed_tokens"] = (context_stats["packed_tokens"]
+                                                  - estimate_tokens(render_scaffold(blocks))
+                                                  + estimate_tokens(scaffold))
+                context_stats["saved_tokens"] = max(0, context_stats["original_tokens"]
+                                                    - context_stats["packed_tokens"])
+                context_stats["scaffold_blocks"] = len(used_ids)
+                context_stats["scaffold_tokens"] = estimate_tokens(scaffold)
+                context_stats["model_name"] = model_name
+                print(f"[ContextPacker] {model_name or 'default'}: 打包 {context_stats['examples_packed']}/"
+                      f"{context_stats['examples_in']} 个示例，共享块 {len(used_ids)} 个，"
+                      f"{context_stats['packed_tokens']} tokens，节省 {context_stats['saved_tokens']} tokens")
+            else:
+                scaffold = render_scaffold(blocks)
+                context_parts = [self._render_example(j + 1, result, code)
+                                 for j, (result, code) in enumerate(zip(results, codes))]
+            if scaffold:
+                context_parts = [scaffold] + context_parts
         else:
-            context_parts.append("No relevant VTK.js examples found.")
+            context_parts = ["No relevant VTK.js examples found."]
 
         context_str = "\n" + "-"*80 + "\n".join(context_parts)
 
@@ -506,7 +912,7 @@ User Requirements:
 Relevant VTK.js Examples:
 {context_str}
 """
-        return final_prompt
+        return final_prompt, context_stats
 
 # --- Excel 处理逻辑 (保持兼容) ---
 
@@ -1,17 +1,25 @@
+import time
+
+# 进程启动时刻，用于统计启动耗时（需在其他模块导入之前记录）
+APP_START_TIME = time.time()
+
 import asyncio
 import datetime
 import json
-import time
+import threading
 
 from flask import Flask, render_template, stream_with_context, jsonify
 from flask import request, Response
 
 from config.app_config import app_config
-from llm_agent.ollma_chat import get_llm_response
-from llm_agent.rag_agent import RAGAgent
+from llm_agent.ollma_chat import get_llm_response, get_llm_response_stream, get_error_page
+from llm_agent.llm_clients import init_clients
+from llm_agent.rag_agent import get_rag_agent
 from flask_cors import CORS, cross_origin
 from llm_agent import evaluator_agent
-from utils.dataset import add_data, get_all_data, modify_object,get_object_by_id,modify_object_with_export
+from utils.dataset import add_data, get_all_data, modify_object,get_object_by_id,modify_object_with_export, iter_data, count_data
+from utils.job_queue import get_job_queue, JobCancelled
+from llm_agent.pipeline import run_generation_pipeline
 from llm_agent.prompt_agent import analyze_query
 from config.ollama_config import ollama_config
 import os
@@ -28,10 +36,50 @@ CORS(app, resources={
     r'/*': {
         'origins': '*',
         'methods': ['GET', 'POST', 'OPTIONS'],
-        'allow_headers': ['Content-Type']
+        'allow_headers': ['Content-Type'],
+        'expose_headers': ['X-Total-Count']
     }
 })
 
+# 启动时创建共享的 RAG Agent；语料索引在后台线程中预加载，加载完成前 /healthz 返回 503
+rag_agent = get_rag_agent()
+warm_up_state = {"done": False, "attempts": 0, "seconds": None}
+
+
+def _warm_up_in_background():
+    start_time = time.time()
+    while True:
+        warm_up_state["attempts"] += 1
+        try:
+            if rag_agent.warm_up():
+                break
+        except Exception as e:
+            print(f"[App] 检索后端预热失败: {e}")
+        time.sleep(app_config.MONGO_RETRY_INTERVAL)
+    warm_up_state["seconds"] = time.time() - start_time
+    warm_up_state["done"] = True
+    print(f"[App] 检索后端预热完成，耗时 {warm_up_state['seconds']:.2f}秒")
+
+
+threading.Thread(target=_warm_up_in_background, name="rag-warm-up", daemon=True).start()
+# 启动时为各 LLM 服务创建共享客户端（复用连接池）
+init_clients()
+# 生成任务在后台线程池中执行，/generate 立即返回 eval_id，前端通过 /jobs/<id> 轮询
+job_queue = get_job_queue()
+STARTUP_SECONDS = time.time() - APP_START_TIME
+print(f"[App] 启动完成，耗时 {STARTUP_SECONDS:.2f}秒")
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """就绪检查：检索后端（MongoDB + 语料快照）预热完成后返回 200，否则 503"""
+    status = rag_agent.health()
+    status["warm_up"] = dict(warm_up_state)
+    status["startup_seconds"] = STARTUP_SECONDS
+    status["ready"] = bool(status.get("ready") and warm_up_state["done"])
+    status["job_queue"] = job_queue.stats()
+    return jsonify(status), 200 if status["ready"] else 503
+
 
 @app.route('/upload', methods=["POST"])
 def upload():
@@ -54,11 +102,24 @@ def upload():
     return jsonify({'error': 'An error occurred while uploading the file'}), 500
 
 
-@app.route('/generate', methods=["POST"])
-def generation():
-    obj = request.json
-    print('case',obj)
-    eval_id = str(int(time.time()))
+_eval_id_lock = threading.Lock()
+_last_eval_id = 0
+
+
+def _new_eval_id():
+    """秒级时间戳形式的 eval_id；同一秒内的并发请求顺延到下一秒，保证进程内不重复（也用作任务 ID）"""
+    global _last_eval_id
+    with _eval_id_lock:
+        _last_eval_id = max(int(time.time()), _last_eval_id + 1)
+        return str(_last_eval_id)
+
+
+def _prepare_generation(obj, eval_id=None):
+    """
+    生成前的准备工作：构建记录、提示词拓展、RAG 检索。
+    返回 (data_dict, final_prompt)，data_dict 中已填好 final_prompt/analysis/retrieval_results。
+    """
+    eval_id = eval_id or _new_eval_id()
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     data_dict = {
         "path":obj['path'],
@@ -90,45 +151,182 @@ def generation():
     #         'loop_time':0,
     #         'error_log':''
     #     }
-    final_prompt=obj['prompt']
-    analysis=''
-    analysis_data = []  # 存储结构化的分析数据
-    retrieval_results = []
-    
-    if obj['workflow']['inquiryExpansion']:
-        analysis=analyze_query(obj['prompt'],model_name=ollama_config.inquiry_expansion_model,system=None)
-        print('prompt analysis (result):\n', analysis, '\n')
-        
-        # 保存结构化的分析数据供前端使用
-        # analysis 现在返回 list[dict]，每个 dict 包含: phase, step_name, vtk_modules, description
-        if isinstance(analysis, list):
-            analysis_data = analysis  # 直接保存结构化数据
-        else:
-            analysis_data = []  # 如果不是列表，返回空数组
-        print('analysis_data for frontend:\n', analysis_data, '\n')
-
+    # 提示词拓展、数据文件分析、RAG 检索按依赖关系并发执行（见 llm_agent/pipeline.py）
+    # analysis 为 list[dict]，每个 dict 包含: phase, step_name, vtk_modules, description
+    prepared = run_generation_pipeline(obj['prompt'], obj['workflow'], rag_agent,
+                                       model_name=obj.get('generator'),
+                                       expansion_model=ollama_config.inquiry_expansion_model)
+    final_prompt = prepared['final_prompt']
     if obj['workflow']['rag']:
-        # 如果没有启用提示词拓展，但启用了RAG，使用原始prompt
-        search_analysis = analysis if analysis else obj['prompt']
-        
-        rag_agent = RAGAgent(use_v3=True)  # 使用 retriever_v3
-        # 传递分析结果列表给 RAG agent
-        # RAG agent 会提取 description 和其他元信息用于检索
-        final_prompt = rag_agent.search(search_analysis, obj['prompt'])
         print('rag prompt\n',final_prompt)
-        
-        # Extract retrieval results for frontend display
-        retrieval_results = rag_agent.get_retrieval_metadata()
     
-    response = get_llm_response(final_prompt, obj['generator'],system=obj.get('generatorPrompt', ''))
-
-    data_dict['generated_code']=response
     data_dict['final_prompt']=final_prompt
-    data_dict['analysis']=analysis_data  # 返回结构化数据而不是文本
-    data_dict['retrieval_results']=retrieval_results
+    data_dict['analysis']=prepared['analysis']  # 返回结构化数据而不是文本
+    data_dict['retrieval_results']=prepared['retrieval_results']
+    data_dict['data_analysis']=prepared['data_analysis']
+    data_dict['pipeline_timings']=prepared['timings']
+    return data_dict, final_prompt
+
+
+def _run_generation_job(job, obj):
+    """
+    后台生成任务：拓展 + 检索 -> 流式生成（部分输出写入 job）-> 保存到数据集。
+    各阶段之间及每段输出后检查取消请求；取消的任务不保存。
+    """
+    job.set_stage('preparing')
+    data_dict, final_prompt = _prepare_generation(obj, eval_id=job.id)
+    job.info = {
+        'final_prompt': final_prompt,
+        'analysis': data_dict['analysis'],
+        'retrieval_results': data_dict['retrieval_results']
+    }
+    job.check_cancelled()
+
+    job.set_stage('generating')
+    parts = []
+    chunks = get_llm_response_stream(final_prompt, obj['generator'], system=obj.get('generatorPrompt', ''))
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            job.append_output(chunk)
+            job.check_cancelled()
+    except JobCancelled:
+        chunks.close()
+        raise
+    except Exception as e:
+        print(f'[Generate Job] {job.id} Error: {str(e)}')
+        job.error = str(e)
+        if not parts:
+            # 与同步接口一致，失败时保存错误页面
+            parts = [get_error_page(e)]
+
+    job.set_stage('saving')
+    data_dict['generated_code'] = "".join(parts)
     add_data(data_dict)
+    job.set_stage('done')
+    return data_dict
 
-    return Response(json.dumps(data_dict), content_type='application/json')
+
+@app.route('/generate', methods=["POST"])
+def generation():
+    """
+    提交生成任务，立即返回 {eval_id, job_id, status}（202），结果通过 /jobs/<job_id> 获取。
+    请求体中 wait=true（或 URL 参数 ?wait=1）时按原来的方式同步生成并直接返回完整记录。
+    """
+    obj = request.json
+    print('case',obj)
+    if obj.get('wait') or request.args.get('wait') in ('1', 'true'):
+        data_dict, final_prompt = _prepare_generation(obj)
+
+        response = get_llm_response(final_prompt, obj['generator'],system=obj.get('generatorPrompt', ''))
+
+        data_dict['generated_code']=response
+        add_data(data_dict)
+
+        return Response(json.dumps(data_dict), content_type='application/json')
+
+    eval_id = _new_eval_id()
+    job = job_queue.submit(lambda job: _run_generation_job(job, obj), job_id=eval_id, kind='generate')
+    return jsonify({'eval_id': eval_id, 'job_id': job.id, 'status': job.status}), 202
+
+
+@app.route('/jobs/<job_id>', methods=["GET"])
+def get_job(job_id):
+    """
+    查询任务状态与部分输出。URL 参数 offset 为已收到的输出长度，只返回其后的新内容。
+    任务已从内存中清除（或服务重启）时，从数据集中查找同一 eval_id 的已保存记录。
+    """
+    offset = request.args.get('offset', default=0, type=int)
+    job = job_queue.get(job_id)
+    if job is not None:
+        return jsonify(job.to_dict(offset=max(0, offset)))
+
+    data_item = get_object_by_id({'evalId': job_id})
+    if data_item is None:
+        return jsonify({'error': f'job not found: {job_id}'}), 404
+    return jsonify({'job_id': job_id, 'status': 'succeeded', 'stage': 'done', 'result': data_item})
+
+
+@app.route('/jobs/<job_id>/cancel', methods=["POST"])
+def cancel_job(job_id):
+    """取消排队中或执行中的任务（执行中的任务在当前输出片段后停止，不保存结果）"""
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': f'job not found: {job_id}'}), 404
+    return jsonify(job.to_dict(include_result=False))
+
+
+def _sse(event, data):
+    """格式化一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _job_event_stream(job, offset=0):
+    """
+    以 SSE 推送生成任务的进度：
+      meta  - 检索/拓展结果与 eval_id（准备阶段完成后）
+      stage - 任务阶段变化 {"stage": ...}
+      token - 新生成的代码片段 {"text": ...}
+      done  - 完整记录（已保存到数据集）
+      error - 任务失败或被取消 {"error": ..., "status": ...}
+    客户端断开只结束推送，任务继续在后台执行；重连时传入已收到的输出长度 offset。
+    """
+    stage = None
+    meta_sent = False
+    while True:
+        finished = job.finished
+        if job.stage != stage:
+            stage = job.stage
+            yield _sse('stage', {'stage': stage})
+        if not meta_sent and job.info:
+            meta_sent = True
+            yield _sse('meta', dict(job.info, eval_id=job.id))
+        output = job.partial_output
+        if len(output) > offset:
+            yield _sse('token', {'text': output[offset:]})
+            offset = len(output)
+        if finished:
+            break
+        if not job.wait_for_update(offset, stage, timeout=app_config.JOB_STREAM_HEARTBEAT):
+            # 心跳注释行，避免代理因长时间无数据断开连接
+            yield ": keep-alive\n\n"
+
+    if job.status == 'succeeded':
+        yield _sse('done', job.result)
+    else:
+        yield _sse('error', {'error': job.error or f'job {job.status}', 'status': job.status})
+
+
+def _sse_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/jobs/<job_id>/stream', methods=["GET"])
+def stream_job(job_id):
+    """以 SSE 推送任务进度（见 _job_event_stream），URL 参数 offset 为已收到的输出长度"""
+    offset = request.args.get('offset', default=0, type=int)
+    job = job_queue.get(job_id)
+    if job is not None:
+        return _sse_response(_job_event_stream(job, offset=max(0, offset)))
+
+    data_item = get_object_by_id({'evalId': job_id})
+    if data_item is None:
+        return jsonify({'error': f'job not found: {job_id}'}), 404
+    return _sse_response(iter([_sse('done', data_item)]))
+
+
+@app.route('/generate/stream', methods=["POST"])
+def generation_stream():
+    """
+    提交生成任务并直接以 SSE 推送进度（事件见 _job_event_stream）。
+    与 /generate + /jobs/<job_id>/stream 等价，生成同样在任务队列中执行。
+    """
+    obj = request.json
+    print('case (stream)',obj)
+    eval_id = _new_eval_id()
+    job = job_queue.submit(lambda job: _run_generation_job(job, obj), job_id=eval_id, kind='generate')
+    return _sse_response(_job_event_stream(job))
 
 @app.route('/retrieval', methods=["POST"])
 def handle_retrieval():
@@ -143,15 +341,9 @@ def handle_retrieval():
         print('[Retrieval API] Received analysis:', analysis)
         print('[Retrieval API] Received prompt:', prompt)
         
-        # 初始化 RAG Agent
-        rag_agent = RAGAgent(use_v3=True)
-        
-        # 执行检索
-        final_prompt = rag_agent.search(analysis, prompt)
+        # 执行检索（共享的 RAG Agent，结果随返回值带回）
+        final_prompt, retrieval_results = rag_agent.retrieve(analysis, prompt, model_name=obj.get('generator'))
         print('[Retrieval API] Generated prompt:', final_prompt[:200], '...')
-        
-        # 获取检索结果元数据
-        retrieval_results = rag_agent.get_retrieval_metadata()
         print(f'[Retrieval API] Found {len(retrieval_results)} retrieval results')
         
         return jsonify({
@@ -322,8 +514,45 @@ def get_models():
 
 @app.route('/get_all_data', methods=["GET"])
 def get_all():
-    data_list = get_all_data()
-    return Response(json.dumps(data_list), content_type='application/json')
+    """
+    返回评测记录（JSON 数组，流式输出）。不带参数时与原先完全一致，返回全部记录的完整字段。
+    可选查询参数：
+      offset, limit                 分页
+      generator, evaluator          按模型筛选
+      workflow.<标志>=true|false    按流程开关筛选，如 workflow.rag=true
+      eval_time_from, eval_time_to  评测时间范围（"YYYY-mm-dd HH:MM:SS"）
+      fields                        字段投影，逗号分隔，如 fields=eval_id,name,score
+    响应头 X-Total-Count 为满足筛选条件的总记录数（不受分页影响）。
+    """
+    args = request.args
+    try:
+        offset = int(args.get('offset', 0))
+        limit = int(args['limit']) if args.get('limit') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'offset/limit must be integers'}), 400
+
+    workflow = {
+        key[len('workflow.'):]: value.lower() == 'true'
+        for key, value in args.items() if key.startswith('workflow.')
+    }
+    filters = {
+        'generator': args.get('generator'),
+        'evaluator': args.get('evaluator'),
+        'workflow': workflow,
+        'eval_time_from': args.get('eval_time_from'),
+        'eval_time_to': args.get('eval_time_to'),
+    }
+    fields = [f.strip() for f in args.get('fields', '').split(',') if f.strip()] or None
+
+    def generate():
+        # 逐条序列化，输出与 json.dumps(list) 相同
+        yield '['
+        for i, data_item in enumerate(iter_data(offset=offset, limit=limit, fields=fields, **filters)):
+            yield (', ' if i else '') + json.dumps(data_item)
+        yield ']'
+
+    return Response(generate(), content_type='application/json',
+                    headers={'X-Total-Count': str(count_data(**filters))})
 
 def read_directory_structure(base_path, current_path, include_content=False):
     """Read directory structure. Set include_content=True to load file contents."""
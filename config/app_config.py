@@ -31,13 +31,99 @@ class AppConfig:
             self.cst_apikey = ''
 
         self.eval_status = ['failed', 'completed']
-        self.DATASET_PATH = './utils/dataset/dataset.json'
+        self.DATASET_PATH = './utils/dataset/dataset.json'  # 旧的 JSON 数据集，首次启动时迁移到 SQLite
+        self.DATASET_DB_PATH = './utils/dataset/dataset.sqlite'
         self.VTKJS_COMMON_APIS = ["vtkCalculator", "vtkMapper", "vtkContourTriangulator", "vtkSampleFunction", "vtkImageMarchingCubes", "vtkImageMarchingSquares", "vtkImageSlice", "vtkImageMapper", "vtkImageStreamline", "vtkOutlineFilter", "vtkHttpDataSetReader", "vtkCylinderSource", "vtkTriangleFilter", "vtkVolumeMapper", "vtkVolumeActor", "vtkElevationReader",
                                   "vtkGCodeReader", "vtkOBJReader", "vtkMTLReader", "vtkPDBReader", "vtkMoleculeToRepresentation", "vtkXMLPolyDataReader", "vtkStickMapper", "vtkXMLImageDataWriter", "vtkXMLImageDataReader", "vtkXMLPolyDataWriter", "vtkGlyph3DMapper", "vtkRTAnalyticSource", "vtkSphereSource", "vtkSphereMapper", "vtkPlaneSource"]  # Added more based on query examples
 
         self.faissDB_path = 'data/faiss_cache'
         self.TRUNK_SIZE = 3000
         self.TRUNK_OVERLAP = 200
+        # 建索引时的批量嵌入参数
+        self.EMBEDDING_BATCH_SIZE = 64
+        self.EMBEDDING_NUM_THREADS = 4
+        # 文本向量缓存目录（按模型名分子目录）
+        self.EMBEDDING_CACHE_DIR = 'data/embedding_cache'
+        # FAISS 索引类型：flat（精确）/ ivf / hnsw / ivfpq，语料达到十万级时改用近似索引
+        self.ANN_INDEX_TYPE = 'flat'
+        self.ANN_NLIST = None  # None 表示按语料规模自动选择（约 4*sqrt(N)）
+        self.ANN_NPROBE = None  # None 表示自动（约 nlist/8）
+        self.ANN_HNSW_M = 32
+        self.ANN_HNSW_EF_CONSTRUCTION = 80
+        self.ANN_HNSW_EF_SEARCH = 64
+        self.ANN_PQ_M = 48  # 子空间个数，需整除向量维度
+        self.ANN_PQ_NBITS = 8
+        # 近似索引建好后与精确搜索对比 recall@k（抽样查询），结果打印在日志中
+        self.ANN_RECALL_CHECK = True
+        self.ANN_RECALL_CHECK_K = 10
+        self.ANN_RECALL_CHECK_QUERIES = 100
+
+        # 检索重排序：是否使用向量化（文档×模块关联矩阵）打分
+        self.RERANK_VECTORIZED = True
+        # 查询分析结果 LRU 缓存条目数
+        self.QUERY_ANALYZER_CACHE_SIZE = 1024
+        # 服务端检索器保留的检索历史条数（环形缓冲区）
+        self.SEARCH_HISTORY_SIZE = 50
+        # RAG 示例上下文打包：按生成模型的 token 预算贪心放入示例，并精简示例代码（去样式、注释）
+        self.CONTEXT_PACKING_ENABLED = True
+        self.CONTEXT_REDUCE_CODE = True
+        # 多个示例共有的脚手架代码（CDN 引用、渲染窗口初始化等）只输出一次，各示例中用 "// [Common Scaffold #n]" 引用
+        self.CONTEXT_COMPRESS_SHARED = True
+        self.CONTEXT_TOKEN_BUDGETS = {
+            'default': 12000,
+            'llama3.2-1b': 4000,
+            'qwen3-turbo': 8000,
+            'qwen3-coder-flash': 8000,
+        }
+        # MongoDB 连接池与重连（retriever_v3 首次访问时才连接）
+        self.MONGO_MAX_POOL_SIZE = 50
+        self.MONGO_SERVER_SELECTION_TIMEOUT_MS = 2000
+        self.MONGO_RETRY_INTERVAL = 10  # 秒，连接失败后多久再重试；也是启动预热的重试间隔
+
+        # LLM 回答缓存（默认关闭，批量实验脚本按调用开启）
+        self.LLM_CACHE_ENABLED = False
+        self.LLM_CACHE_PATH = 'data/llm_cache/llm_cache.sqlite'
+        self.LLM_CACHE_TTL = 30 * 24 * 3600  # 秒，None 表示永不过期
+        self.LLM_CACHE_MAX_ENTRIES = 100000
+
+        # LLM 客户端连接池（每个服务一个共享客户端）
+        self.LLM_HTTP_MAX_CONNECTIONS = 20
+        self.LLM_HTTP_MAX_KEEPALIVE = 10
+        self.LLM_HTTP_KEEPALIVE_EXPIRY = 60  # 秒
+        self.LLM_HTTP_TIMEOUT = 600  # 秒，代码生成的长回答需要较长超时
+
+        # 批量实验执行器：各服务并发数、限速（每秒请求数）与重试
+        self.LLM_BATCH_CONCURRENCY = {'qwen': 8, 'aihub': 4, 'cst': 4, 'ollama': 1, 'default': 4}
+        self.LLM_BATCH_RATE_LIMITS = {'qwen': 5.0, 'aihub': 2.0, 'cst': 2.0}
+        self.LLM_BATCH_MAX_RETRIES = 3
+        self.LLM_BATCH_BACKOFF_BASE = 1.0  # 秒
+        self.LLM_BATCH_BACKOFF_MAX = 30.0  # 秒
+
+        # /generate 后台任务队列：同时执行的生成任务数、内存中保留的已结束任务数
+        self.JOB_QUEUE_WORKERS = 4
+        self.JOB_QUEUE_MAX_FINISHED = 200
+        self.JOB_STREAM_HEARTBEAT = 15  # /jobs/<id>/stream 无新内容时发送心跳的间隔（秒）
+
+        # 生成前准备流程（llm_agent/pipeline.py）：阶段线程池大小、是否在提示词拓展期间用原始提示预先检索、是否分析提示中的数据文件
+        self.PIPELINE_MAX_WORKERS = 16
+        self.PIPELINE_SPECULATIVE_RETRIEVAL = True
+        # 数据分析结果会加入最终 Prompt（改变生成结果），默认关闭；请求的 workflow.dataAnalysis 可单独开启
+        self.PIPELINE_DATA_ANALYSIS = False
+        self.PIPELINE_DATA_ANALYSIS_TIMEOUT = 60  # 数据分析阶段超时（秒），超时后不再等待，直接生成
+        # 数据文件分析结果缓存（按 URL + ETag/Last-Modified/内容哈希校验，LRU 淘汰）
+        self.DATA_ANALYSIS_CACHE_ENABLED = True
+        self.DATA_ANALYSIS_CACHE_PATH = 'data/analysis_cache/analysis_cache.sqlite'
+        self.DATA_ANALYSIS_CACHE_MAX_ENTRIES = 500
+        # 数据文件流式下载：临时目录（含断点续传的 .part 文件）、大小上限、块大小、续传次数、连接池大小
+        self.DATA_DOWNLOAD_DIR = 'data/download_cache'
+        self.DATA_DOWNLOAD_MAX_BYTES = 8 * 1024 ** 3
+        self.DATA_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+        self.DATA_DOWNLOAD_RESUME_ATTEMPTS = 3
+        self.DATA_DOWNLOAD_POOL_SIZE = 10
+        # 数据文件统计模式：auto / exact / approx / header（见 VTKDataAnalyzer.analyze_vtk_file）
+        self.DATA_ANALYSIS_MODE = 'auto'
+        self.DATA_ANALYSIS_EXACT_MAX_VALUES = 50_000_000  # auto 模式下超过该值数的数组改用采样统计
+        self.DATA_ANALYSIS_MAX_SAMPLES = 1 << 20  # 采样统计的最大采样行数
 
 
 app_config = AppConfig()
@@ -231,7 +231,7 @@ def perform_retrieval(query: str, corpus: dict, model_name: str = "deepseek-v3")
 3. 返回结构化的JSON格式响应
 4. 不包含任何markdown或代码块标记"""
 
-        response = get_llm_response(prompt, model_name, system_prompt)
+        response = get_llm_response(prompt, model_name, system_prompt, use_cache=True)
         
         # 解析结构化响应
         parsed_response = parse_retrieval_response(response)
@@ -1,4 +1,4 @@
-import { post, get, postStream } from "@/api/request.js";
+import { post, get, postStream, getSSE } from "@/api/request.js";
 
 
 
@@ -12,8 +12,64 @@ function getCodeStream(data, load) {
 function getEvalResultStream(data, callback) {
     return postStream('/evaluate', data, callback)
 }
-function generateCodeStream(data, callback) {
-    return postStream('/generateStream', data, callback)
+/**
+ * 流式生成：提交后台生成任务（/generate），再通过 /jobs/<job_id>/stream 的 SSE 接收进度。
+ * 成功时以 { data: 生成记录 } 的形式返回（与 generateCode 一致）
+ * @param data
+ * @param handlers 可选：onMeta(检索/拓展结果与 eval_id)、onToken(代码片段, 已生成的代码)、onJob(任务 ID)
+ * @param signal 可选，AbortController.signal（只停止接收，任务需用 cancelJob 取消）
+ */
+async function generateCodeStream(data, handlers = {}, signal) {
+    const res = await post('/generate', data)
+    if (!res.data || !res.data.job_id) {
+        return res
+    }
+    handlers.onJob && handlers.onJob(res.data.job_id)
+    return streamJob(res.data.job_id, handlers, signal)
+}
+
+/**
+ * 接收任务的 SSE 进度直到结束；连接中断时从已收到的位置改为轮询
+ */
+async function streamJob(jobId, handlers = {}, signal) {
+    let record = null
+    let error = null
+    let output = ''
+    try {
+        await getSSE(`/jobs/${jobId}/stream`, {}, (event, payload) => {
+            switch (event) {
+                case 'meta':
+                    handlers.onMeta && handlers.onMeta(payload)
+                    break
+                case 'token':
+                    output += payload.text
+                    handlers.onToken && handlers.onToken(payload.text, output)
+                    break
+                case 'done':
+                    record = payload
+                    break
+                case 'error':
+                    error = payload.error
+                    break
+            }
+        }, signal)
+    } catch (e) {
+        if (signal && signal.aborted) {
+            throw e
+        }
+        console.warn('Job stream interrupted, falling back to polling:', e)
+        return waitForJob(jobId, (text, job) => {
+            if (text.length > output.length) {
+                const chunk = text.slice(output.length)
+                output = text
+                handlers.onToken && handlers.onToken(chunk, output)
+            }
+        })
+    }
+    if (record) {
+        return { data: record }
+    }
+    throw new Error(error || 'Generation stream ended unexpectedly')
 }
 
 /**
@@ -21,8 +77,48 @@ function generateCodeStream(data, callback) {
  * @param data
  * @returns {options}
  */
-function generateCode(data) {
-    return post('/generate', data)
+async function generateCode(data, onProgress) {
+    const res = await post('/generate', data)
+    // /generate 现在返回后台任务 ID（wait=true 时仍直接返回完整记录）
+    if (!res.data || !res.data.job_id) {
+        return res
+    }
+    return waitForJob(res.data.job_id, onProgress)
+}
+
+function getJob(jobId, offset = 0) {
+    return get(`/jobs/${jobId}`, { offset })
+}
+
+function cancelJob(jobId) {
+    return post(`/jobs/${jobId}/cancel`, {})
+}
+
+/**
+ * 轮询任务直到结束，成功时以 { data: 生成记录 } 的形式返回（与原同步接口一致）
+ * @param jobId
+ * @param onProgress 可选，onProgress(已生成的代码, 任务状态)
+ * @param interval 轮询间隔（毫秒）
+ */
+async function waitForJob(jobId, onProgress, interval = 1000) {
+    let output = ''
+    for (;;) {
+        const res = await getJob(jobId, output.length)
+        const job = res.data
+        if (job.partial_output) {
+            output += job.partial_output
+        }
+        if (onProgress) {
+            onProgress(output, job)
+        }
+        if (job.status === 'succeeded') {
+            return { ...res, data: job.result }
+        }
+        if (job.status === 'failed' || job.status === 'cancelled') {
+            throw new Error(job.error || `Generation ${job.status}`)
+        }
+        await new Promise(resolve => setTimeout(resolve, interval))
+    }
 }
 
 /**
@@ -33,8 +129,9 @@ function generateCode(data) {
 function getEvalResult(data) {
     return post('/evaluate', data)
 }
-function getAllCase() {
-    return get('/get_all_data', {})
+// params 可选：offset, limit, generator, evaluator, fields 等，见后端 /get_all_data
+function getAllCase(params = {}) {
+    return get('/get_all_data', params)
 }
 function handleCodeError(data) {
     return post('/code_error', data)
@@ -61,8 +158,12 @@ export {
     getCaseList,
     getEvalResultStream,
     generateCodeStream,
+    streamJob,
     getAllCase,
     generateCode,
+    getJob,
+    cancelJob,
+    waitForJob,
     handleCodeError,
     handleExport,
     handleErrorAnalysis,
@@ -33,4 +33,83 @@ function postStream(url,data,onProgress) {
         },
     })
 }
-export {post,postStream,get}
+/**
+ * 以 fetch + ReadableStream 读取 Server-Sent Events（axios 在浏览器中不支持 responseType: 'stream'）
+ * @param url
+ * @param init fetch 的请求参数
+ * @param onEvent onEvent(事件名, 解析后的 data)，每收到一条完整事件调用一次
+ */
+async function fetchSSE(url, init, onEvent) {
+    const response = await fetch(baseURL + url, init);
+    if (!response.ok || !response.body) {
+        throw new Error(`Request failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    const dispatch = (frame) => {
+        let event = 'message';
+        const dataLines = [];
+        for (const line of frame.split('\n')) {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).replace(/^ /, ''));
+            }
+        }
+        if (!dataLines.length) {
+            return;
+        }
+        const raw = dataLines.join('\n');
+        let payload = raw;
+        try {
+            payload = JSON.parse(raw);
+        } catch (e) {
+            // 非 JSON 数据按原文传递
+        }
+        onEvent(event, payload);
+    };
+
+    for (;;) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true }).replace(/\r\n/g, '\n');
+        // 事件之间以空行分隔，最后一段可能不完整，留到下次
+        let index;
+        while ((index = buffer.indexOf('\n\n')) !== -1) {
+            dispatch(buffer.slice(0, index));
+            buffer = buffer.slice(index + 2);
+        }
+    }
+    buffer += decoder.decode();
+    if (buffer.trim()) {
+        dispatch(buffer);
+    }
+}
+/**
+ * POST 请求体（JSON）并读取 SSE
+ * @param signal 可选，AbortController.signal，用于中止请求
+ */
+function postSSE(url, data, onEvent, signal) {
+    return fetchSSE(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+        body: JSON.stringify(data),
+        signal: signal
+    }, onEvent);
+}
+/**
+ * GET 请求并读取 SSE（params 拼接为查询参数）
+ */
+function getSSE(url, params, onEvent, signal) {
+    const query = new URLSearchParams(params || {}).toString();
+    return fetchSSE(query ? `${url}?${query}` : url, {
+        method: 'GET',
+        headers: { 'Accept': 'text/event-stream' },
+        signal: signal
+    }, onEvent);
+}
+export {post,postStream,postSSE,getSSE,get}
@@ -0,0 +1,168 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config.app_config import app_config
+
+'''
+数据文件分析结果的本地持久化缓存（VTKDataAnalyzer 使用）
+以 URL 为键，记录服务端的校验信息（ETag / Last-Modified / Content-Length）和文件内容的 SHA-256：
+- 再次分析同一 URL 时先发一个 HEAD（不支持 HEAD 时改用条件 GET）确认文件未变，直接返回缓存的分析结果；
+- 服务端不提供校验信息、需要重新下载时，内容哈希相同也不再重复解析文件；
+- 不同 URL 指向同一份内容时按内容哈希复用分析结果。
+按最近访问时间做 LRU 淘汰。
+'''
+
+
+class DataAnalysisCache:
+    def __init__(self, db_path, max_entries=None, version='1'):
+        """
+        :param db_path: SQLite 文件路径
+        :param max_entries: 最大缓存条数，超出后淘汰最久未访问的记录，None 表示不限
+        :param version: 分析结果格式版本，分析逻辑变化后旧记录自动失效
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.version = str(version)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS analysis_cache (
+                url TEXT NOT NULL,
+                version TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_length INTEGER,
+                content_hash TEXT,
+                filename TEXT,
+                analysis TEXT,
+                created_at REAL,
+                last_access REAL,
+                PRIMARY KEY (url, version)
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_analysis_cache_hash ON analysis_cache(content_hash)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_access ON analysis_cache(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def _row_to_entry(row):
+        url, etag, last_modified, content_length, content_hash, filename, analysis = row
+        return {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "content_length": content_length,
+            "content_hash": content_hash,
+            "filename": filename,
+            "analysis": json.loads(analysis),
+        }
+
+    def _version(self, variant=None):
+        """同一文件的不同分析方式（如统计模式）分别缓存"""
+        return f"{self.version}:{variant}" if variant else self.version
+
+    def get(self, url, variant=None):
+        """返回 URL 对应的缓存记录（含校验信息和分析结果），没有时返回 None。不更新命中统计"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, etag, last_modified, content_length, content_hash, filename, analysis "
+                "FROM analysis_cache WHERE url = ? AND version = ?", (url, self._version(variant))).fetchone()
+        return self._row_to_entry(row) if row is not None else None
+
+    def get_by_hash(self, content_hash, variant=None):
+        """按文件内容哈希查找已有的分析结果"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, etag, last_modified, content_length, content_hash, filename, analysis "
+                "FROM analysis_cache WHERE content_hash = ? AND version = ? "
+                "ORDER BY last_access DESC LIMIT 1", (content_hash, self._version(variant))).fetchone()
+        return self._row_to_entry(row) if row is not None else None
+
+    def touch(self, url, hit=True, variant=None):
+        """记录一次访问（用于 LRU 与命中统计）"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE analysis_cache SET last_access = ? WHERE url = ? AND version = ?",
+                (time.time(), url, self._version(variant)))
+            self._conn.commit()
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, url, analysis, etag=None, last_modified=None, content_length=None,
+            content_hash=None, filename=None, hit=False, variant=None):
+        """
+        :param hit: 分析结果是否来自缓存（按内容哈希复用），用于命中统计
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (url, version, etag, last_modified, content_length, "
+                "content_hash, filename, analysis, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, self._version(variant), etag, last_modified, content_length, content_hash, filename,
+                 json.dumps(analysis, ensure_ascii=False), now, now))
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        if self.max_entries is not None:
+            count = self._conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM analysis_cache WHERE rowid IN "
+                    "(SELECT rowid FROM analysis_cache ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,))
+
+    def delete(self, url):
+        with self._lock:
+            self._conn.execute("DELETE FROM analysis_cache WHERE url = ?", (url,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM analysis_cache")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size
+        }
+
+
+_analysis_cache = None
+_analysis_cache_lock = threading.Lock()
+
+
+def get_analysis_cache() -> DataAnalysisCache:
+    """进程内共享的缓存实例"""
+    global _analysis_cache
+    if _analysis_cache is None:
+        with _analysis_cache_lock:
+            if _analysis_cache is None:
+                _analysis_cache = DataAnalysisCache(
+                    app_config.DATA_ANALYSIS_CACHE_PATH,
+                    max_entries=app_config.DATA_ANALYSIS_CACHE_MAX_ENTRIES)
+    return _analysis_cache
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config.app_config import app_config
+from llm_agent.ollma_chat import call_llm, get_model_provider
+
+'''
+批量 LLM 调用执行器（用于基准实验）
+- 按服务限制并发数（asyncio.Semaphore）
+- 令牌桶限速
+- 失败后指数退避 + 随机抖动重试
+- 每完成一行就追加写入 JSONL 检查点，中断后可从检查点继续
+'''
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充的令牌数，capacity 为桶容量（允许的突发请求数）"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+
+def _task_key(task):
+    """检查点中用于校验的任务指纹（同一行的输入变了就不复用旧结果）"""
+    raw = json.dumps([task.get('model_name'), task.get('system'), task.get('prompt')],
+                     ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _default_worker(task):
+    return call_llm(task['prompt'], task['model_name'], task.get('system', ''),
+                    use_cache=task.get('use_cache'))
+
+
+class BatchLLMRunner:
+    def __init__(self, concurrency=None, rate_limits=None, max_retries=None,
+                 backoff_base=None, backoff_max=None, checkpoint_path=None):
+        """
+        :param concurrency: {服务名: 最大并发数}，'default' 为未列出服务的默认值
+        :param rate_limits: {服务名: 每秒请求数}，未列出的服务不限速
+        :param max_retries: 单个任务最大重试次数
+        :param checkpoint_path: JSONL 检查点路径，None 表示不写检查点
+        """
+        self.concurrency = dict(app_config.LLM_BATCH_CONCURRENCY)
+        self.concurrency.update(concurrency or {})
+        self.rate_limits = dict(app_config.LLM_BATCH_RATE_LIMITS)
+        self.rate_limits.update(rate_limits or {})
+        self.max_retries = app_config.LLM_BATCH_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = app_config.LLM_BATCH_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = app_config.LLM_BATCH_BACKOFF_MAX if backoff_max is None else backoff_max
+        self.checkpoint_path = checkpoint_path
+        self._checkpoint_lock = threading.Lock()
+
+    # --- 检查点 ---
+
+    def load_checkpoint(self):
+        """读取检查点中已成功的任务 {task_id: record}"""
+        done = {}
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return done
+        with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 中断时可能写了半行，忽略
+                    continue
+                if record.get('status') == 'success':
+                    done[str(record.get('id'))] = record
+        return done
+
+    def _write_checkpoint(self, record):
+        if not self.checkpoint_path:
+            return
+        with self._checkpoint_lock:
+            checkpoint_dir = os.path.dirname(self.checkpoint_path)
+            if checkpoint_dir:
+                os.makedirs(checkpoint_dir, exist_ok=True)
+            with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+                f.flush()
+
+    # --- 执行 ---
+
+    def _provider_of(self, task):
+        return task.get('provider') or get_model_provider(task.get('model_name')) or 'default'
+
+    async def _run_one(self, task, worker, semaphores, buckets, executor):
+        """
+        记录中的 elapsed 只统计最后一次调用 worker 的耗时（基准实验的延迟列），
+        total_elapsed 为包含排队、限速等待、失败重试与退避在内的总耗时。
+        """
+        provider = self._provider_of(task)
+        semaphore = semaphores[provider]
+        bucket = buckets.get(provider)
+        loop = asyncio.get_running_loop()
+        start_time = time.time()
+        call_elapsed = 0.0
+        last_error = None
+
+        for attempt in range(1, self.max_retries + 2):
+            async with semaphore:
+                if bucket is not None:
+                    await bucket.acquire()
+                call_start = time.time()
+                try:
+                    result = await loop.run_in_executor(executor, worker, task)
+                    call_elapsed = time.time() - call_start
+                    record = {
+                        "id": task['id'],
+                        "key": _task_key(task),
+                        "status": "success",
+                        "result": result,
+                        "attempts": attempt,
+                        "elapsed": call_elapsed,
+                        "total_elapsed": time.time() - start_time
+                    }
+                    self._write_checkpoint(record)
+                    return record
+                except Exception as e:
+                    call_elapsed = time.time() - call_start
+                    last_error = e
+                    print(f"[BatchRunner] 任务 {task['id']} 第{attempt}次调用失败: {e}")
+
+            if attempt <= self.max_retries:
+                # 指数退避 + 全抖动
+                delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+                await asyncio.sleep(random.uniform(0, delay))
+
+        record = {
+            "id": task['id'],
+            "key": _task_key(task),
+            "status": "failed",
+            "error": str(last_error),
+            "attempts": self.max_retries + 1,
+            "elapsed": call_elapsed,
+            "total_elapsed": time.time() - start_time
+        }
+        self._write_checkpoint(record)
+        return record
+
+    async def run_async(self, tasks, worker=None):
+        """
+        :param tasks: 任务列表，每个任务为 dict，需包含唯一的 'id'；
+                      默认 worker 还需要 'prompt'、'model_name'，可选 'system'、'use_cache'
+        :param worker: 同步函数 worker(task) -> 结果，在线程池中执行；默认调用 call_llm
+        :return: 与 tasks 顺序一致的结果记录列表
+        """
+        worker = worker or _default_worker
+        done = self.load_checkpoint()
+
+        providers = {self._provider_of(t) for t in tasks}
+        default_limit = self.concurrency.get('default', 4)
+        semaphores = {p: asyncio.Semaphore(self.concurrency.get(p, default_limit)) for p in providers}
+        buckets = {p: TokenBucket(self.rate_limits[p]) for p in providers if self.rate_limits.get(p)}
+
+        results = [None] * len(tasks)
+        pending = []
+        for i, task in enumerate(tasks):
+            record = done.get(str(task['id']))
+            if record is not None and record.get('key') == _task_key(task):
+                record['resumed'] = True
+                results[i] = record
+            else:
+                pending.append(i)
+
+        if len(pending) < len(tasks):
+            print(f"[BatchRunner] 从检查点恢复 {len(tasks) - len(pending)} 个任务")
+        print(f"[BatchRunner] 开始执行 {len(pending)} 个任务")
+
+        # 线程池大小与总并发数匹配，避免默认线程池成为瓶颈
+        max_workers = sum(self.concurrency.get(p, default_limit) for p in providers) or 1
+        # 使用本地线程池，不替换事件循环的默认线程池
+        batch_start = time.time()
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch") as executor:
+            records = await asyncio.gather(
+                *(self._run_one(tasks[i], worker, semaphores, buckets, executor) for i in pending))
+        for i, record in zip(pending, records):
+            results[i] = record
+
+        failed = sum(1 for r in records if r['status'] != 'success')
+        print(f"[BatchRunner] 完成 {len(records)} 个任务，失败 {failed} 个，"
+              f"耗时 {time.time() - batch_start:.2f}秒")
+        return results
+
+    def run(self, tasks, worker=None):
+        return asyncio.run(self.run_async(tasks, worker))
+
+
+def run_batch(tasks, worker=None, **kwargs):
+    """同步入口：BatchLLMRunner(**kwargs).run(tasks, worker)"""
+    return BatchLLMRunner(**kwargs).run(tasks, worker)
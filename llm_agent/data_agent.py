@@ -1,12 +1,87 @@
 import re
 import json
+import hashlib
+import threading
+import zlib
 import requests
-import pyvista as pv
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
 import numpy as np
 from typing import Dict, List, Any, Tuple
 import tempfile
 import os
 
+from config.app_config import app_config
+from llm_agent.analysis_cache import get_analysis_cache
+from llm_agent.vtk_stats import array_info, blocked_stats, sampled_stats, estimate_info, scan_xml_header
+
+# analyze_vtk_file 的统计模式
+ANALYSIS_MODES = ('auto', 'exact', 'approx', 'header')
+
+
+class DownloadTooLargeError(Exception):
+    """下载（或解压后）的文件超过大小上限"""
+    pass
+
+
+_session = None
+_session_lock = threading.Lock()
+_download_locks = {}
+
+
+def get_http_session() -> requests.Session:
+    """进程内共享的 HTTP 会话（复用连接池）"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=app_config.DATA_DOWNLOAD_POOL_SIZE,
+                                      pool_maxsize=app_config.DATA_DOWNLOAD_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def _download_lock(key):
+    """同一 URL 的下载串行执行（共用同一个 .part 文件）"""
+    with _session_lock:
+        return _download_locks.setdefault(key, threading.Lock())
+
+
+def _inflate(chunks, wbits):
+    """流式解压 gzip / deflate 数据块（支持多成员 gzip）"""
+    decoder = zlib.decompressobj(wbits)
+    for chunk in chunks:
+        while chunk:
+            data = decoder.decompress(chunk)
+            if data:
+                yield data
+            chunk = b''
+            if decoder.eof:
+                # 下一个 gzip 成员
+                chunk = decoder.unused_data
+                decoder = zlib.decompressobj(wbits)
+    data = decoder.flush()
+    if data:
+        yield data
+
+
+def _remove_files(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _read_chunks(path, chunk_size):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
 
 class VTKDataAnalyzer:
     """VTK数据分析工具
@@ -83,39 +158,282 @@ class VTKDataAnalyzer:
         Returns:
             (文件内容, 文件扩展名)
         """
+        path, filename, _, _ = VTKDataAnalyzer.download_to_file(url, timeout=timeout)
         try:
-            response = requests.get(url, timeout=timeout)
-            response.raise_for_status()
+            with open(path, 'rb') as f:
+                return f.read(), filename
+        finally:
+            os.remove(path)
+
+    @staticmethod
+    def _validators(headers) -> Dict[str, Any]:
+        """从响应头中取出用于判断文件是否变化的校验信息"""
+        length = headers.get('content-length')
+        return {
+            'etag': headers.get('etag'),
+            'last_modified': headers.get('last-modified'),
+            'content_length': int(length) if length and length.isdigit() else None
+        }
+
+    @staticmethod
+    def _filename(url: str, headers) -> str:
+        """从URL或Content-Type获取文件名（.gz 压缩文件返回解压后的文件名）"""
+        filename = url.split('/')[-1].split('?')[0]
+        if filename.lower().endswith('.gz'):
+            filename = filename[:-3]
+        if '.' not in filename:
+            content_type = headers.get('content-type', '')
+            ext_map = {
+                'xml': '.xml',
+                'vtp': '.vtp',
+                'vtu': '.vtu',
+                'vtk': '.vtk',
+                'vts': '.vts',
+                'vtr': '.vtr'
+            }
+            ext = next((ext for key, ext in ext_map.items() if key in content_type), '.vtu')
+            filename = f'data{ext}'
+        return filename
+
+    @staticmethod
+    def download_to_file(url: str, timeout: int = 30, max_bytes: int = None,
+                         chunk_size: int = None) -> Tuple[str, str, Dict[str, Any], str]:
+        """流式下载文件到磁盘，内存占用与文件大小无关
+        
+        - 按块写入 <下载目录>/<URL哈希>.part，连接中断后用 Range 请求从断点续传
+          （If-Range 保证服务端文件变化时重新下载），中断的 .part 文件下次调用时继续使用
+        - Content-Encoding 为 gzip/deflate 或 URL 以 .gz 结尾时，下载完成后按块解压
+        - 超过大小上限（原始数据或解压后）时抛出 DownloadTooLargeError
+        
+        Args:
+            url: 文件URL
+            timeout: 连接 / 读取超时时间（秒）
+            max_bytes: 大小上限，默认 app_config.DATA_DOWNLOAD_MAX_BYTES
+            chunk_size: 每次读写的块大小
             
-            # 从URL或Content-Disposition获取文件扩展名
-            filename = url.split('/')[-1].split('?')[0]
-            if '.' not in filename:
-                content_type = response.headers.get('content-type', '')
-                ext_map = {
-                    'xml': '.xml',
-                    'vtp': '.vtp',
-                    'vtu': '.vtu',
-                    'vtk': '.vtk',
-                    'vts': '.vts',
-                    'vtr': '.vtr'
-                }
-                ext = next((ext for key, ext in ext_map.items() if key in content_type), '.vtu')
-                filename = f'data{ext}'
+        Returns:
+            (文件路径, 文件名, 校验信息, 内容 SHA-256)。文件由调用方负责删除
+        """
+        max_bytes = max_bytes or app_config.DATA_DOWNLOAD_MAX_BYTES
+        chunk_size = chunk_size or app_config.DATA_DOWNLOAD_CHUNK_SIZE
+        download_dir = app_config.DATA_DOWNLOAD_DIR
+        os.makedirs(download_dir, exist_ok=True)
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        part_path = os.path.join(download_dir, key + '.part')
+        meta_path = part_path + '.json'
+        session = get_http_session()
+
+        with _download_lock(key):
+            attempts = 0
+            while True:
+                attempts += 1
+                # 断点续传：只在上次的响应未经压缩编码且带有校验信息时使用
+                meta = {}
+                if os.path.exists(part_path) and os.path.exists(meta_path):
+                    with open(meta_path, 'r', encoding='utf-8') as f:
+                        meta = json.load(f)
+                offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                validator = meta.get('etag') or meta.get('last_modified')
+                headers = {}
+                if offset and meta.get('url') == url and validator and not meta.get('content_encoding'):
+                    headers['Range'] = f'bytes={offset}-'
+                    headers['If-Range'] = validator
+
+                try:
+                    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                        if response.status_code == 416 and 'Range' in headers:
+                            # 断点已在文件末尾（上次在收尾阶段中断）：总长度一致时 .part 即完整文件，否则重新下载
+                            total = response.headers.get('content-range', '').rsplit('/', 1)[-1]
+                            if total.isdigit() and int(total) == offset:
+                                print(f"[VTKDataAnalyzer] 断点文件已完整: {url}")
+                                validators = {k: meta.get(k) for k in ('etag', 'last_modified', 'content_length')}
+                                filename = meta.get('filename') or VTKDataAnalyzer._filename(url, {})
+                                content_encoding = meta.get('content_encoding', '')
+                                break
+                            print(f"[VTKDataAnalyzer] 断点无效，重新下载: {url}")
+                            _remove_files(part_path, meta_path)
+                            continue
+                        response.raise_for_status()
+                        if response.status_code != 206:
+                            offset = 0
+                        validators = VTKDataAnalyzer._validators(response.headers)
+                        content_range = response.headers.get('content-range', '')
+                        if response.status_code == 206 and '/' in content_range:
+                            total = content_range.rsplit('/', 1)[1]
+                            validators['content_length'] = int(total) if total.isdigit() else None
+                        if validators['content_length'] and validators['content_length'] > max_bytes:
+                            raise DownloadTooLargeError(
+                                f"文件大小 {validators['content_length']} 超过上限 {max_bytes}")
+                        filename = VTKDataAnalyzer._filename(url, response.headers)
+                        content_encoding = response.headers.get('content-encoding', '').lower()
+                        if content_encoding == 'identity':
+                            content_encoding = ''
+                        meta = dict(validators, url=url, filename=filename, content_encoding=content_encoding)
+                        with open(meta_path, 'w', encoding='utf-8') as f:
+                            json.dump(meta, f)
+
+                        written = offset
+                        with open(part_path, 'ab' if offset else 'wb') as f:
+                            # decode_content=False：写入原始字节，断点位置与服务端一致，解压在下载完成后进行
+                            for chunk in response.raw.stream(chunk_size, decode_content=False):
+                                written += len(chunk)
+                                if written > max_bytes:
+                                    raise DownloadTooLargeError(f"下载数据超过上限 {max_bytes}")
+                                f.write(chunk)
+                    break
+                except DownloadTooLargeError:
+                    _remove_files(part_path, meta_path)
+                    raise
+                except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                        ProtocolError, ReadTimeoutError) as e:
+                    if attempts >= app_config.DATA_DOWNLOAD_RESUME_ATTEMPTS:
+                        raise Exception(f"下载文件失败: {str(e)}")
+                    print(f"[VTKDataAnalyzer] 下载中断，从断点续传 ({attempts}): {url}")
+                except requests.RequestException as e:
+                    # 不可重试的错误（如 4xx/5xx）：丢弃断点文件，避免之后每次都以同样的断点请求失败
+                    _remove_files(part_path, meta_path)
+                    raise Exception(f"下载文件失败: {str(e)}")
+
+            # 解压（传输层编码 + .gz 文件本身），边解压边计算哈希
+            wbits_list = []
+            if content_encoding == 'gzip':
+                wbits_list.append(31)
+            elif content_encoding == 'deflate':
+                wbits_list.append(47)  # 自动识别 zlib / gzip 头
+            if url.split('?')[0].lower().endswith('.gz'):
+                wbits_list.append(31)
+
+            fd, final_path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1], dir=download_dir)
+            digest = hashlib.sha256()
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    chunks = _read_chunks(part_path, chunk_size)
+                    for wbits in wbits_list:
+                        chunks = _inflate(chunks, wbits)
+                    size = 0
+                    for chunk in chunks:
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise DownloadTooLargeError(f"解压后的数据超过上限 {max_bytes}")
+                        digest.update(chunk)
+                        out.write(chunk)
+            except Exception:
+                os.remove(final_path)
+                raise
+            finally:
+                _remove_files(part_path, meta_path)
+
+        return final_path, filename, validators, digest.hexdigest()
+
+    @staticmethod
+    def _is_unchanged(entry: Dict[str, Any], url: str, timeout: int = 10) -> bool:
+        """用一次 HEAD 确认缓存记录对应的文件未变化；服务端不支持 HEAD 时改用条件 GET"""
+        if not entry.get('etag') and not entry.get('last_modified'):
+            return False
+        try:
+            response = get_http_session().head(url, timeout=timeout, allow_redirects=True)
+            if response.status_code in (405, 501):
+                headers = {}
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+                with get_http_session().get(url, headers=headers, timeout=timeout, stream=True) as conditional:
+                    return conditional.status_code == 304
+            if not response.ok:
+                return False
+        except requests.RequestException:
+            return False
+
+        current = VTKDataAnalyzer._validators(response.headers)
+        if entry.get('etag') and current['etag']:
+            return current['etag'] == entry['etag']
+        if entry.get('last_modified') and current['last_modified']:
+            return (current['last_modified'] == entry['last_modified']
+                    and (current['content_length'] is None or entry.get('content_length') is None
+                         or current['content_length'] == entry['content_length']))
+        return False
+
+    @classmethod
+    def analyze_url(cls, url: str, mode: str = None) -> Tuple[Dict[str, Any], str]:
+        """下载并分析 URL 对应的数据文件（结果经持久化缓存，不同统计模式分别缓存）
+        
+        Args:
+            url: 文件URL
+            mode: 统计模式，见 analyze_vtk_file
             
-            return response.content, filename
-        except Exception as e:
-            raise Exception(f"下载文件失败: {str(e)}")
+        Returns:
+            (分析结果, 缓存状态)。缓存状态为 hit（HEAD 校验未变化）、content_hit（重新下载但内容未变）或 miss
+        """
+        mode = mode or getattr(app_config, 'DATA_ANALYSIS_MODE', 'auto')
+        cache = get_analysis_cache() if getattr(app_config, 'DATA_ANALYSIS_CACHE_ENABLED', True) else None
+        entry = cache.get(url, variant=mode) if cache is not None else None
+        if entry is not None and cls._is_unchanged(entry, url):
+            cache.touch(url, variant=mode)
+            print(f"[VTKDataAnalyzer] 分析缓存命中: {url}")
+            return entry['analysis'], 'hit'
+
+        # 流式下载到磁盘上的临时文件
+        tmp_path, filename, validators, content_hash = cls.download_to_file(url)
+        try:
+            cached = None
+            if cache is not None:
+                if entry is not None and entry.get('content_hash') == content_hash:
+                    cached = entry
+                else:
+                    cached = cache.get_by_hash(content_hash, variant=mode)
+
+            if cached is not None:
+                analysis = cached['analysis']
+                cache_status = 'content_hit'
+            else:
+                # 分析VTK文件
+                analysis = cls.analyze_vtk_file(tmp_path, mode=mode)
+                cache_status = 'miss'
+        finally:
+            # 清理临时文件
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        if cache is not None:
+            cache.put(url, analysis, content_hash=content_hash, filename=filename,
+                      hit=cached is not None, variant=mode, **validators)
+        return analysis, cache_status
     
     @staticmethod
-    def analyze_vtk_file(file_path: str) -> Dict[str, Any]:
+    def analyze_vtk_file(file_path: str, mode: str = None) -> Dict[str, Any]:
         """分析VTK文件并提取关键信息
         
         Args:
             file_path: VTK文件路径
+            mode: 统计模式，默认 app_config.DATA_ANALYSIS_MODE
+                - exact:  读取全部数组，分块精确统计
+                - approx: 读取全部数组，采样统计（结果中 'estimate' 给出误差界）
+                - header: VTK XML 文件只读头部的 RangeMin / RangeMax，不加载数组；头部信息不完整时改用 approx
+                - auto:   能读头部时读头部，否则值数超过 DATA_ANALYSIS_EXACT_MAX_VALUES 的数组用采样统计
             
         Returns:
-            分析结果字典
+            分析结果字典（结构与精确统计相同，另含 'mode' 表示实际使用的模式）
         """
+        mode = mode or getattr(app_config, 'DATA_ANALYSIS_MODE', 'auto')
+        if mode not in ANALYSIS_MODES:
+            raise ValueError(f"未知的统计模式: {mode}，可选: {', '.join(ANALYSIS_MODES)}")
+        if mode in ('auto', 'header'):
+            header = scan_xml_header(file_path)
+            if header is not None:
+                return header
+            if mode == 'header':
+                print(f"[VTKDataAnalyzer] 无法只从头部获取完整信息，改用采样统计: {file_path}")
+                mode = 'approx'
+
+        exact_max_values = getattr(app_config, 'DATA_ANALYSIS_EXACT_MAX_VALUES', 50_000_000)
+        max_samples = getattr(app_config, 'DATA_ANALYSIS_MAX_SAMPLES', 1 << 20)
+
+        def approximate(array):
+            return mode == 'approx' or (mode == 'auto' and array.size > exact_max_values)
+
+        # pyvista 较重，只在真正分析文件时导入
+        import pyvista as pv
         try:
             mesh = pv.read(file_path)
         except Exception as e:
@@ -150,50 +468,37 @@ class VTKDataAnalyzer:
                     'type': str(type(val).__name__)
                 }
         
-        # 点数据
+        # 点数据（三分量向量另算模长范围；分块统计，不生成整个数组大小的临时数组）
         point_data_info = {}
         if mesh.point_data:
             for name, array in mesh.point_data.items():
-                dim = array.shape[1] if len(array.shape) > 1 else 1
-                min_val = float(np.min(array))
-                max_val = float(np.max(array))
-                
-                info = {
-                    'dimensions': int(dim),
-                    'data_type': str(array.dtype),
-                    'range': {
-                        'min': min_val,
-                        'max': max_val
-                    }
-                }
-                
-                # 如果是向量，计算模长
-                if dim == 3:
-                    magnitude = np.linalg.norm(array, axis=1)
-                    info['magnitude_range'] = {
-                        'min': float(np.min(magnitude)),
-                        'max': float(np.max(magnitude))
-                    }
-                
-                point_data_info[name] = info
+                point_data_info[name] = array_info(array, approximate=approximate(array),
+                                                   max_samples=max_samples)
         
         # 单元数据
         cell_data_info = {}
         if mesh.cell_data:
             for name, array in mesh.cell_data.items():
+                if approximate(array):
+                    stats = sampled_stats(array, max_samples=max_samples)
+                else:
+                    stats = blocked_stats(array)
                 cell_data_info[name] = {
                     'data_type': str(array.dtype),
                     'range': {
-                        'min': float(np.min(array)),
-                        'max': float(np.max(array))
+                        'min': stats['min'],
+                        'max': stats['max']
                     }
                 }
+                if not stats.get('exact', True):
+                    cell_data_info[name]['estimate'] = estimate_info(stats)
         
         return {
             'geometry': geometry_info,
             'field_data': field_data_info,
             'point_data': point_data_info,
-            'cell_data': cell_data_info
+            'cell_data': cell_data_info,
+            'mode': mode
         }
     
     @classmethod
@@ -217,12 +522,13 @@ class VTKDataAnalyzer:
         return recommendation
     
     @classmethod
-    def analyze_from_prompt(cls, prompt_text: str, download: bool = True) -> Dict[str, Any]:
+    def analyze_from_prompt(cls, prompt_text: str, download: bool = True, mode: str = None) -> Dict[str, Any]:
         """从提示词字符串中提取URL并分析VTK数据
         
         Args:
             prompt_text: 提示词字符串
             download: 是否下载文件进行分析
+            mode: 统计模式，见 analyze_vtk_file
             
         Returns:
             完整的分析结果
@@ -246,32 +552,21 @@ class VTKDataAnalyzer:
                 'status': 'success',
                 'error': None,
                 'analysis': None,
-                'module_recommendation': None
+                'module_recommendation': None,
+                'cache': None
             }
             
             try:
                 if download:
-                    # 下载文件
-                    file_content, filename = cls.download_file(url)
-                    
-                    # 保存到临时文件
-                    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename)[1], delete=False) as tmp:
-                        tmp.write(file_content)
-                        tmp_path = tmp.name
+                    # 下载并分析文件（同一文件未变化时直接使用缓存的分析结果）
+                    analysis, cache_status = cls.analyze_url(url, mode=mode)
+                    analysis_item['analysis'] = analysis
+                    analysis_item['cache'] = cache_status
                     
-                    try:
-                        # 分析VTK文件
-                        analysis = cls.analyze_vtk_file(tmp_path)
-                        analysis_item['analysis'] = analysis
-                        
-                        # 获取模块推荐
-                        data_type = analysis['geometry']['data_type']
-                        recommendation = cls.get_module_recommendations(data_type)
-                        analysis_item['module_recommendation'] = recommendation
-                    finally:
-                        # 清理临时文件
-                        if os.path.exists(tmp_path):
-                            os.remove(tmp_path)
+                    # 获取模块推荐
+                    data_type = analysis['geometry']['data_type']
+                    recommendation = cls.get_module_recommendations(data_type)
+                    analysis_item['module_recommendation'] = recommendation
             except Exception as e:
                 analysis_item['status'] = 'failed'
                 analysis_item['error'] = str(e)
@@ -281,6 +576,18 @@ class VTKDataAnalyzer:
         return result
 
 
+def _estimate_note(info: Dict[str, Any]) -> str:
+    """非精确统计的范围在输出中加注说明"""
+    estimate = info.get('estimate')
+    if not estimate:
+        return ""
+    if estimate.get('range_is_bound'):
+        return " (上界估计，来自文件头部)"
+    if estimate.get('method') == 'sampled':
+        return f" (采样估计，{estimate['sampled_rows']}/{estimate['total_rows']} 行)"
+    return " (来自文件头部)"
+
+
 def format_analysis_output(analysis_result: Dict[str, Any]) -> str:
     """格式化分析结果为可读的文本
     
@@ -328,7 +635,7 @@ def format_analysis_output(analysis_result: Dict[str, Any]) -> str:
                 for name, info in analysis['point_data'].items():
                     output.append(f"    - {name}:")
                     output.append(f"      维度: {info['dimensions']}")
-                    output.append(f"      范围: [{info['range']['min']:.6f}, {info['range']['max']:.6f}]")
+                    output.append(f"      范围: [{info['range']['min']:.6f}, {info['range']['max']:.6f}]{_estimate_note(info)}")
                     if 'magnitude_range' in info:
                         output.append(f"      向量模长范围: [{info['magnitude_range']['min']:.6f}, {info['magnitude_range']['max']:.6f}]")
             
@@ -336,7 +643,7 @@ def format_analysis_output(analysis_result: Dict[str, Any]) -> str:
             if analysis['cell_data']:
                 output.append(f"\n    [单元数据 (Cell Data)]")
                 for name, info in analysis['cell_data'].items():
-                    output.append(f"    - {name}: [{info['range']['min']:.6f}, {info['range']['max']:.6f}]")
+                    output.append(f"    - {name}: [{info['range']['min']:.6f}, {info['range']['max']:.6f}]{_estimate_note(info)}")
             
             # 模块推荐
             if item['module_recommendation']:
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from config.app_config import app_config
+
+'''
+LLM 回答的本地持久化缓存
+以 (model, system, prompt) 的哈希为键存储在 SQLite 中，支持过期时间和按条数淘汰，
+用于批量实验重复运行时避免重复调用远程模型。
+'''
+
+
+class LLMResponseCache:
+    def __init__(self, db_path, ttl=None, max_entries=None):
+        """
+        :param db_path: SQLite 文件路径
+        :param ttl: 过期时间（秒），None 表示永不过期
+        :param max_entries: 最大缓存条数，超出后淘汰最久未访问的记录，None 表示不限
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT,
+                created_at REAL,
+                last_access REAL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name, system, prompt):
+        raw = json.dumps([model_name, system or '', prompt], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, model_name, system, prompt):
+        """命中返回缓存的回答，否则返回 None"""
+        key = self.make_key(model_name, system, prompt)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                # 已过期
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, model_name, system, prompt, response):
+        key = self.make_key(model_name, system, prompt)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, str(model_name), response, now, now))
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, model_name, system, prompt):
+        key = self.make_key(model_name, system, prompt)
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self):
+        if self.ttl is not None:
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        if self.max_entries is not None:
+            count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size
+        }
+
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """进程内共享的缓存实例"""
+    global _llm_cache
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                _llm_cache = LLMResponseCache(
+                    app_config.LLM_CACHE_PATH,
+                    ttl=app_config.LLM_CACHE_TTL,
+                    max_entries=app_config.LLM_CACHE_MAX_ENTRIES)
+    return _llm_cache
@@ -0,0 +1,88 @@
+import threading
+
+import httpx
+from langchain_ollama import OllamaLLM
+from openai import OpenAI
+
+from config.app_config import app_config
+
+'''
+LLM 客户端注册表
+每个 OpenAI 兼容服务（按 base_url + api_key）只创建一个客户端，复用 keep-alive 连接池，
+避免每次调用都重新建立连接和 TLS 握手。
+'''
+
+# 服务名 -> (api_key 属性名, base_url 属性名)
+PROVIDERS = {
+    'deepseek': ('deepseek_apikey', 'deepseek_url'),
+    'qwen': ('qwen_apikey', 'qwen_url'),
+    'cst': ('cst_apikey', 'cst_url'),
+    'aihub': ('aihub_apikey', 'aihub_url'),
+}
+
+_clients = {}         # {(base_url, api_key): OpenAI}
+_ollama_llms = {}     # {model_name: OllamaLLM}
+_lock = threading.Lock()
+
+
+def _build_http_client():
+    limits = httpx.Limits(
+        max_connections=app_config.LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=app_config.LLM_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=app_config.LLM_HTTP_KEEPALIVE_EXPIRY,
+    )
+    return httpx.Client(limits=limits, timeout=app_config.LLM_HTTP_TIMEOUT)
+
+
+def get_client(provider: str) -> OpenAI:
+    """获取某个服务的共享客户端（base_url 与 api_key 都相同的服务共用一个）"""
+    if provider not in PROVIDERS:
+        raise ValueError(f"未知的LLM服务: {provider}")
+    key_attr, url_attr = PROVIDERS[provider]
+    base_url = getattr(app_config, url_attr)
+    api_key = getattr(app_config, key_attr)
+    cache_key = (base_url, api_key)
+
+    client = _clients.get(cache_key)
+    if client is None:
+        with _lock:
+            client = _clients.get(cache_key)
+            if client is None:
+                client = OpenAI(api_key=api_key,
+                                base_url=base_url,
+                                http_client=_build_http_client())
+                _clients[cache_key] = client
+                print(f"[LLM Clients] 已创建客户端: {provider} ({base_url})")
+    return client
+
+
+def get_ollama_llm(model_name) -> OllamaLLM:
+    """获取共享的 OllamaLLM 实例"""
+    llm = _ollama_llms.get(model_name)
+    if llm is None:
+        with _lock:
+            llm = _ollama_llms.get(model_name)
+            if llm is None:
+                llm = OllamaLLM(base_url=app_config.ollama_url, model=model_name)
+                _ollama_llms[model_name] = llm
+    return llm
+
+
+def init_clients():
+    """启动时为所有已配置的服务创建客户端"""
+    for provider in PROVIDERS:
+        try:
+            get_client(provider)
+        except Exception as e:
+            print(f"[LLM Clients] 创建 {provider} 客户端失败: {e}")
+
+
+def close_clients():
+    with _lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception as e:
+                print(f"[LLM Clients] 关闭客户端出错: {e}")
+        _clients.clear()
+        _ollama_llms.clear()
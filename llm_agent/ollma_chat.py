@@ -5,6 +5,8 @@ from langchain_ollama import OllamaLLM
 from urllib3 import response
 from config.app_config import app_config
 from config.ollama_config import ollama_config
+from llm_agent.llm_cache import get_llm_cache
+from llm_agent.llm_clients import get_client, get_ollama_llm
 from openai import OpenAI
 
 '''
@@ -22,38 +24,161 @@ class MyEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, o)
 
 
-# 获取模型回答的入口函数
+class LLMCallError(Exception):
+    """LLM 调用失败"""
+
+
+class ModelNotFoundError(LLMCallError):
+    """未找到对应的模型"""
+
+
+class OllamaCallError(LLMCallError):
+    """Ollama 调用失败"""
+
+
+def get_model_provider(model_name):
+    """返回模型所属的服务名（ollama/qwen/aihub/cst），未知模型返回 None"""
+    if model_name in ollama_config.models_ollama.keys():
+        return 'ollama'
+    elif model_name in ollama_config.models_qwen.keys():
+        return 'qwen'
+    elif model_name in ollama_config.models_aihub.keys():
+        return 'aihub'
+    elif model_name in ollama_config.models_cst.keys():
+        return 'cst'
+    return None
+
+
+def call_llm(prompt: str, model_name, system, use_cache=None) -> str:
+    """
+    调用模型获取回答，失败时抛出异常（批量执行器据此重试）。
+    :param use_cache: 是否使用本地回答缓存；None 时取 app_config.LLM_CACHE_ENABLED
+    """
+    if use_cache is None:
+        use_cache = app_config.LLM_CACHE_ENABLED
+    cache = get_llm_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(model_name, system, prompt)
+        if cached is not None:
+            print(f"命中LLM缓存: {model_name}")
+            return cached
+
+    provider = get_model_provider(model_name)
+    if provider == 'ollama':
+        print("使用ollama模型")
+        result = get_ollama_response(
+            prompt, ollama_config.models_ollama[model_name], system)
+        if result is None:
+            raise OllamaCallError("Ollama调用失败")
+    elif provider == 'qwen':
+        print("使用qwen模型")
+        result = get_qwen_response(prompt, ollama_config.models_qwen[model_name], system)
+    elif provider == 'aihub':
+        print("使用aihub模型")
+        result = get_aihub_response(prompt, ollama_config.models_aihub[model_name], system)
+    elif provider == 'cst':
+        print("使用cst模型")
+        result = get_cst_response(prompt, ollama_config.models_cst[model_name], system)
+    else:
+        raise ModelNotFoundError(f"未找到对应的模型: {model_name}")
+
+    # 只缓存成功的回答
+    if cache is not None and result:
+        cache.put(model_name, system, prompt, result)
+    return result
+
+
+def discard_cached_response(prompt: str, model_name, system, use_cache=None):
+    """删除缓存中的回答（调用方发现回答不可用时调用，参数与 call_llm 一致）"""
+    if use_cache is None:
+        use_cache = app_config.LLM_CACHE_ENABLED
+    if use_cache:
+        get_llm_cache().delete(model_name, system, prompt)
+
+
+def get_llm_response_stream(prompt: str, model_name, system, use_cache=None):
+    """
+    流式获取模型回答，逐段 yield 文本。失败时抛出异常（由调用方决定如何通知前端）。
+    :param use_cache: 是否使用本地回答缓存；命中时一次性返回缓存的完整回答
+    """
+    if use_cache is None:
+        use_cache = app_config.LLM_CACHE_ENABLED
+    cache = get_llm_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(model_name, system, prompt)
+        if cached is not None:
+            print(f"命中LLM缓存: {model_name}")
+            yield cached
+            return
+
+    provider = get_model_provider(model_name)
+    if provider == 'ollama':
+        print("使用ollama模型（流式）")
+        chunks = get_ollama_response_stream(
+            prompt, ollama_config.models_ollama[model_name], system)
+    elif provider == 'qwen':
+        print("使用qwen模型（流式）")
+        chunks = get_openai_compatible_stream(
+            'qwen', prompt, ollama_config.models_qwen[model_name], system,
+            extra_body={"enable_thinking": False})
+    elif provider == 'aihub':
+        print("使用aihub模型（流式）")
+        chunks = get_openai_compatible_stream(
+            'aihub', prompt, ollama_config.models_aihub[model_name], system)
+    elif provider == 'cst':
+        print("使用cst模型（流式）")
+        chunks = get_openai_compatible_stream(
+            'cst', prompt, ollama_config.models_cst[model_name], system)
+    else:
+        raise ModelNotFoundError(f"未找到对应的模型: {model_name}")
 
-def get_llm_response(prompt: str, model_name, system) -> str:
-    try:
-        if model_name in ollama_config.models_ollama.keys():
-            print("使用ollama模型")
-            result = get_ollama_response(
-                prompt, ollama_config.models_ollama[model_name], system)
-            return result if result is not None else f"""<!DOCTYPE html>
+    parts = []
+    for chunk in chunks:
+        if chunk:
+            parts.append(chunk)
+            yield chunk
+
+    # 完整生成后写入缓存
+    result = "".join(parts)
+    if cache is not None and result:
+        cache.put(model_name, system, prompt, result)
+
+
+def get_error_page(e) -> str:
+    """调用失败时返回给前端展示的错误页面"""
+    return f"""
+        <!DOCTYPE html>
 <html lang="zh-CN">
+
 <head>
     <meta charset="UTF-8">
     <title>error page</title>
 </head>
+
 <body>
     <h1>error</h1>
+
     <div class="error-box">
-        <h2>Ollama调用失败</h2>
+        <h2>error_message</h2>
+        <pre><code>{e}</code></pre>
     </div>
 </body>
-</html>"""
-        elif model_name in ollama_config.models_qwen.keys():
-            print("使用qwen模型")
-            return get_qwen_response(prompt, ollama_config.models_qwen[model_name], system)
-        elif model_name in ollama_config.models_aihub.keys():
-            print("使用aihub模型")
-            return get_aihub_response(prompt, ollama_config.models_aihub[model_name], system)
-        elif model_name in ollama_config.models_cst.keys():
-            print("使用cst模型")
-            return get_cst_response(prompt, ollama_config.models_cst[model_name], system)
-        else:
-            return f"""<!DOCTYPE html>
+
+</html>
+        """
+
+
+# 获取模型回答的入口函数
+
+def get_llm_response(prompt: str, model_name, system, use_cache=None) -> str:
+    """
+    :param use_cache: 是否使用本地回答缓存；None 时取 app_config.LLM_CACHE_ENABLED
+    调用失败时返回错误页面 HTML（而不是抛出异常）
+    """
+    try:
+        return call_llm(prompt, model_name, system, use_cache=use_cache)
+    except OllamaCallError:
+        return f"""<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
     <meta charset="UTF-8">
@@ -62,43 +187,35 @@ def get_llm_response(prompt: str, model_name, system) -> str:
 <body>
     <h1>error</h1>
     <div class="error-box">
-        <h2>未找到对应的模型: {model_name}</h2>
+        <h2>Ollama调用失败</h2>
     </div>
 </body>
 </html>"""
-    except Exception as e:
-        print(f"调用 LLM 出错: {e}")
-        return f"""
-        <!DOCTYPE html>
+    except ModelNotFoundError:
+        return f"""<!DOCTYPE html>
 <html lang="zh-CN">
-
 <head>
     <meta charset="UTF-8">
     <title>error page</title>
 </head>
-
 <body>
     <h1>error</h1>
-
     <div class="error-box">
-        <h2>error_message</h2>
-        <pre><code>{e}</code></pre>
+        <h2>未找到对应的模型: {model_name}</h2>
     </div>
 </body>
-
-</html>
-        """
+</html>"""
+    except Exception as e:
+        print(f"调用 LLM 出错: {e}")
+        return get_error_page(e)
 
 #!!! 提前开启ollama服务
 
 
 def get_ollama_response(prompt: str, model_name, system) -> str | None:
     """调用ollama获取回答"""
-    # 使用 OllamaLLM 类初始化，指定基础 URL 和模型名称
-    llm = OllamaLLM(
-        base_url=app_config.ollama_url,
-        model=model_name
-    )
+    # 复用共享的 OllamaLLM 实例（基础 URL 和模型名称见 llm_clients）
+    llm = get_ollama_llm(model_name)
     try:
         # 调用 Ollama API 获取回答
         response = llm.invoke(prompt)
@@ -110,9 +227,8 @@ def get_ollama_response(prompt: str, model_name, system) -> str | None:
 
 def get_deepseek_response(prompt: str, model_name, system) -> str:
     """调用deepseek获取回答"""
-    # Initialize OpenAI client here to avoid module-level initialization issues
-    app = OpenAI(api_key=app_config.deepseek_apikey,
-                 base_url=app_config.deepseek_url)
+    # 复用共享客户端（连接池），避免每次调用重新建立连接
+    app = get_client('deepseek')
     response = app.chat.completions.create(
         model=model_name,
         stream=False,
@@ -129,7 +245,7 @@ def get_deepseek_response(prompt: str, model_name, system) -> str:
 
 def get_cst_response(prompt: str, model_name, system) -> str:
     """调用deepseek获取回答"""
-    app = OpenAI(api_key=app_config.cst_apikey, base_url=app_config.cst_url)
+    app = get_client('cst')
     response = app.chat.completions.create(
         model=model_name,
         stream=False,
@@ -143,9 +259,8 @@ def get_cst_response(prompt: str, model_name, system) -> str:
 
 
 def get_deepseek_response_stream(prompt: str, model_name, system):
-    app = OpenAI(api_key=app_config.deepseek_apikey,
-                 base_url=app_config.deepseek_url)
     """调用deepseek获取流式回答"""
+    app = get_client('deepseek')
     response = app.chat.completions.create(
         model=model_name,
         stream=True,
@@ -157,14 +272,39 @@ def get_deepseek_response_stream(prompt: str, model_name, system):
     return response
 
 
+def get_openai_compatible_stream(provider: str, prompt: str, model_name, system, extra_body=None):
+    """调用 OpenAI 兼容接口获取流式回答，逐段 yield 文本"""
+    client = get_client(provider)
+    kwargs = {"extra_body": extra_body} if extra_body else {}
+    response = client.chat.completions.create(
+        model=model_name,
+        stream=True,
+        messages=[
+            {'role': 'system', 'content': system},
+            {"role": "user", "content": prompt}
+        ],
+        **kwargs
+    )
+    for chunk in response:
+        if not chunk.choices:
+            continue
+        content = chunk.choices[0].delta.content
+        if content:
+            yield content
+
+
+def get_ollama_response_stream(prompt: str, model_name, system):
+    """调用ollama获取流式回答"""
+    llm = get_ollama_llm(model_name)
+    for chunk in llm.stream(prompt):
+        yield chunk
+
+
 def get_qwen_response(prompt: str, model_name, system) -> str:
     """调用qwen获取回答"""
 
-    client = OpenAI(
-        # 若没有配置环境变量，请用百炼API Key将下行替换为：api_key="sk-xxx",
-        api_key=app_config.qwen_apikey,
-        base_url=app_config.qwen_url,
-    )
+    # 百炼 API Key 与地址见 app_config，客户端在 llm_clients 中共享
+    client = get_client('qwen')
 
     response = client.chat.completions.create(
         # 模型列表：https://help.aliyun.com/zh/model-studio/getting-started/models
@@ -183,9 +323,8 @@ def get_qwen_response(prompt: str, model_name, system) -> str:
 
 def get_aihub_response(prompt: str, model_name, system):
 
-    app = OpenAI(api_key=app_config.aihub_apikey,
-                 base_url=app_config.aihub_url)
     """调用aihub获取非流式回答"""
+    app = get_client('aihub')
     response = app.chat.completions.create(
         model=model_name,
         stream=False,
@@ -0,0 +1,233 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config.app_config import app_config
+from config.ollama_config import ollama_config
+from llm_agent.data_agent import VTKDataAnalyzer, format_analysis_output
+from llm_agent.prompt_agent import analyze_query
+
+'''
+生成流程的 DAG 执行器
+把生成前的准备工作拆成有依赖关系的阶段，互不依赖的阶段并发执行：
+
+    expansion (提示词拓展, LLM)        ─┐
+    speculative_retrieval (原始提示检索) ─┼─> retrieval (结果协调) ─> 最终 Prompt
+    data_analysis (数据下载与分析)      ─┘
+
+提示词拓展耗时 5~20 秒，期间先用原始提示做一次检索并下载分析数据文件；
+拓展完成后用拓展结果检索（语料在内存中，耗时很短），拓展失败或为空时直接采用预先检索的结果。
+'''
+
+
+class PipelineError(Exception):
+    """必需阶段执行失败"""
+
+    def __init__(self, stage, error):
+        super().__init__(f"阶段 {stage} 失败: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class Pipeline:
+    """
+    用法:
+        pipeline = Pipeline('generate')
+        pipeline.add('a', lambda r: 1)
+        pipeline.add('b', lambda r: r['a'] + 1, deps=['a'])
+        results, report = pipeline.run()
+    每个阶段函数接收已完成阶段的结果字典；optional 阶段失败时结果为 None，不影响后续阶段。
+    设置了 timeout 的阶段超时后按失败处理（状态为 timeout），不再等待其结果；
+    已在线程中执行的函数无法中断，会在后台执行完后被丢弃。
+    """
+
+    def __init__(self, name='pipeline'):
+        self.name = name
+        self.stages = {}
+
+    def add(self, name, fn, deps=(), optional=False, timeout=None):
+        if name in self.stages:
+            raise ValueError(f"阶段已存在: {name}")
+        self.stages[name] = {'fn': fn, 'deps': tuple(deps), 'optional': optional, 'timeout': timeout}
+        return self
+
+    def _check(self):
+        """检查依赖是否存在且无环"""
+        visiting, done = set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"阶段依赖存在环: {name}")
+            visiting.add(name)
+            for dep in self.stages[name]['deps']:
+                if dep not in self.stages:
+                    raise ValueError(f"阶段 {name} 依赖未定义的阶段 {dep}")
+                visit(dep)
+            visiting.discard(name)
+            done.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def _run_stage(self, name, results):
+        start = time.time()
+        try:
+            return self.stages[name]['fn'](results), None, start, time.time()
+        except Exception as e:
+            return None, e, start, time.time()
+
+    def run(self, executor=None):
+        """
+        :param executor: 执行阶段的线程池，默认使用进程内共享的线程池
+        :return: (results, report)。report 为 {阶段: {status, seconds, start, end, error}}，
+                 另含 '_total' 为整个流程的耗时
+        """
+        self._check()
+        executor = executor or get_pipeline_executor()
+        results, report = {}, {}
+        pending = dict(self.stages)
+        running = {}
+        deadlines = {}
+        failure = None
+        run_start = time.time()
+
+        while pending or running:
+            if failure is None:
+                for name in [n for n, s in pending.items() if all(d in report for d in s['deps'])]:
+                    del pending[name]
+                    # 只传入已完成阶段的结果快照，阶段之间不共享可变状态
+                    future = executor.submit(self._run_stage, name, dict(results))
+                    running[future] = name
+                    if self.stages[name]['timeout'] is not None:
+                        deadlines[future] = time.time() + self.stages[name]['timeout']
+            elif not running:
+                break
+            wait_timeout = max(0.0, min(deadlines.values()) - time.time()) if deadlines else None
+            done, _ = wait(running, timeout=wait_timeout, return_when=FIRST_COMPLETED)
+            now = time.time()
+            for future in [f for f, deadline in deadlines.items() if f not in done and deadline <= now]:
+                name = running.pop(future)
+                del deadlines[future]
+                timeout = self.stages[name]['timeout']
+                error = TimeoutError(f"超过 {timeout} 秒")
+                report[name] = {'status': 'timeout', 'seconds': timeout, 'start': None, 'end': now - run_start,
+                                'error': str(error)}
+                results[name] = None
+                print(f"[Pipeline] {self.name}.{name} 超时（{timeout}秒），不再等待")
+                if not self.stages[name]['optional'] and failure is None:
+                    failure = PipelineError(name, error)
+            for future in done:
+                deadlines.pop(future, None)
+                name = running.pop(future)
+                value, error, start, end = future.result()
+                report[name] = {'status': 'failed' if error else 'succeeded', 'seconds': end - start,
+                                'start': start - run_start, 'end': end - run_start,
+                                'error': str(error) if error else None}
+                results[name] = value
+                if error is not None:
+                    print(f"[Pipeline] {self.name}.{name} 失败: {error}")
+                    if not self.stages[name]['optional'] and failure is None:
+                        # 不再启动新阶段，等已在执行的阶段结束后抛出
+                        failure = PipelineError(name, error)
+
+        for name in pending:
+            report[name] = {'status': 'skipped', 'seconds': 0, 'start': None, 'end': None, 'error': None}
+        total = time.time() - run_start
+        report['_total'] = total
+        serial = sum(r['seconds'] for n, r in report.items() if n != '_total')
+        print(f"[Pipeline] {self.name}: 耗时 {total:.2f}秒（各阶段串行合计 {serial:.2f}秒）")
+        if failure is not None:
+            raise failure from failure.error
+        return results, report
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_pipeline_executor() -> ThreadPoolExecutor:
+    """进程内共享的阶段线程池"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=app_config.PIPELINE_MAX_WORKERS,
+                                               thread_name_prefix="pipeline")
+    return _executor
+
+
+# --- 生成流程 ---
+
+def _analyze_data(prompt):
+    return VTKDataAnalyzer.analyze_from_prompt(prompt)
+
+
+def format_data_context(data_analysis):
+    """把成功的数据分析结果整理成 Prompt 中的数据说明，没有可用结果时返回空字符串"""
+    if not data_analysis or not any(item.get('status') == 'success' and item.get('analysis')
+                                     for item in data_analysis.get('analyses', [])):
+        return ""
+    succeeded = {
+        'urls_extracted': data_analysis.get('urls_extracted', []),
+        'analyses': [item for item in data_analysis['analyses'] if item.get('status') == 'success'],
+    }
+    return "\nDataset Information (analyzed from the data URLs in the requirements):\n" + \
+        format_analysis_output(succeeded) + "\n"
+
+
+def run_generation_pipeline(prompt, workflow, rag_agent, model_name=None, expansion_model=None):
+    """
+    生成前的准备流程（拓展 / 数据分析 / 检索并发执行）。
+    :param workflow: 前端的 workflow 开关（inquiryExpansion / rag / dataAnalysis）
+    :return: dict，包含 final_prompt、analysis、retrieval_results、data_analysis、timings
+    """
+    expansion = bool(workflow.get('inquiryExpansion'))
+    rag = bool(workflow.get('rag'))
+    # 数据分析结果会加入最终 Prompt，改变生成结果，默认关闭，需在 workflow 中显式开启
+    data_analysis = (bool(workflow.get('dataAnalysis', getattr(app_config, 'PIPELINE_DATA_ANALYSIS', False)))
+                     and bool(VTKDataAnalyzer.extract_urls_from_prompt(prompt)))
+    speculative = rag and expansion and getattr(app_config, 'PIPELINE_SPECULATIVE_RETRIEVAL', True)
+
+    pipeline = Pipeline('generate')
+    if expansion:
+        pipeline.add('expansion', lambda r: analyze_query(
+            prompt, model_name=expansion_model or ollama_config.inquiry_expansion_model, system=None),
+            optional=True)
+    if data_analysis:
+        # 下载大文件可能很慢，超时后放弃数据分析，不阻塞生成
+        pipeline.add('data_analysis', lambda r: _analyze_data(prompt), optional=True,
+                     timeout=getattr(app_config, 'PIPELINE_DATA_ANALYSIS_TIMEOUT', None))
+    if speculative:
+        # 与拓展失败时的检索方式一致：以原始提示作为检索输入
+        pipeline.add('speculative_retrieval',
+                     lambda r: rag_agent.retrieve(None, prompt, model_name=model_name), optional=True)
+    if rag:
+        def retrieval(r):
+            analysis = r.get('expansion')
+            if not analysis and r.get('speculative_retrieval') is not None:
+                print('[Pipeline] 拓展结果为空，采用预先检索的结果')
+                return r['speculative_retrieval']
+            return rag_agent.retrieve(analysis or None, prompt, model_name=model_name)
+
+        pipeline.add('retrieval', retrieval,
+                     deps=[name for name in ('expansion', 'speculative_retrieval') if name in pipeline.stages])
+
+    results, timings = pipeline.run()
+
+    analysis = results.get('expansion') or ''
+    print('prompt analysis (result):\n', analysis, '\n')
+    final_prompt, retrieval_results = results['retrieval'] if rag else (prompt, [])
+    data_result = results.get('data_analysis')
+    data_context = format_data_context(data_result)
+    if data_context:
+        final_prompt = final_prompt + data_context
+
+    return {
+        'final_prompt': final_prompt,
+        'analysis': analysis if isinstance(analysis, list) else [],
+        'retrieval_results': retrieval_results,
+        'data_analysis': data_result,
+        'timings': timings,
+    }
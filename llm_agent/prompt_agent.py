@@ -1,7 +1,8 @@
 from config.ollama_config import ollama_config
 from config.app_config import app_config
 from langchain_ollama import OllamaLLM
-from llm_agent.ollma_chat import get_llm_response
+from llm_agent.ollma_chat import get_llm_response, call_llm, discard_cached_response
+from llm_agent.batch_runner import run_batch
 import pandas as pd
 import time
 import json
@@ -22,18 +23,26 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 VTKJS_COMMON_APIS = app_config.VTKJS_COMMON_APIS
 
 
-def analyze_query(query: str, model_name, system=None) -> list[dict]:
+def analyze_query(query: str, model_name, system=None, use_cache=None, strict=False) -> list[dict]:
     """分析用户查询，返回结构化的提示词拓展，用于构建可视化管道流程图
 
     Args:
         query: 用户输入的查询
         model_name: 使用的LLM模型名称
         system: 可选的系统提示词，若不提供则使用默认提示词
+        use_cache: 是否使用LLM回答缓存，None 时取全局配置
+        strict: 为 True 时调用失败或回答无法解析直接抛出异常（供批量执行器重试），否则返回 None
 
     Returns:
         list[dict]: 包含分割后的查询结果，支持流程图渲染
     """
+    result = _analyze_query(query, model_name, system, use_cache, strict)
+    if strict and result is None:
+        raise ValueError("提示词拓展结果无法解析")
+    return result
+
 
+def _analyze_query(query, model_name, system, use_cache, strict):
     # 默认系统提示词，结构化输出格式
     # 关键修改点：定义了更丰富的JSON结构，增加了 phase, step_name, vtk_modules, weight
     default_system = f"""
@@ -176,11 +185,27 @@ Output:
 Warning: You must output the result in the specified JSON format strictly. Do not output any other content.
 Output only one valid JSON object."""
     # 从LLM获取回答
+    try:
+        response = (call_llm if strict else get_llm_response)(
+            analysis_prompt, model_name, default_system, use_cache=use_cache)
+    except Exception as e:
+        print(f"Error in analyze_query: {e}")
+        if strict:
+            raise
+        return None
+    print('prompt analysis (raw):\n', response, '\n')
+
+    result = _parse_analysis(response)
+    if result is None and strict:
+        # 无法解析的回答不能留在缓存中，否则重试和续跑都会取到同一个回答
+        discard_cached_response(analysis_prompt, model_name, default_system, use_cache=use_cache)
+    return result
+
+
+def _parse_analysis(response):
+    """从模型回答中提取提示词拓展结果（JSON 数组），无法解析时返回 None"""
     try:
         result = ''
-        response = get_llm_response(
-            analysis_prompt, model_name, default_system)
-        print('prompt analysis (raw):\n', response, '\n')
 
         # 尝试从回答中提取JSON，使用更健壮的方法
 
@@ -261,18 +286,22 @@ Output only one valid JSON object."""
     return result
 
 
-def process_benchmark_prompts(input_file="res2.xlsx", output_file="res2.xlsx", model_name=None):
+def process_benchmark_prompts(input_file="res2.xlsx", output_file="res2.xlsx", model_name=None, checkpoint_path=None):
     """
     读取Excel文件中的Benchmark prompt列，对每个问题进行分析，
-    统计分割耗时，并将结果写入Excel文件
+    统计分割耗时，并将结果写入Excel文件。
+    各行通过 BatchLLMRunner 并发处理，每完成一行写入检查点，中断后可继续。
 
     Args:
         input_file: 输入Excel文件路径
         output_file: 输出Excel文件路径
         model_name: 使用的LLM模型名称
+        checkpoint_path: 检查点文件路径，默认为 output_file + ".prompt_plus.checkpoint.jsonl"
     """
     if model_name is None:
         model_name = ollama_config.models_qwen["qwen3-plus"]
+    if checkpoint_path is None:
+        checkpoint_path = output_file + ".prompt_plus.checkpoint.jsonl"
 
     # 读取Excel文件
     df = pd.read_excel(input_file, sheet_name='检索效果对比')
@@ -287,7 +316,8 @@ def process_benchmark_prompts(input_file="res2.xlsx", output_file="res2.xlsx", m
     df['splited_prompt_plus'] = df['splited_prompt_plus'].astype(str)
     df['time_spend_prompt_plus'] = df['time_spend_prompt_plus'].astype(str)
 
-    # 处理每个问题
+    # 收集需要处理的问题
+    tasks = []
     for index, row in df.iterrows():
         prompt = row['Benchmark prompt']
 
@@ -298,42 +328,38 @@ def process_benchmark_prompts(input_file="res2.xlsx", output_file="res2.xlsx", m
             df.at[index, 'time_spend_prompt_plus'] = str("")
             continue
 
-        print(f"正在处理第{index+1}个问题...")
+        tasks.append({"id": index, "prompt": prompt, "model_name": model_name})
 
-        # 记录开始时间
-        start_time = time.time()
-
-        try:
-            # 分析问题
-            result = analyze_query(prompt, model_name)
-            print(f"使用的模型{model_name}")
-
-            # 记录结束时间
-            end_time = time.time()
-            time_spent = end_time - start_time
-
-            # 将结果写入DataFrame，确保转换为字符串
-            if result is not None:
-                # 将结果转换为JSON字符串保存
-                df.at[index, 'splited_prompt_plus'] = str(
-                    json.dumps(result, ensure_ascii=False, indent=2))
-                df.at[index, 'time_spend_prompt_plus'] = str(
-                    f"{time_spent:.2f}")
-                print(f"第{index+1}个问题处理完成，耗时: {time_spent:.2f}秒")
-            else:
-                df.at[index, 'splited_prompt_plus'] = str("分析失败")
-                df.at[index, 'time_spend_prompt_plus'] = str(
-                    f"{time_spent:.2f}")
-                print(f"第{index+1}个问题分析失败，耗时: {time_spent:.2f}秒")
+    print(f"正在并发处理 {len(tasks)} 个问题，使用的模型{model_name}...")
+    records = run_batch(
+        tasks,
+        worker=lambda task: analyze_query(task["prompt"], task["model_name"], use_cache=True, strict=True),
+        checkpoint_path=checkpoint_path)
 
-        except Exception as e:
-            # 记录结束时间
-            end_time = time.time()
-            time_spent = end_time - start_time
+    for task, record in zip(tasks, records):
+        index = task["id"]
+        time_spent = record["elapsed"]
 
-            df.at[index, 'splited_prompt_plus'] = str(f"处理出错: {str(e)}")
+        if record["status"] != "success":
+            df.at[index, 'splited_prompt_plus'] = str(f"处理出错: {record['error']}")
             df.at[index, 'time_spend_prompt_plus'] = str(f"{time_spent:.2f}")
-            print(f"第{index+1}个问题处理出错: {e}，耗时: {time_spent:.2f}秒")
+            print(f"第{index+1}个问题处理出错: {record['error']}，耗时: {time_spent:.2f}秒")
+            continue
+
+        result = record["result"]
+        # 将结果写入DataFrame，确保转换为字符串
+        if result is not None:
+            # 将结果转换为JSON字符串保存
+            df.at[index, 'splited_prompt_plus'] = str(
+                json.dumps(result, ensure_ascii=False, indent=2))
+            df.at[index, 'time_spend_prompt_plus'] = str(
+                f"{time_spent:.2f}")
+            print(f"第{index+1}个问题处理完成，耗时: {time_spent:.2f}秒")
+        else:
+            df.at[index, 'splited_prompt_plus'] = str("分析失败")
+            df.at[index, 'time_spend_prompt_plus'] = str(
+                f"{time_spent:.2f}")
+            print(f"第{index+1}个问题分析失败，耗时: {time_spent:.2f}秒")
 
     # 保存到Excel文件
     try:
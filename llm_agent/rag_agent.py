@@ -1,16 +1,17 @@
 import sys
 import os
-from RAG.retriever import VTKSearcher
 from llm_agent.ollma_chat import get_qwen_response,get_llm_response
-from RAG.retriever_v2 import get_data_from_excel
 import json
 # from RAG.retriever_v2 import VTKSearcherV2
 # 引入 retriever_v3 的搜索器
 from RAG.retriever_v3 import VTKSearcherV3
 from config.ollama_config import ollama_config 
+from config.app_config import app_config
 import json
 from llm_agent.ollma_chat import get_llm_response
+from llm_agent.batch_runner import run_batch
 import time
+import threading
 import pandas as pd
 from openpyxl import load_workbook
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -19,27 +20,37 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 
 class RAGAgent:
-    def __init__(self, use_v3=True):
+    def __init__(self, use_v3=True, history_size=None):
         """
         初始化 RAG Agent
         :param use_v3: 是否使用 retriever_v3（纯关键词检索），默认为 True
+        :param history_size: 检索历史环形缓冲区容量，None 表示不限（批量实验用）
         """
         self.use_v3 = use_v3
         if use_v3:
-            self.searcher = VTKSearcherV3()
+            self.searcher = VTKSearcherV3(history_size=history_size)
             print("[RAGAgent] 使用 VTKSearcherV3 (关键词检索)")
         self.last_retrieval_results = []
 
-    def search(self, analysis: list, prompt: str) -> str:
-        """
-        检索数据,支持元数据过滤。
-        :param analysis: 查询分析结果，格式为 list[dict]，每个 dict 包含: phase, step_name, vtk_modules, description
-        :param prompt: 原始用户查询
-        :return: 结合了上下文信息的最终提示
-        """
+    def warm_up(self):
+        """预热检索器（加载语料索引）"""
+        if hasattr(self.searcher, 'warm_up'):
+            return self.searcher.warm_up()
+        return True
+
+    def health(self):
+        """检索后端的就绪状态（MongoDB 连接、语料规模与快照新旧）"""
+        if hasattr(self.searcher, 'health'):
+            return self.searcher.health()
+        return {"ready": True}
+
+    def _build_query_list(self, analysis, prompt):
         # 如果 analysis 为空或为 None，使用原始 prompt 创建默认的查询列表
         if not analysis:
             query_list = [{'description': prompt, 'weight': 5}]
+        elif isinstance(analysis, str):
+            # 未经拓展的文本（如原始提示）作为单条查询
+            query_list = [{'description': analysis, 'weight': 5}]
         else:
             # 将新格式的分析结果转换为检索兼容的格式
             # 从每个分析步骤中提取 description，并添加权重
@@ -55,20 +66,36 @@ class RAGAgent:
                         'weight': 5  # 默认权重
                     }
                     query_list.append(query_item)
-        
+        return query_list
+
+    def retrieve(self, analysis: list, prompt: str, model_name: str = None):
+        """
+        无状态检索：结果直接返回给调用方，不写入实例属性，可被多个请求线程共享。
+        :param analysis: 查询分析结果，格式为 list[dict]，每个 dict 包含: phase, step_name, vtk_modules, description
+        :param prompt: 原始用户查询
+        :param model_name: 生成代码的目标模型（决定示例上下文的 token 预算）
+        :return: (最终提示, 检索结果元数据列表)
+        """
+        query_list = self._build_query_list(analysis, prompt)
         print(f'[RAGAgent] 转换后的查询列表：{query_list}')
-        
-        # 执行检索
-        result = self.searcher.search(prompt, query_list)
-        
-        # 根据不同的检索器提取元数据
+
         if self.use_v3:
-            # retriever_v3 没有 last_retrieval_metadata 属性，需要从 reranked_results_history 中提取
-            self._extract_metadata_from_v3()
-        else:
-            # retriever_v2 有 last_retrieval_metadata 属性
-            self.last_retrieval_results = getattr(self.searcher, 'last_retrieval_metadata', [])
-        
+            retrieval = self.searcher.retrieve(prompt, query_list, model_name=model_name)
+            return retrieval["prompt"], self._extract_metadata_from_v3(retrieval["results"])
+
+        # retriever_v2 有 last_retrieval_metadata 属性
+        result = self.searcher.search(prompt, query_list)
+        return result, getattr(self.searcher, 'last_retrieval_metadata', [])
+
+    def search(self, analysis: list, prompt: str, model_name: str = None) -> str:
+        """
+        检索数据,支持元数据过滤。
+        :param analysis: 查询分析结果，格式为 list[dict]，每个 dict 包含: phase, step_name, vtk_modules, description
+        :param prompt: 原始用户查询
+        :param model_name: 生成代码的目标模型（决定示例上下文的 token 预算）
+        :return: 结合了上下文信息的最终提示
+        """
+        result, self.last_retrieval_results = self.retrieve(analysis, prompt, model_name=model_name)
         return result
     
     def _get_thumbnail_url(self, file_path: str) -> str:
@@ -105,56 +132,61 @@ class RAGAgent:
         # 如果没有找到图片,返回空字符串(前端会处理)
         return ""
     
-    def _extract_metadata_from_v3(self):
+    def _extract_metadata_from_v3(self, last_results=None):
         """
         从 retriever_v3 的检索结果中提取元数据用于前端展示
+        :param last_results: 重排后的文档列表；为 None 时取检索器最近一次的历史记录
+        :return: 元数据列表
         """
-        self.last_retrieval_results = []
-        
-        # 从最后一次检索的 reranked_results_history 中提取
-        if hasattr(self.searcher, 'reranked_results_history') and self.searcher.reranked_results_history:
-            last_results = self.searcher.reranked_results_history[-1]
-            
-            # 提取所有分数用于归一化
-            all_scores = [r.get("rerank_score", 0.0) for r in last_results]
-            
-            if not all_scores:
-                print(f"[RAGAgent] 无有效分数")
-                return
-            
-            # 使用最小-最大归一化方法：normalized = (score - min) / (max - min)
-            # 这样最低分变为0%，最高分变为100%，中间分数线性分布
-            max_score = max(all_scores)
-            min_score = min(all_scores)
-            score_range = max_score - min_score if max_score > min_score else 1.0
-            
-            for idx, result in enumerate(last_results[:10]):  # Top 10 results
-                meta = result.get("meta_info", {})
-                raw_score = result.get("rerank_score", 0.0)
-                
-                # 使用最小-最大归一化
-                if score_range > 0:
-                    normalized_relevance = (raw_score - min_score) / score_range
-                else:
-                    normalized_relevance = 1.0 if raw_score > 0 else 0.0
-                
-                # 确保在0-1范围内
-                normalized_relevance = min(max(normalized_relevance, 0.0), 1.0)
-                
-                self.last_retrieval_results.append({
-                    "id": result.get("faiss_id") or result.get("file_path") or idx,
-                    "title": meta.get("file_name") or meta.get("file_path", f"Example {idx+1}"),
-                    "description": meta.get("description", "N/A")[:200],
-                    "relevance": normalized_relevance,
-                    "raw_score": raw_score,  # 保留原始分数供调试
-                    "vtkjs_modules": meta.get("vtkjs_modules", []),  # 添加模块信息
-                    "matched_keywords": result.get("matched_keywords", []),
-                    "file_path": meta.get("file_path", ""),  # 添加文件路径供参考
-                    "thumbnail_url": self._get_thumbnail_url(meta.get("file_path", ""))
-                })
+        metadata = []
 
+        if last_results is None:
+            # 从最后一次检索的 reranked_results_history 中提取
+            if hasattr(self.searcher, 'reranked_results_history') and self.searcher.reranked_results_history:
+                last_results = self.searcher.reranked_results_history[-1]
+            else:
+                return metadata
+
+        # 提取所有分数用于归一化
+        all_scores = [r.get("rerank_score", 0.0) for r in last_results]
+
+        if not all_scores:
+            print(f"[RAGAgent] 无有效分数")
+            return metadata
+
+        # 使用最小-最大归一化方法：normalized = (score - min) / (max - min)
+        # 这样最低分变为0%，最高分变为100%，中间分数线性分布
+        max_score = max(all_scores)
+        min_score = min(all_scores)
+        score_range = max_score - min_score if max_score > min_score else 1.0
+
+        for idx, result in enumerate(last_results[:10]):  # Top 10 results
+            meta = result.get("meta_info", {})
+            raw_score = result.get("rerank_score", 0.0)
+
+            # 使用最小-最大归一化
+            if score_range > 0:
+                normalized_relevance = (raw_score - min_score) / score_range
+            else:
+                normalized_relevance = 1.0 if raw_score > 0 else 0.0
+
+            # 确保在0-1范围内
+            normalized_relevance = min(max(normalized_relevance, 0.0), 1.0)
+
+            metadata.append({
+                "id": result.get("faiss_id") or result.get("file_path") or idx,
+                "title": meta.get("file_name") or meta.get("file_path", f"Example {idx+1}"),
+                "description": meta.get("description", "N/A")[:200],
+                "relevance": normalized_relevance,
+                "raw_score": raw_score,  # 保留原始分数供调试
+                "vtkjs_modules": meta.get("vtkjs_modules", []),  # 添加模块信息
+                "matched_keywords": result.get("matched_keywords", []),
+                "file_path": meta.get("file_path", ""),  # 添加文件路径供参考
+                "thumbnail_url": self._get_thumbnail_url(meta.get("file_path", ""))
+            })
+
+        return metadata
 
-    
     def get_retrieval_metadata(self) -> list:
         """
         获取最近一次检索的元数据用于前端展示
@@ -162,6 +194,23 @@ class RAGAgent:
         """
         return self.last_retrieval_results
 
+_rag_agent = None
+_rag_agent_lock = threading.Lock()
+
+
+def get_rag_agent() -> RAGAgent:
+    """
+    获取进程内共享的 RAGAgent（服务端使用）。
+    检索器只构建一次，语料索引保持常驻，历史记录使用有界环形缓冲区。
+    """
+    global _rag_agent
+    if _rag_agent is None:
+        with _rag_agent_lock:
+            if _rag_agent is None:
+                _rag_agent = RAGAgent(use_v3=True, history_size=app_config.SEARCH_HISTORY_SIZE)
+    return _rag_agent
+
+
 def retrieval_step(searcher, excel_path):
     """
     负责从Excel读取查询并执行检索过程，将检索结果保存到列表中。
@@ -173,6 +222,9 @@ def retrieval_step(searcher, excel_path):
     Returns:
         list: 包含每个查询检索结果的字典列表。
     """
+    # 延迟导入：retriever_v2 依赖 embedding_v3_1（FAISS 索引 / 嵌入模型），只有批量实验才需要
+    from RAG.retriever_v2 import get_data_from_excel
+
     benchmark_prompts, splited_queries = get_data_from_excel(excel_path)
     all_retrieval_results = []
 
@@ -211,36 +263,47 @@ def retrieval_step(searcher, excel_path):
 
     return all_retrieval_results
 
-def generation_step(retrieval_results, output_file="generation_results.json"):
+def generation_step(retrieval_results, output_file="generation_results.json", model_name="qwen3-plus", checkpoint_path=None):
     """
     负责利用检索结果调用LLM生成代码，并将最终结果保存到JSON文件。
+    各行通过 BatchLLMRunner 并发生成（按服务限流、失败重试），
+    每完成一行写入检查点，中断后重新运行会跳过已完成的行。
 
     Args:
         retrieval_results (list): 包含检索结果的字典列表。
         output_file (str): 保存最终结果的JSON文件路径。
+        model_name (str): 生成代码使用的模型。
+        checkpoint_path (str): 检查点文件路径，默认为 output_file + ".checkpoint.jsonl"。
     """
-    for result_entry in retrieval_results:
-        # 跳过已标记为“跳过”的结果
-        if result_entry.get("status") == "skipped":
-            continue
-        
-        final_prompt = result_entry["final_prompt"]
-        generated_code = ""
-        llm_start_time = time.time()
+    if checkpoint_path is None:
+        checkpoint_path = output_file + ".checkpoint.jsonl"
 
-        print(f"\n为第{result_entry['index']}行生成代码...")
-        
-        try:
-            generated_code = get_llm_response(final_prompt, model_name="qwen3-plus", system=ollama_config.code_sytstem)
-            print(f"代码生成成功")
-        except Exception as e:
-            print(f"代码生成失败: {e}")
-            generated_code = f"代码生成失败: {e}"
+    # 跳过已标记为“跳过”的结果
+    entries = [e for e in retrieval_results if e.get("status") != "skipped"]
+    tasks = [{
+        "id": e["index"],
+        "prompt": e["final_prompt"],
+        "model_name": model_name,
+        "system": ollama_config.code_sytstem,
+        "use_cache": True
+    } for e in entries]
+
+    print(f"\n开始为 {len(tasks)} 行生成代码...")
+    records = run_batch(tasks, checkpoint_path=checkpoint_path)
+
+    for result_entry, record in zip(entries, records):
+        final_prompt = result_entry["final_prompt"]
+        if record["status"] == "success":
+            generated_code = record["result"]
+            print(f"第{result_entry['index']}行代码生成成功")
+        else:
+            print(f"第{result_entry['index']}行代码生成失败: {record['error']}")
+            generated_code = f"代码生成失败: {record['error']}"
             result_entry["status"] = "failed"
-        
-        llm_time = time.time() - llm_start_time
+
+        llm_time = record["elapsed"]
         total_time = result_entry["retrieval_time"] + llm_time
-        
+
         # 更新字典，添加生成结果
         result_entry.update({
             "generated_code": generated_code,
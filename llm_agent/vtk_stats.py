@@ -0,0 +1,311 @@
+import math
+import re
+
+import numpy as np
+
+'''
+VTKDataAnalyzer 使用的数组统计与 XML 头部扫描
+- 分块统计：按行分块计算 min / max 与向量模长范围，模长用 einsum 逐块求平方和，
+  不再生成与整个数组同样大小的临时数组
+- 近似统计：随机起点的等间隔采样，给出误差界（见 sampled_stats）
+- XML 头部扫描：VTK XML 格式（.vti / .vtr 等）的 DataArray 标签带有 RangeMin / RangeMax，
+  只读取到 <AppendedData 为止即可得到数据规模与各数组范围，完全不加载数组
+'''
+
+DEFAULT_BLOCK_ROWS = 1 << 20
+DEFAULT_MAX_SAMPLES = 1 << 20
+
+# VTK XML 的 type 属性 -> numpy dtype 名称（与 str(array.dtype) 一致）
+_XML_TYPES = {
+    'Int8': 'int8', 'UInt8': 'uint8', 'Int16': 'int16', 'UInt16': 'uint16',
+    'Int32': 'int32', 'UInt32': 'uint32', 'Int64': 'int64', 'UInt64': 'uint64',
+    'Float32': 'float32', 'Float64': 'float64', 'Char': 'int8', 'UChar': 'uint8',
+}
+
+
+def _components(array):
+    return array.shape[1] if array.ndim > 1 else 1
+
+
+def blocked_stats(array, magnitude=False, block_rows=None):
+    """
+    分块精确统计。
+    :param magnitude: 是否同时计算每行向量模长的范围
+    :return: {'min', 'max'[, 'magnitude_min', 'magnitude_max']}
+    """
+    block_rows = block_rows or DEFAULT_BLOCK_ROWS
+    n_rows = array.shape[0]
+    mins, maxs, sq_mins, sq_maxs = [], [], [], []
+    for start in range(0, n_rows, block_rows):
+        block = np.asarray(array[start:start + block_rows])
+        mins.append(np.min(block))
+        maxs.append(np.max(block))
+        if magnitude:
+            block = block.reshape(block.shape[0], -1).astype(np.float64, copy=False)
+            squared = np.einsum('ij,ij->i', block, block)
+            sq_mins.append(np.min(squared))
+            sq_maxs.append(np.max(squared))
+
+    if not mins:
+        raise ValueError("空数组没有统计范围")
+    # 与 np.min 一致：任一块含 NaN 时结果为 NaN
+    stats = {'min': float(np.min(mins)), 'max': float(np.max(maxs))}
+    if magnitude:
+        # 开方是单调的，只需对平方和的最值开方
+        stats['magnitude_min'] = float(math.sqrt(np.min(sq_mins)))
+        stats['magnitude_max'] = float(math.sqrt(np.max(sq_maxs)))
+    return stats
+
+
+def sampled_stats(array, magnitude=False, max_samples=None, confidence=0.99, seed=0, block_rows=None):
+    """
+    近似统计：从随机起点开始每隔 stride 行取一行，共约 max_samples 行。
+    采样得到的范围总在真实范围之内；把采样视为 m 行的均匀随机样本时，
+    以 confidence 的置信度，落在该范围之外的行不超过 eps = ln(1/(1-confidence)) / m 的比例。
+    :return: 与 blocked_stats 相同的字典，另含 exact、sampled_rows、total_rows、error_bound
+    """
+    max_samples = max_samples or DEFAULT_MAX_SAMPLES
+    n_rows = array.shape[0]
+    if n_rows <= max_samples:
+        stats = blocked_stats(array, magnitude=magnitude, block_rows=block_rows)
+        stats.update({'exact': True, 'sampled_rows': n_rows, 'total_rows': n_rows, 'error_bound': None})
+        return stats
+
+    stride = math.ceil(n_rows / max_samples)
+    offset = int(np.random.default_rng(seed).integers(stride))
+    sample = array[offset::stride]
+    stats = blocked_stats(sample, magnitude=magnitude, block_rows=block_rows)
+    m = sample.shape[0]
+    stats.update({
+        'exact': False,
+        'sampled_rows': int(m),
+        'total_rows': int(n_rows),
+        'error_bound': {
+            'outside_fraction': min(1.0, math.log(1.0 / (1.0 - confidence)) / m),
+            'confidence': confidence,
+        },
+    })
+    return stats
+
+
+def array_info(array, approximate=False, max_samples=None, block_rows=None):
+    """
+    生成 analyze_vtk_file 中单个数组的描述：维度、类型、范围，三分量向量另含模长范围。
+    approximate 为 True 时使用采样统计，并附带 'estimate' 说明误差界。
+    """
+    dim = _components(array)
+    magnitude = dim == 3
+    if approximate:
+        stats = sampled_stats(array, magnitude=magnitude, max_samples=max_samples, block_rows=block_rows)
+    else:
+        stats = blocked_stats(array, magnitude=magnitude, block_rows=block_rows)
+
+    info = {
+        'dimensions': int(dim),
+        'data_type': str(array.dtype),
+        'range': {
+            'min': stats['min'],
+            'max': stats['max']
+        }
+    }
+    if magnitude:
+        info['magnitude_range'] = {
+            'min': stats['magnitude_min'],
+            'max': stats['magnitude_max']
+        }
+    if approximate and not stats['exact']:
+        info['estimate'] = estimate_info(stats)
+    return info
+
+
+def estimate_info(stats):
+    """采样统计结果中的误差说明（放在数组描述的 'estimate' 字段）"""
+    return {
+        'method': 'sampled',
+        'sampled_rows': stats['sampled_rows'],
+        'total_rows': stats['total_rows'],
+        'error_bound': stats['error_bound'],
+    }
+
+
+# --- VTK XML 头部扫描 ---
+
+_TAG_RE = re.compile(r'<(/?)([A-Za-z]\w*)([^>]*?)(/?)>')
+_ATTR_RE = re.compile(r'([A-Za-z_][\w:.-]*)\s*=\s*"([^"]*)"')
+XML_EXTENSIONS = ('.vti', '.vtr', '.vtp', '.vtu', '.vts')
+
+
+def _numbers(text):
+    return [float(v) for v in text.split()]
+
+
+def _scan_tags(file_path, chunk_size, max_header_bytes):
+    """
+    逐块读取文件，产出 (是否结束标签, 标签名, 属性字典, 标签后的文本)，遇到 <AppendedData 停止。
+    自闭合标签（<PointData/>）按开始标签紧跟结束标签处理。
+    标签后的文本只保留少量（用于读取 ascii 格式的 FieldData 取值）。
+    """
+    read_bytes = 0
+    buffer = ''
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            read_bytes += len(chunk)
+            buffer += chunk.decode('latin-1')
+            stop = buffer.find('<AppendedData')
+            if stop >= 0:
+                buffer = buffer[:stop]
+            # 只解析完整的标签，最后一个 '<' 之后可能是不完整的标签，留到下一块
+            end = len(buffer)
+            if stop < 0 and chunk:
+                last = buffer.rfind('<')
+                if last >= 0:
+                    end = last
+            for match in _TAG_RE.finditer(buffer, 0, end):
+                text_end = buffer.find('<', match.end(), end)
+                text = buffer[match.end():text_end if text_end >= 0 else end][:256]
+                yield match.group(1) == '/', match.group(2), dict(_ATTR_RE.findall(match.group(3))), text
+                if match.group(4):
+                    yield True, match.group(2), {}, ''
+            buffer = buffer[end:]
+            if stop >= 0 or not chunk:
+                return
+            if read_bytes > max_header_bytes:
+                raise ValueError("XML 头部过大（数据可能以内联方式存储）")
+
+
+def scan_xml_header(file_path, chunk_size=1 << 20, max_header_bytes=64 << 20):
+    """
+    只读取 VTK XML 文件的头部（到 <AppendedData 为止），返回与 analyze_vtk_file 相同结构的分析结果。
+    需要的信息不完整时返回 None（调用方改为读取数组）：
+    - 目前支持 ImageData（范围由 WholeExtent / Origin / Spacing 计算）和 RectilinearGrid（由坐标数组范围得到）；
+    - 每个点 / 单元数组都必须带有 RangeMin / RangeMax。多分量数组的 RangeMin / RangeMax 是模长范围，
+      分量范围以模长给出的界 [-max, max] 代替，并在 'estimate' 中注明。
+    """
+    if not file_path.lower().endswith(XML_EXTENSIONS):
+        return None
+    try:
+        tags = list(_scan_tags(file_path, chunk_size, max_header_bytes))
+    except (OSError, ValueError) as e:
+        print(f"[VTKDataAnalyzer] 读取 XML 头部失败: {e}")
+        return None
+
+    data_type = None
+    dataset_attrs = {}
+    arrays = {'PointData': {}, 'CellData': {}, 'FieldData': {}, 'Coordinates': []}
+    section = None
+    for closing, name, attrs, text in tags:
+        if name == 'VTKFile' and not closing:
+            data_type = attrs.get('type')
+        elif data_type and name == data_type and not closing:
+            dataset_attrs = attrs
+        elif name in ('PointData', 'CellData', 'FieldData', 'Coordinates', 'Points', 'Cells', 'Verts',
+                      'Lines', 'Strips', 'Polys'):
+            section = None if closing else name
+        elif name == 'DataArray' and not closing and section in arrays:
+            if section == 'Coordinates':
+                arrays['Coordinates'].append(attrs)
+            else:
+                array_name = attrs.get('Name', f'Array{len(arrays[section])}')
+                attrs = dict(attrs, _text=text)
+                # 多个 Piece 中的同名数组合并范围
+                arrays[section].setdefault(array_name, []).append(attrs)
+
+    if data_type == 'ImageData':
+        extent = dataset_attrs.get('WholeExtent')
+        if not extent or dataset_attrs.get('Direction', '1 0 0 0 1 0 0 0 1').split() != \
+                '1 0 0 0 1 0 0 0 1'.split():
+            return None
+        extent = [int(v) for v in extent.split()]
+        origin = _numbers(dataset_attrs.get('Origin', '0 0 0'))
+        spacing = _numbers(dataset_attrs.get('Spacing', '1 1 1'))
+        dims = [extent[2 * i + 1] - extent[2 * i] + 1 for i in range(3)]
+        bounds = []
+        for i in range(3):
+            ends = [origin[i] + spacing[i] * extent[2 * i], origin[i] + spacing[i] * extent[2 * i + 1]]
+            bounds.append([min(ends), max(ends)])
+        points_count = int(np.prod(dims))
+        cells_count = int(np.prod([d - 1 for d in dims if d > 1])) if any(d > 1 for d in dims) else 0
+    elif data_type == 'RectilinearGrid':
+        extent = dataset_attrs.get('WholeExtent')
+        coordinates = arrays['Coordinates']
+        if not extent or len(coordinates) < 3 or any('RangeMin' not in c or 'RangeMax' not in c
+                                                      for c in coordinates[:3]):
+            return None
+        extent = [int(v) for v in extent.split()]
+        dims = [extent[2 * i + 1] - extent[2 * i] + 1 for i in range(3)]
+        # 多个 Piece 时每个坐标轴各有一组数组，按轴合并
+        bounds = [[math.inf, -math.inf] for _ in range(3)]
+        for n, c in enumerate(coordinates):
+            axis = bounds[n % 3]
+            axis[0] = min(axis[0], float(c['RangeMin']))
+            axis[1] = max(axis[1], float(c['RangeMax']))
+        points_count = int(np.prod(dims))
+        cells_count = int(np.prod([d - 1 for d in dims if d > 1])) if any(d > 1 for d in dims) else 0
+    else:
+        return None
+
+    def merged(pieces):
+        if any('RangeMin' not in a or 'RangeMax' not in a for a in pieces):
+            return None
+        first = pieces[0]
+        dim = int(first.get('NumberOfComponents', 1))
+        low = min(float(a['RangeMin']) for a in pieces)
+        high = max(float(a['RangeMax']) for a in pieces)
+        info = {
+            'dimensions': dim,
+            'data_type': _XML_TYPES.get(first.get('type'), str(first.get('type', '')).lower()),
+        }
+        if dim == 1:
+            info['range'] = {'min': low, 'max': high}
+            info['estimate'] = {'method': 'xml_header'}
+        else:
+            # 多分量数组头部只记录模长范围，各分量都落在 [-模长最大值, 模长最大值] 内
+            info['range'] = {'min': -high, 'max': high}
+            info['estimate'] = {'method': 'xml_header', 'range_is_bound': True}
+            if dim == 3:
+                info['magnitude_range'] = {'min': low, 'max': high}
+        return info
+
+    result = {}
+    for section, key in (('PointData', 'point_data'), ('CellData', 'cell_data')):
+        result[key] = {}
+        for array_name, pieces in arrays[section].items():
+            info = merged(pieces)
+            if info is None:
+                return None
+            if key == 'cell_data':
+                info = {'data_type': info['data_type'], 'range': info['range'], 'estimate': info['estimate']}
+            result[key][array_name] = info
+
+    field_data_info = {}
+    for array_name, pieces in arrays['FieldData'].items():
+        attrs = pieces[0]
+        value = None
+        if attrs.get('format') == 'ascii' and attrs['_text'].split():
+            value = attrs['_text'].split()[0]
+        elif 'RangeMin' in attrs and int(attrs.get('NumberOfTuples', 0)) == 1:
+            value = attrs['RangeMin']
+        if value is None:
+            continue
+        try:
+            field_data_info[array_name] = {'value': float(value), 'type': 'float'}
+        except ValueError:
+            field_data_info[array_name] = {'value': value, 'type': 'str'}
+
+    return {
+        'geometry': {
+            'data_type': data_type,
+            'points_count': points_count,
+            'cells_count': cells_count,
+            'bounds': {
+                'x': [float(bounds[0][0]), float(bounds[0][1])],
+                'y': [float(bounds[1][0]), float(bounds[1][1])],
+                'z': [float(bounds[2][0]), float(bounds[2][1])]
+            }
+        },
+        'field_data': field_data_info,
+        'point_data': result['point_data'],
+        'cell_data': result['cell_data'],
+        'mode': 'header'
+    }
@@ -1,5 +1,8 @@
 # 处理dataset相关逻辑
 import json
+import os
+import sqlite3
+import threading
 from datetime import time
 from config.app_config import app_config
 
@@ -19,112 +22,223 @@ class Evaluation:
         print(f"Score: {self.score}, Workflow: {self.workflow}, Generator: {self.generator}")
 
 
-def add_data(obj):
-    # print("add_data", obj)
+_conn = None
+_lock = threading.RLock()
+
+
+def _get_conn():
+    """
+    获取数据集的 SQLite 连接（进程内共享）。
+    每条记录以 JSON 文本存储，eval_id 单独建索引；按 seq 保持插入顺序。
+    首次使用时自动从旧的 dataset.json 迁移数据。
+    """
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                db_dir = os.path.dirname(app_config.DATASET_DB_PATH)
+                if db_dir:
+                    os.makedirs(db_dir, exist_ok=True)
+                conn = sqlite3.connect(app_config.DATASET_DB_PATH, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                # eval_id 不声明类型，避免 '123' 与 123 之间的隐式转换（与原先 Python 比较语义一致）
+                # eval_id 以秒级时间戳生成，可能重复，因此索引不设为唯一
+                conn.execute(
+                    """CREATE TABLE IF NOT EXISTS records (
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        eval_id,
+                        data TEXT NOT NULL
+                    )""")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_records_eval_id ON records(eval_id)")
+                conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+                conn.commit()
+                _migrate_from_json(conn)
+                _conn = conn
+    return _conn
+
+
+def _migrate_from_json(conn):
+    """把旧的 dataset.json 导入 SQLite（只执行一次）"""
+    migrated = conn.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone()
+    if migrated is not None:
+        return
     try:
-        # 尝试读取现有的 JSON 文件
         with open(app_config.DATASET_PATH, 'r', encoding='utf-8') as file:
             existing_data = json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # 如果文件不存在或解析失败，创建一个新的列表
-        print('error')
+    except FileNotFoundError:
         existing_data = []
+    except json.JSONDecodeError as e:
+        # 文件损坏时不标记为已迁移，修复文件后下次启动会重新导入
+        print(f"[Dataset] 无法解析 {app_config.DATASET_PATH}，暂不迁移: {e}")
+        return
+
+    if existing_data:
+        print(f"迁移 {len(existing_data)} 条记录: {app_config.DATASET_PATH} -> {app_config.DATASET_DB_PATH}")
+    conn.executemany(
+        "INSERT INTO records (eval_id, data) VALUES (?, ?)",
+        [(_as_key(item.get("eval_id")), json.dumps(item, ensure_ascii=False)) for item in existing_data])
+    conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_from_json', ?)", (app_config.DATASET_PATH,))
+    conn.commit()
+
+
+def _as_key(value):
+    """eval_id 列只存放 SQLite 可比较的标量，其他类型转为 JSON 文本"""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _find_first(eval_id, predicate=None):
+    """按插入顺序返回第一条匹配 eval_id（且满足 predicate）的 (seq, data)"""
+    rows = _get_conn().execute(
+        "SELECT seq, data FROM records WHERE eval_id IS ? ORDER BY seq", (_as_key(eval_id),))
+    for seq, raw in rows:
+        data_item = json.loads(raw)
+        # 索引列只做初筛，最终以原始值比较
+        if data_item.get("eval_id") != eval_id:
+            continue
+        if predicate is None or predicate(data_item):
+            return seq, data_item
+    return None, None
+
+
+def _update(seq, data_item):
+    _get_conn().execute(
+        "UPDATE records SET data = ? WHERE seq = ?", (json.dumps(data_item, ensure_ascii=False), seq))
+    _get_conn().commit()
 
-    # 将新数据添加到现有数据列表中
-    existing_data.append(obj)
 
-    # 将更新后的数据写回 JSON 文件
-    with open(app_config.DATASET_PATH, 'w', encoding='utf-8') as file:
-        json.dump(existing_data, file, ensure_ascii=False, indent=4)
-        # print(existing_data)
-        # print(t)
+def add_data(obj):
+    # print("add_data", obj)
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            "INSERT INTO records (eval_id, data) VALUES (?, ?)",
+            (_as_key(obj.get("eval_id")), json.dumps(obj, ensure_ascii=False)))
+        conn.commit()
 
 
 def delete_object(eval_id):
     """
-    根据 eval_id 删除 JSON 文件中的数据。
+    根据 eval_id 删除数据集中的数据。
 
     :param eval_id: 要删除的数据的 eval_id
-    :param file_path: JSON 文件的路径
     """
-    try:
-        with open(app_config.DATASET_PATH, 'r', encoding='utf-8') as file:
-            existing_data = json.load(file)
-        # 过滤掉要删除的数据
-        existing_data = [data for data in existing_data if data["eval_id"] != eval_id]
-        with open(app_config.DATASET_PATH, 'w', encoding='utf-8') as file:
-            json.dump(existing_data, file, ensure_ascii=False, indent=4)
-    except (FileNotFoundError, json.JSONDecodeError):
-        pass
+    with _lock:
+        conn = _get_conn()
+        rows = conn.execute(
+            "SELECT seq, data FROM records WHERE eval_id IS ?", (_as_key(eval_id),)).fetchall()
+        seqs = [(seq,) for seq, raw in rows if json.loads(raw).get("eval_id") == eval_id]
+        conn.executemany("DELETE FROM records WHERE seq = ?", seqs)
+        conn.commit()
 
 def get_object_by_id(obj):
     """
-    根据 eval_id 获取 JSON 文件中的数据。
+    根据 eval_id 获取数据集中的数据。
 
-    :param eval_id: 要获取的数据的 eval_id
-    :param file_path: JSON 文件的路径
-    :return: 如果找到匹配的 eval_id，则返回 EvalData 对象，否则返回 None
+    :param obj: 包含 evalId 的字典
+    :return: 如果找到匹配的 eval_id，则返回该条记录，否则返回 None
     """
-    try:
-        with open(app_config.DATASET_PATH, 'r', encoding='utf-8') as file:
-            existing_data = json.load(file)
-            for data_item in existing_data:
-                if data_item.get("eval_id") == obj.get("evalId"):
-                #    print('find',data_item)
-                   return data_item
-        # The following lines seem incorrect in a get function, they should be removed or moved elsewhere if needed.
-        # with open(app_config.DATASET_PATH, 'w', encoding='utf-8') as file:
-        #     json.dump(existing_data, file, ensure_ascii=False, indent=4)
-    except (FileNotFoundError, json.JSONDecodeError):
-        print('ADD_ERROR', FileNotFoundError, json.JSONDecodeError)
-        return None
+    with _lock:
+        _, data_item = _find_first(obj.get("evalId"))
+    return data_item
 
 
 def modify_object(obj):
     """
-    根据 eval_id 修改 JSON 文件中的数据。
+    根据 eval_id 修改数据集中的数据。
 
     :param obj: 包含新数据的 EvalData 对象
     """
-    try:
-        with open(app_config.DATASET_PATH, 'r', encoding='utf-8') as file:
-            existing_data = json.load(file)
-            for index, data_item in enumerate(existing_data):
-                if data_item.get("eval_id") == obj.get('eval_id') and data_item.get("evaluator_evaluation") is None:
-                    existing_data[index]["evaluator_evaluation"] = obj.get("evaluator_evaluation")
-                    existing_data[index]["score"] = obj.get("score")
-                    print('\n update score and evaluatorEvaluation \n')
-                    break
-        with open(app_config.DATASET_PATH, 'w', encoding='utf-8') as file:
-            json.dump(existing_data, file, ensure_ascii=False, indent=4)
-    except (FileNotFoundError, json.JSONDecodeError):
-        print('ADD_ERROR', FileNotFoundError, json.JSONDecodeError)
+    with _lock:
+        seq, data_item = _find_first(
+            obj.get('eval_id'), lambda item: item.get("evaluator_evaluation") is None)
+        if data_item is not None:
+            data_item["evaluator_evaluation"] = obj.get("evaluator_evaluation")
+            data_item["score"] = obj.get("score")
+            _update(seq, data_item)
+            print('\n update score and evaluatorEvaluation \n')
 
 
 def modify_object_with_export(obj):
     """
-    根据 eval_id 修改 JSON 文件中的数据。
+    根据 eval_id 修改数据集中的数据。
 
     :param obj: 包含新数据的 ExportData 对象
     """
-    try:
-        with open(app_config.DATASET_PATH, 'r', encoding='utf-8') as file:
-            existing_data = json.load(file)
-            for index, data_item in enumerate(existing_data):
-                if data_item.get("eval_id") == obj.get('evalId') and data_item.get("evaluatorEvaluation") is None:
-                    existing_data[index]["export_time"] = obj.get("exportTime")
-                    existing_data[index]["console_output"] = obj.get("consoleOutput")
-                    print('\n update export_time and console_output \n')
-                    break
-        with open(app_config.DATASET_PATH, 'w', encoding='utf-8') as file:
-            json.dump(existing_data, file, ensure_ascii=False, indent=4)
-    except (FileNotFoundError, json.JSONDecodeError):
-        print('ADD_ERROR', FileNotFoundError, json.JSONDecodeError)
+    with _lock:
+        seq, data_item = _find_first(
+            obj.get('evalId'), lambda item: item.get("evaluatorEvaluation") is None)
+        if data_item is not None:
+            data_item["export_time"] = obj.get("exportTime")
+            data_item["console_output"] = obj.get("consoleOutput")
+            _update(seq, data_item)
+            print('\n update export_time and console_output \n')
 
 def get_all_data():
+    with _lock:
+        rows = _get_conn().execute("SELECT data FROM records ORDER BY seq").fetchall()
+    return [json.loads(raw) for (raw,) in rows]
+
+
+def _build_filters(generator=None, evaluator=None, workflow=None, eval_time_from=None, eval_time_to=None):
+    """把筛选条件转换为 SQL WHERE 子句（基于 json_extract）"""
+    clauses = []
+    params = []
+    if generator is not None:
+        clauses.append("json_extract(data, '$.generator') = ?")
+        params.append(generator)
+    if evaluator is not None:
+        clauses.append("json_extract(data, '$.evaluator') = ?")
+        params.append(evaluator)
+    for flag, enabled in (workflow or {}).items():
+        # JSON 中的 true/false 经 json_extract 后为 1/0
+        clauses.append("json_extract(data, ?) = ?")
+        params.extend([f'$.workflow."{flag}"', 1 if enabled else 0])
+    if eval_time_from is not None:
+        # eval_time 格式为 "%Y-%m-%d %H:%M:%S"，可直接按字符串比较
+        clauses.append("json_extract(data, '$.eval_time') >= ?")
+        params.append(eval_time_from)
+    if eval_time_to is not None:
+        clauses.append("json_extract(data, '$.eval_time') <= ?")
+        params.append(eval_time_to)
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    return where, params
+
+
+def count_data(**filters):
+    """统计满足筛选条件的记录数（参数同 iter_data）"""
+    where, params = _build_filters(**filters)
+    with _lock:
+        return _get_conn().execute(f"SELECT COUNT(*) FROM records{where}", params).fetchone()[0]
+
+
+def iter_data(offset=0, limit=None, fields=None, batch_size=200, **filters):
+    """
+    按插入顺序逐条返回记录，不一次性加载整个数据集。
+
+    :param offset: 跳过的记录数
+    :param limit: 最多返回的记录数，None 表示不限
+    :param fields: 只返回这些字段（投影），None 表示返回完整记录
+    :param filters: generator, evaluator, workflow({标志: bool}), eval_time_from, eval_time_to
+    """
+    where, params = _build_filters(**filters)
+    sql = f"SELECT data FROM records{where} ORDER BY seq LIMIT ? OFFSET ?"
+    params = params + [-1 if limit is None else int(limit), int(offset or 0)]
+
+    _get_conn()
+    # 使用独立的只读连接，WAL 模式下流式读取期间不阻塞写入
+    conn = sqlite3.connect(app_config.DATASET_DB_PATH)
     try:
-        with open(app_config.DATASET_PATH, 'r', encoding='utf-8') as file:
-            existing_data = json.load(file)
-        return existing_data
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for (raw,) in rows:
+                data_item = json.loads(raw)
+                if fields:
+                    data_item = {f: data_item[f] for f in fields if f in data_item}
+                yield data_item
+    finally:
+        conn.close()
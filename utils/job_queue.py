@@ -0,0 +1,223 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config.app_config import app_config
+
+'''
+进程内后台任务队列
+耗时的生成请求（提示词拓展 + 检索 + 数分钟的 LLM 调用）提交到本地线程池中执行，
+接口立即返回任务 ID，前端通过 /jobs/<id> 轮询状态、已生成的部分输出，或取消任务。
+不依赖外部消息队列；任务状态只保存在内存中，完成的结果由任务函数自行写入数据集。
+
+任务状态: queued -> running -> succeeded / failed / cancelled
+'''
+
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed', 'cancelled')
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    """任务函数在检查到取消请求时抛出"""
+    pass
+
+
+class Job:
+    def __init__(self, job_id, kind=None):
+        self.id = job_id
+        self.kind = kind
+        self.status = 'queued'
+        self.stage = None       # 任务函数自行设置的当前阶段，如 preparing / generating
+        self.info = {}          # 任务函数在执行过程中公开的中间结果（如检索结果）
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self._chunks = []
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._output_length = 0
+        self._cancel_event = threading.Event()
+
+    # --- 供任务函数调用 ---
+
+    def set_stage(self, stage):
+        self.stage = stage
+        self._notify()
+
+    def append_output(self, text):
+        """追加一段部分输出（如 LLM 流式返回的代码片段）"""
+        if text:
+            with self._updated:
+                self._chunks.append(text)
+                self._output_length += len(text)
+                self._updated.notify_all()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """收到取消请求时抛出 JobCancelled，任务函数应在各阶段之间调用"""
+        if self._cancel_event.is_set():
+            raise JobCancelled(self.id)
+
+    # --- 供队列与接口调用 ---
+
+    def _notify(self):
+        with self._updated:
+            self._updated.notify_all()
+
+    def wait_for_update(self, offset, stage, timeout):
+        """
+        阻塞到有 offset 之后的新输出、阶段变化或任务结束（用于 SSE 推送），超时也返回。
+        :return: 是否有更新
+        """
+        with self._updated:
+            return self._updated.wait_for(
+                lambda: self._output_length > offset or self.stage != stage or self.finished, timeout)
+
+    @property
+    def partial_output(self):
+        with self._lock:
+            return "".join(self._chunks)
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self, offset=0, include_result=True):
+        """
+        :param offset: 只返回部分输出中该位置之后的内容（轮询时传入上次的 output_length，避免重复传输）
+        """
+        output = self.partial_output
+        now = self.finished_at or time.time()
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "cancel_requested": self.cancel_requested,
+            "info": self.info,
+            "partial_output": output[offset:] if offset else output,
+            "output_offset": min(offset, len(output)),
+            "output_length": len(output),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_seconds": (self.started_at or now) - self.created_at,
+            "run_seconds": now - self.started_at if self.started_at else None,
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+
+class JobQueue:
+    def __init__(self, max_workers=4, max_finished=200):
+        """
+        :param max_workers: 同时执行的任务数
+        :param max_finished: 内存中保留的已结束任务数，超出后丢弃最早结束的任务
+        """
+        self.max_workers = max_workers
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, job_id, kind=None):
+        """
+        提交任务。fn(job) 在工作线程中执行，返回值作为任务结果。
+        :return: Job
+        """
+        job = Job(job_id, kind)
+        with self._lock:
+            if job_id in self._jobs and not self._jobs[job_id].finished:
+                raise ValueError(f"任务已存在: {job_id}")
+            self._jobs[job_id] = job
+        job.future = self._executor.submit(self._run, job, fn)
+        print(f"[JobQueue] 已提交任务 {job_id}（{kind}），排队中 {self.count('queued')} 个")
+        return job
+
+    def _run(self, job, fn):
+        if job.cancel_requested:
+            self._finish(job, 'cancelled')
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = fn(job)
+            # 任务函数正常返回说明结果已完整产生（取消请求来得太晚），按成功处理
+            self._finish(job, 'succeeded')
+        except JobCancelled:
+            self._finish(job, 'cancelled')
+        except Exception as e:
+            print(f"[JobQueue] 任务 {job.id} 失败: {e}")
+            job.error = str(e)
+            self._finish(job, 'failed')
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        job._notify()
+        print(f"[JobQueue] 任务 {job.id} 结束: {status}")
+        self._prune()
+
+    def _prune(self):
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.finished]
+            if len(finished) <= self.max_finished:
+                return
+            finished.sort(key=lambda job: job.finished_at)
+            for job in finished[:len(finished) - self.max_finished]:
+                del self._jobs[job.id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        请求取消任务：排队中的任务直接取消，执行中的任务在下一次 check_cancelled 时停止。
+        :return: Job，任务不存在时返回 None
+        """
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        job._cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            self._finish(job, 'cancelled')
+        return job
+
+    def count(self, status):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == status)
+
+    def stats(self):
+        with self._lock:
+            counts = {status: 0 for status in JOB_STATUSES}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return {"workers": self.max_workers, "jobs": counts}
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """进程内共享的任务队列"""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue(
+                    max_workers=app_config.JOB_QUEUE_WORKERS,
+                    max_finished=app_config.JOB_QUEUE_MAX_FINISHED)
+    return _job_queue